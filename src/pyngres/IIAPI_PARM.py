@@ -38,17 +38,42 @@ else:
     IIAPI_DEV_MODE = False
 
 
-class IIAPI(C.Structure):
+class _IIAPI_TYPE(type(C.Structure)):
+    '''the metaclass of the OpenAPI structures'''
+
+    ##  ctypes only creates the field descriptors of a structure after
+    ##  __init_subclass__() has run, so the names are worked out here, once
+    ##  the class is complete
+
+    def __init__(cls, name, bases, namespace, **kwargs):
+        super().__init__(name, bases, namespace, **kwargs)
+        ##  a subclass that doesn't declare _fields_ inherits everything
+        fields = namespace.get('_fields_')
+        if not fields:
+            return
+        prefix = fields[0][0][0:2]
+        cls._prefix = prefix
+        cls._field_names = frozenset(name for name, type in fields)
+        cls._suffix_names = {
+            name[len(prefix) + 1:]: name for name, type in fields
+            if name.startswith(prefix + '_')}
+        ##  _genParm etc. are the field descriptors themselves, under a
+        ##  second name, so reading one costs what reading the field does
+        for suffix in ('genParm', 'connHandle', 'tranHandle', 'stmtHandle'):
+            name = cls._suffix_names.get(suffix)
+            setattr(cls, '_' + suffix, cls.__dict__[name] if name else None)
+
+
+class IIAPI(C.Structure, metaclass=_IIAPI_TYPE):
     '''structures for the Ingres OpenAPI'''
 
     if IIAPI_DEV_MODE:
         ##  this checking is only useful during development
         def __setattr__(self, name, value):
             '''prevent undeclared attributes from being set'''
-            names = [name for name, type in self._fields_]
-            if name not in names:
+            if name not in self._field_names:
                 struct_name = self.__class__.__name__
-                diagnostic = '{struct_name} object has no attribute "{name}"'
+                diagnostic = f'{struct_name} object has no attribute "{name}"'
                 raise AttributeError(diagnostic)
             super().__setattr__(name, value)
 
@@ -58,52 +83,54 @@ class IIAPI(C.Structure):
     ##  all the OpenAPI structure member names have a structure-specific
     ##  prefix (e.g. co_genParm, qy_genparm, etc). The following methods
     ##  facilitate access when the prefix is not known, using only the
-    ##  suffix (e.g. genParm)
+    ##  suffix (e.g. genParm). The names are worked out once per structure,
+    ##  when its class is defined, because genParm() etc. are called for
+    ##  every OpenAPI call; in the hottest loops pcb._genParm etc. read the
+    ##  field without the cost of a call
+
+    _prefix = None
+    _field_names = frozenset()
+    _suffix_names = {}
+    _genParm = _connHandle = _tranHandle = _stmtHandle = None
+
 
     def _field_name_prefix(self):
         '''return the field name prefix used in the structure'''
 
-        prefix = None
-        field = self._fields_[0]
-        name = field[0]
-        prefix = name[0:2]
-        return prefix
+        return self._prefix
 
 
     def field_by_suffix(self,suffix):
         '''get a structure field using only its name-suffix'''
 
-        prefix = self._field_name_prefix()
-        full_name = prefix + '_' + suffix
-        try:
-            field = getattr(self,full_name)
-        except AttributeError:
-            field = None
-        return field
+        full_name = self._suffix_names.get(suffix)
+        if full_name is None:
+            return None
+        return getattr(self,full_name)
 
 
     def genParm(self):
         '''return the genParm field (if any)'''
 
-        return self.field_by_suffix('genParm')
+        return self._genParm
 
 
     def connHandle(self):
         '''return the connHandle field (if any)'''
 
-        return self.field_by_suffix('connHandle')
+        return self._connHandle
 
 
     def tranHandle(self):
         '''return the tranHandle field (if any)'''
 
-        return self.field_by_suffix('tranHandle')
+        return self._tranHandle
 
 
     def stmtHandle(self):
         '''return the stmtHandle field (if any)'''
 
-        return self.field_by_suffix('stmtHandle')
+        return self._stmtHandle
 
 
     def __repr__(self):
@@ -0,0 +1,155 @@
+##  Copyright (c) 2024 Rational Commerce Ltd.
+
+'''
+reuse RowSets and Parameters instead of allocating them for each statement
+
+A RowSet owns a copy of the IIAPI_DESCRIPTORs, an IIAPI_DATAVALUE array
+and a value buffer, and Parameters own the same for query parameters;
+allocating them is most of the Python cost of a short query. An Arena keeps
+the ones released to it, keyed by their shape, and hands them out again
+for the next result (or set of parameters) of the same shape:
+
+    rowset = arena.rowset( gdp )
+    ...fetch with rowset.gcp...
+    arena.release( rowset )
+
+pyngres.blocking.fetch() and pyngres.asyncio.fetch() take their RowSets
+from the shared Arena (and release them when the result is exhausted), as
+executemany() does its Parameters, so a loop executing the same queries
+allocates no new ctypes objects for them once it has warmed up; stats()
+counts the allocations and reuses.
+'''
+
+
+import collections
+import ctypes as C
+import os
+import threading
+from .IIAPI_CONSTANTS import *
+from .IIAPI_PARM import *
+from .parameters import Parameters
+from .rowset import RowSet, shape, row_count
+
+
+##  the most memory (in bytes) kept in released buffers by an Arena
+IIAPI_ARENA_SIZE = int(os.environ.get('IIAPI_ARENA_SIZE', 64 << 20))
+
+
+def _size( item ):
+    ##  the bytes of buffers an item owns
+    if isinstance(item, RowSet):
+        return item.rowCount * (item.width
+            + item.columnCount * C.sizeof(IIAPI_DATAVALUE))
+    return item.size + item.count * (C.sizeof(IIAPI_DESCRIPTOR)
+        + C.sizeof(IIAPI_DATAVALUE))
+
+
+def _key( item ):
+    if isinstance(item, RowSet):
+        return ('rowset', item.shape, item.rowCount)
+    return ('parameters', item.count, item.columnType)
+
+
+class Arena(object):
+    '''released RowSets and Parameters, kept for reuse by their shape'''
+
+    def __init__( self, size=None ):
+        self.size = size or IIAPI_ARENA_SIZE
+        self._lock = threading.Lock()
+        ##  the released items of each key, least recently released first
+        self.free = collections.OrderedDict()
+        self.held = 0
+        self.allocations = collections.Counter()
+        self.reuses = collections.Counter()
+        self.discards = 0
+
+
+    def _take( self, key ):
+        with self._lock:
+            items = self.free.get( key )
+            if not items:
+                return None
+            item = items.pop()
+            if not items:
+                del self.free[key]
+            self.held -= _size( item )
+            self.reuses[key[0]] += 1
+            return item
+
+
+    def rowset( self, gdp, rowCount=None, size=None, expected=None ):
+        '''return a RowSet for the result described by gdp'''
+
+        count = gdp.gd_descriptorCount
+        columns = shape( gdp.gd_descriptor, count )
+        rowset = self._take( ('rowset', columns,
+            row_count(columns, rowCount, size, expected)) )
+        if rowset is None:
+            with self._lock:
+                self.allocations['rowset'] += 1
+            return RowSet( gdp, rowCount, size, expected )
+        ##  reuse() checks the RowSet matches() the result
+        rowset.reuse( gdp )
+        return rowset
+
+
+    def parameters( self, count, columnType=IIAPI_COL_QPARM ):
+        '''return Parameters for count values'''
+
+        parameters = self._take( ('parameters', count, columnType) )
+        if parameters is None:
+            with self._lock:
+                self.allocations['parameters'] += 1
+            return Parameters( count, columnType )
+        return parameters
+
+
+    def release( self, item ):
+        '''keep a RowSet or Parameters (no longer used) for reuse'''
+
+        key = _key( item )
+        ##  an item released twice would be handed out twice
+        with self._lock:
+            if any(free is item for free in self.free.get( key, () )):
+                raise ValueError( 'the item has already been released' )
+        ##  the views() of a RowSet are released first; if some are still
+        ##  exported, BufferError is raised and the RowSet isn't reused
+        if isinstance(item, RowSet):
+            item.expire()
+        size = _size( item )
+        with self._lock:
+            self.free.setdefault( key, [] ).append( item )
+            self.free.move_to_end( key )
+            self.held += size
+            ##  drop the least recently released when over the limit
+            while self.held > self.size:
+                oldest, items = next(iter(self.free.items()))
+                self.held -= _size( items.pop(0) )
+                self.discards += 1
+                if not items:
+                    del self.free[oldest]
+
+
+    def clear( self ):
+        '''drop every released item'''
+
+        with self._lock:
+            self.free.clear()
+            self.held = 0
+
+
+    def stats( self ):
+        '''return the allocation and reuse counts, and the memory held'''
+
+        with self._lock:
+            return dict(
+                allocations=dict(self.allocations),
+                reuses=dict(self.reuses),
+                discards=self.discards,
+                free=sum(len(items) for items in self.free.values()),
+                held=self.held,
+            )
+
+
+##  the Arena used by fetch() and executemany()
+shared = Arena()
@@ -0,0 +1,367 @@
+##  Copyright (c) 2024 Rational Commerce Ltd.
+
+'''
+decode fetched columns into NumPy arrays
+
+The fixed-width columns of a RowSet (IIAPI_INT_TYPE, IIAPI_FLT_TYPE,
+IIAPI_BOOL_TYPE, and IIAPI_MNY_TYPE) are exposed as strided views of its
+value buffer, with a null mask taken from the dv_null members of its
+IIAPI_DATAVALUE array, so no Python object is created per value.
+
+    for values, nulls in collect( pyngres.blocking.fetch(stmtHandle) ):
+        ...
+
+With scaled=True, IIAPI_DEC_TYPE and IIAPI_MNY_TYPE columns are decoded
+(from packed decimal, and from cents) into int64 arrays of their values
+scaled by 10**ds_scale (by 100 for money), so they can be summed exactly.
+pack_decimals() does the reverse, for parameters: packed_decimals( values,
+precision, scale ) gives a PackedDecimal for each value, which
+executemany() (say) sends without converting it again.
+
+With temporal=True, the date, time, timestamp, and interval columns are
+decoded from their binary layouts into datetime64 and timedelta64 arrays
+(NaT for NULL), without formatting each value as text and parsing it:
+
+    IIAPI_DATE_TYPE                     datetime64[D]
+    IIAPI_TS/TSWO/TSTZ_TYPE             datetime64[ns]
+    IIAPI_DTE_TYPE                      datetime64[ms]
+    IIAPI_TIME/TMWO/TMTZ_TYPE           timedelta64[ns] since midnight
+    IIAPI_INTDS_TYPE                    timedelta64[ns]
+    IIAPI_INTYM_TYPE                    timedelta64[M]
+
+Times and timestamps with a time zone are in UTC. An IIAPI_DTE_TYPE column
+holding intervals can't be decoded this way.
+
+With unicode=True, IIAPI_NCHA_TYPE and IIAPI_NVCH_TYPE columns are decoded
+into object arrays of str a batch at a time: utf16() gathers the UTF-16
+code units of every value (after its length, for IIAPI_NVCH_TYPE) into one
+array, which is decoded by a single call and then sliced, rather than
+copying each value out of the buffer and decoding it by itself.
+
+Requires NumPy (pip install pyngres[numpy]).
+'''
+
+
+import ctypes as C
+try:
+    import numpy as np
+except ImportError as exception:
+    raise ImportError('pyngres.arrays requires NumPy '
+        '(pip install pyngres[numpy])') from exception
+from .IIAPI_CONSTANTS import *
+from .IIAPI_PARM import IIAPI_DATAVALUE
+from . import datatypes
+from .parameters import PackedDecimal
+
+
+##  the NumPy dtype of each fixed-width (type, length)
+DTYPES = {
+    (IIAPI_INT_TYPE, 1): np.dtype(np.int8),
+    (IIAPI_INT_TYPE, 2): np.dtype(np.int16),
+    (IIAPI_INT_TYPE, 4): np.dtype(np.int32),
+    (IIAPI_INT_TYPE, 8): np.dtype(np.int64),
+    (IIAPI_FLT_TYPE, 4): np.dtype(np.float32),
+    (IIAPI_FLT_TYPE, 8): np.dtype(np.float64),
+    (IIAPI_BOOL_TYPE, 1): np.dtype(np.bool_),
+    (IIAPI_MNY_TYPE, 8): np.dtype(np.float64),
+}
+
+
+def dtype( descriptor ):
+    '''return the NumPy dtype of a column (None if it isn't fixed-width)'''
+
+    return DTYPES.get( (descriptor.ds_dataType, descriptor.ds_length) )
+
+
+def nulls( rowset, rows ):
+    '''return the dv_null members as a (rows, columns) boolean array'''
+
+    ##  NumPy can't take the IIAPI_DATAVALUE array itself (it doesn't know
+    ##  the pointer member), so view it as bytes
+    columnData = rowset.columnData
+    raw = (C.c_byte * C.sizeof(columnData)).from_buffer( columnData )
+    size = C.sizeof(IIAPI_DATAVALUE)
+    count = rowset.columnCount
+    nulls = np.ndarray( (rows, count), dtype=np.intc, buffer=raw,
+        offset=IIAPI_DATAVALUE.dv_null.offset, strides=(count * size, size) )
+    return nulls != 0
+
+
+##  an int64 holds any 18 digits
+SCALED_MAX_PRECISION = 18
+
+
+def _precision( precision ):
+    if precision > SCALED_MAX_PRECISION:
+        raise ValueError(f'DECIMAL({precision}) doesn\'t fit in an int64')
+
+
+def unpack_decimals( data, precision ):
+    '''decode a (rows, length) uint8 array of IIAPI_DEC_TYPE values into
+    an int64 array of the values scaled by 10**scale'''
+
+    _precision( precision )
+    ##  one digit per nibble, the sign in the last one; only the last
+    ##  precision digits can be other than 0
+    nibbles = np.empty( (data.shape[0], data.shape[1] * 2), dtype=np.int64 )
+    nibbles[:, 0::2] = data >> 4
+    nibbles[:, 1::2] = data & 0x0f
+    digits = nibbles[:, -1 - precision:-1]
+    powers = 10 ** np.arange( precision - 1, -1, -1, dtype=np.int64 )
+    values = digits @ powers
+    sign = nibbles[:, -1]
+    return np.where( (sign == 0x0b) | (sign == 0x0d), -values, values )
+
+
+def pack_decimals( values, precision ):
+    '''encode an array of integers (decimals scaled by 10**scale) as a
+    (rows, length) uint8 array of IIAPI_DEC_TYPE values'''
+
+    _precision( precision )
+    values = np.asarray( values, dtype=np.int64 )
+    magnitude = np.abs( values )
+    if (magnitude >= 10 ** precision).any():
+        raise ValueError(f'a value has more than {precision} digits')
+    ##  an odd number of digits, ahead of the sign
+    width = precision | 1
+    powers = 10 ** np.arange( width - 1, -1, -1, dtype=np.int64 )
+    nibbles = np.empty( (len(values), width + 1), dtype=np.uint8 )
+    nibbles[:, :-1] = (magnitude[:, None] // powers) % 10
+    nibbles[:, -1] = np.where( values < 0, 0x0d, 0x0c )
+    return (nibbles[:, 0::2] << 4) | nibbles[:, 1::2]
+
+
+def packed_decimals( values, precision, scale ):
+    '''return a PackedDecimal parameter for each scaled integer'''
+
+    return [PackedDecimal( raw, precision, scale )
+        for raw in map(bytes, pack_decimals(values, precision))]
+
+
+def _scaled( rowset, c, descriptor ):
+    ##  the int64 values of a DECIMAL or MONEY column, scaled by 10**scale
+    if descriptor.ds_dataType == IIAPI_MNY_TYPE:
+        cents = np.ndarray( (rowset.rowsReturned,), dtype=np.float64,
+            buffer=rowset.buffer, offset=rowset.offsets[c],
+            strides=(rowset.width,) )
+        return np.rint( cents ).astype( np.int64 )
+    data = np.ndarray( (rowset.rowsReturned, descriptor.ds_length),
+        dtype=np.uint8, buffer=rowset.buffer, offset=rowset.offsets[c],
+        strides=(rowset.width, 1) )
+    return unpack_decimals( data, descriptor.ds_precision )
+
+
+def _field( rowset, c, dtype, offset=0 ):
+    '''return a strided view of one fixed-width field of column c'''
+
+    return np.ndarray( (rowset.rowsReturned,), dtype=dtype,
+        buffer=rowset.buffer, offset=rowset.offsets[c] + offset,
+        strides=(rowset.width,) )
+
+
+def days( year, month, day ):
+    '''return datetime64[D] from arrays of year, month, and day'''
+
+    year = year.astype(np.int64) - 1970
+    month = month.astype(np.int64) - 1
+    day = day.astype(np.int64) - 1
+    return ((year.astype('M8[Y]') + month.astype('m8[M]')).astype('M8[D]')
+        + day.astype('m8[D]'))
+
+
+def _nanoseconds( rowset, c, offset ):
+    seconds = _field( rowset, c, np.int32, offset ).astype(np.int64)
+    return seconds * 1000000000 + _field( rowset, c, np.int32, offset + 4 )
+
+
+def ansi_dates( rowset, c, mask ):
+    '''return an IIAPI_DATE_TYPE column as datetime64[D]'''
+
+    ##  AD_ADATE
+    return days( _field(rowset, c, np.int16), _field(rowset, c, np.int8, 2),
+        _field(rowset, c, np.uint8, 3) )
+
+
+def times( rowset, c, mask ):
+    '''return a time column as timedelta64[ns] since midnight'''
+
+    ##  AD_TIME
+    return _nanoseconds( rowset, c, 0 ).astype( 'm8[ns]' )
+
+
+def timestamps( rowset, c, mask ):
+    '''return a timestamp column as datetime64[ns]'''
+
+    ##  AD_TIMESTAMP
+    return (ansi_dates(rowset, c, mask).astype('M8[ns]')
+        + _nanoseconds(rowset, c, 4).astype('m8[ns]'))
+
+
+def ingres_dates( rowset, c, mask ):
+    '''return an IIAPI_DTE_TYPE column as datetime64[ms] (in UTC)'''
+
+    ##  AD_DATENTRNL; the empty date is NaT, intervals can't be mixed in
+    status = _field( rowset, c, np.uint8 )
+    if ((status & datatypes.AD_DN_INTERVAL) != 0)[~mask].any():
+        name = rowset.names[c]
+        name = name.decode(errors='replace') if name else f'col{c + 1}'
+        raise ValueError(f'{name} contains intervals, which can\'t be '
+            'decoded as timestamps')
+    day = ((_field(rowset, c, np.uint8, 1).astype(np.int64) << 16)
+        | _field(rowset, c, np.uint16, 6))
+    values = days( _field(rowset, c, np.int16, 2),
+        _field(rowset, c, np.int16, 4), day ).astype( 'M8[ms]' )
+    milliseconds = np.where( (status & datatypes.AD_DN_TIMESPEC) != 0,
+        _field(rowset, c, np.int32, 8), 0 )
+    values += milliseconds.astype( 'm8[ms]' )
+    values[(status & datatypes.AD_DN_ABSOLUTE) == 0] = 'NaT'
+    return values
+
+
+def intervals( rowset, c, mask ):
+    '''return an interval column as timedelta64'''
+
+    if rowset.descriptors[c].ds_dataType == IIAPI_INTYM_TYPE:
+        ##  AD_INTYM
+        months = (_field(rowset, c, np.int16).astype(np.int64) * 12
+            + _field(rowset, c, np.int8, 2))
+        return months.astype( 'm8[M]' )
+    ##  AD_INTDS
+    seconds = (_field(rowset, c, np.int32).astype(np.int64) * 86400
+        + _field(rowset, c, np.int32, 4))
+    return (seconds * 1000000000
+        + _field(rowset, c, np.int32, 8)).astype( 'm8[ns]' )
+
+
+##  the decoder of each temporal type, taking (rowset, column, NULL mask)
+TEMPORAL = {
+    IIAPI_DATE_TYPE: ansi_dates,
+    IIAPI_TS_TYPE: timestamps,
+    IIAPI_TSWO_TYPE: timestamps,
+    IIAPI_TSTZ_TYPE: timestamps,
+    IIAPI_DTE_TYPE: ingres_dates,
+    IIAPI_TIME_TYPE: times,
+    IIAPI_TMWO_TYPE: times,
+    IIAPI_TMTZ_TYPE: times,
+    IIAPI_INTDS_TYPE: intervals,
+    IIAPI_INTYM_TYPE: intervals,
+}
+
+
+def utf16( rowset, c, mask ):
+    '''return the UTF-16 code units of the values of an IIAPI_NCHA_TYPE or
+    IIAPI_NVCH_TYPE column end to end, and the offset of each value'''
+
+    ##  values[offsets[row]:offsets[row + 1]] are the units of row; a NULL
+    ##  has none
+    rows = rowset.rowsReturned
+    descriptor = rowset.descriptors[c]
+    if descriptor.ds_dataType == IIAPI_NVCH_TYPE:
+        ##  the length is in UTF-16 units
+        lengths = _field( rowset, c, np.uint16 ).astype( np.int64 )
+        start = rowset.offsets[c] + 2
+    else:
+        lengths = np.full( rows, descriptor.ds_length // 2, dtype=np.int64 )
+        start = rowset.offsets[c]
+    lengths[mask] = 0
+    offsets = np.zeros( rows + 1, dtype=np.int64 )
+    np.cumsum( lengths, out=offsets[1:] )
+    ##  every column is aligned, so each value starts on a unit
+    buffer = np.ndarray( (C.sizeof(rowset.buffer) // 2,), dtype='<u2',
+        buffer=rowset.buffer )
+    starts = (np.arange(rows, dtype=np.int64) * rowset.width + start) // 2
+    index = (np.repeat(starts - offsets[:-1], lengths)
+        + np.arange(offsets[-1], dtype=np.int64))
+    return buffer[index], offsets
+
+
+def unicode_strings( rowset, c, mask=None ):
+    '''return an IIAPI_NCHA_TYPE or IIAPI_NVCH_TYPE column as an object
+    array of str (None for NULL)'''
+
+    if mask is None:
+        mask = nulls( rowset, rowset.rowsReturned )[:, c]
+    units, offsets = utf16( rowset, c, mask )
+    text = str( units, 'utf-16-le' )
+    if len(text) != len(units):
+        ##  a surrogate pair is one character, so the second unit of each
+        ##  doesn't move the offset into text
+        low = (units >= 0xdc00) & (units <= 0xdfff)
+        characters = np.zeros( len(units) + 1, dtype=np.int64 )
+        np.cumsum( ~low, out=characters[1:] )
+        offsets = characters[offsets]
+    bounds = offsets.tolist()
+    values = np.empty( rowset.rowsReturned, dtype=object )
+    values[:] = [text[start:end] for start, end in zip(bounds, bounds[1:])]
+    values[mask] = None
+    return values
+
+
+def arrays( rowset, copy=False, scaled=False, temporal=False,
+    unicode=False ):
+    '''return (values, nulls) arrays for each column of the fetched rows'''
+
+    ##  unless copy is True the values of fixed-width columns are views of
+    ##  the RowSet buffer, which is overwritten by the next IIapi_getColumns();
+    ##  other columns are object arrays of raw values (None for NULL), but
+    ##  for DECIMAL and MONEY columns if scaled is True, temporal columns
+    ##  if temporal is True, and NCHAR and NVARCHAR columns if unicode is
+    ##  True
+    rows = rowset.rowsReturned
+    mask = nulls( rowset, rows )
+    columns = []
+    raw = None
+    for c, descriptor in enumerate(rowset.descriptors):
+        columnNulls = mask[:, c]
+        type = dtype( descriptor )
+        if scaled and descriptor.ds_dataType in (IIAPI_DEC_TYPE,
+            IIAPI_MNY_TYPE):
+            values = _scaled( rowset, c, descriptor )
+            values[columnNulls] = 0
+        elif temporal and descriptor.ds_dataType in TEMPORAL:
+            values = TEMPORAL[descriptor.ds_dataType]( rowset, c,
+                columnNulls )
+            values[columnNulls] = 'NaT'
+        elif unicode and descriptor.ds_dataType in (IIAPI_NCHA_TYPE,
+            IIAPI_NVCH_TYPE):
+            values = unicode_strings( rowset, c, columnNulls )
+        elif type is None:
+            if raw is None:
+                raw = rowset.rows()
+            values = np.empty( rows, dtype=object )
+            values[:] = [row[c] for row in raw]
+        else:
+            values = np.ndarray( (rows,), dtype=type, buffer=rowset.buffer,
+                offset=rowset.offsets[c], strides=(rowset.width,) )
+            if descriptor.ds_dataType == IIAPI_MNY_TYPE:
+                ##  money is a double holding the number of cents
+                values = values / 100.0
+            elif copy:
+                values = values.copy()
+        columns.append( (values, columnNulls) )
+    return columns
+
+
+def concatenate( batches ):
+    '''join the arrays() of many batches into one pair per column'''
+
+    batches = list(batches)
+    if not batches:
+        return []
+    return [
+        (np.concatenate([batch[c][0] for batch in batches]),
+            np.concatenate([batch[c][1] for batch in batches]))
+        for c in range(len(batches[0]))]
+
+
+def collect( rowsets, scaled=False, temporal=False, unicode=False ):
+    '''fetch every batch and return (values, nulls) for each column'''
+
+    return concatenate( arrays(rowset, copy=True, scaled=scaled,
+        temporal=temporal, unicode=unicode) for rowset in rowsets )
+
+
+def masked( values, nulls ):
+    '''return the column as a NumPy masked array'''
+
+    return np.ma.MaskedArray( values, mask=nulls )
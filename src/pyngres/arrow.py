@@ -0,0 +1,397 @@
+##  Copyright (c) 2024 Rational Commerce Ltd.
+
+'''
+export fetched rows as Apache Arrow record batches
+
+Each RowSet filled by IIapi_getColumns() becomes one RecordBatch, built
+from the RowSet buffers with NumPy rather than by way of Python tuples.
+reader() streams a whole result set as a RecordBatchReader, holding only
+one batch in memory at a time, so it can be handed straight to pandas,
+Polars, DuckDB, etc.
+
+    reader = pyngres.arrow.reader( qyp.qy_stmtHandle )
+    table = reader.read_all()
+
+Character columns are exported as strings when IIAPI_ENCODING (see
+pyngres.decoders) is UTF-8, and each batch is checked to be valid UTF-8;
+in any other character set they are exported as binary, for the caller to
+decode. DECIMAL columns of up to 18 digits, and MONEY columns, are built
+as decimal128 from their values scaled to int64, without a Python object
+per value. Year-to-month intervals are exported as month_day_nano_interval
+(pyarrow has no type for months alone) and day-to-second intervals as
+duration('ns').
+
+A BatchWriter is a copy_into() sink that writes the rows of a COPY INTO
+straight to a Parquet (or Arrow IPC) file:
+
+    sink = pyngres.arrow.BatchWriter(
+        lambda arrowSchema: pyarrow.parquet.ParquetWriter(path, arrowSchema) )
+    pyngres.blocking.copy_into( connHandle, b'COPY TABLE t () INTO PROGRAM',
+        sink )
+    sink.close()
+
+Requires pyarrow and NumPy (pip install pyngres[arrow]).
+'''
+
+
+import codecs
+try:
+    import numpy as np
+    import pyarrow as pa
+except ImportError as exception:
+    raise ImportError('pyngres.arrow requires pyarrow and NumPy '
+        '(pip install pyngres[arrow])') from exception
+import pyngres.blocking as blocking
+from .IIAPI_CONSTANTS import *
+from . import datatypes
+from . import arrays
+from .arrays import nulls
+from .decoders import IIAPI_ENCODING
+
+
+##  Arrow strings are UTF-8; character columns in any other character set
+##  are exported as binary
+_UTF8 = codecs.lookup( IIAPI_ENCODING ).name == 'utf-8'
+_TEXT = pa.string() if _UTF8 else pa.binary()
+
+
+##  the Arrow type of each column is decided by its descriptor; all the
+##  builders take (rowset, column number, mask of NULLs) and return an Array
+
+
+def _view( rowset, c, dtype, offset=0 ):
+    '''return a strided view of one fixed-width field of column c'''
+
+    return np.ndarray( (rowset.rowsReturned,), dtype=dtype, buffer=rowset.buffer,
+        offset=rowset.offsets[c] + offset, strides=(rowset.width,) )
+
+
+def _bytes( rowset, c, length, offset=0 ):
+    '''return the first length bytes of column c as a (rows, length) view'''
+
+    return np.ndarray( (rowset.rowsReturned, length), dtype=np.uint8,
+        buffer=rowset.buffer, offset=rowset.offsets[c] + offset,
+        strides=(rowset.width, 1) )
+
+
+def _validity( mask ):
+    '''return the Arrow validity bitmap and null count for a NULL mask'''
+
+    count = int(mask.sum())
+    if not count:
+        return None, 0
+    return pa.py_buffer( np.packbits(~mask, bitorder='little') ), count
+
+
+def _numeric( dtype ):
+    def build( rowset, c, mask ):
+        return pa.array( _view(rowset, c, dtype), mask=mask )
+    return build
+
+
+def _binary( type, length, rowset, c, mask ):
+    '''build a string or binary Array from the rows of a fixed-width column'''
+
+    rows = rowset.rowsReturned
+    data = np.ascontiguousarray( _bytes(rowset, c, length) ).reshape(-1)
+    offsets = np.arange( rows + 1, dtype=np.int32 ) * length
+    validity, count = _validity( mask )
+    return pa.Array.from_buffers( type, rows,
+        [validity, pa.py_buffer(offsets), pa.py_buffer(data)], count )
+
+
+def _checked( build ):
+    '''make a builder of strings check that the values are valid UTF-8'''
+
+    def check( rowset, c, mask ):
+        array = build( rowset, c, mask )
+        if array.type == pa.string():
+            try:
+                array.validate( full=True )
+            except pa.ArrowInvalid as exception:
+                raise ValueError(f'{_name(rowset, c)} holds a value that '
+                    f'isn\'t valid UTF-8') from exception
+        return array
+    return check
+
+
+def _fixed( type ):
+    def build( rowset, c, mask ):
+        length = rowset.descriptors[c].ds_length
+        return _binary( type, length, rowset, c, mask )
+    return _checked( build )
+
+
+def _varying( type ):
+    def build( rowset, c, mask ):
+        ##  each value is a two-byte length followed by the data; gather
+        ##  the data of all the rows into one contiguous buffer
+        rows = rowset.rowsReturned
+        lengths = _view( rowset, c, np.uint16 ).astype( np.int64 )
+        lengths[mask] = 0
+        offsets = np.zeros( rows + 1, dtype=np.int64 )
+        np.cumsum( lengths, out=offsets[1:] )
+        starts = (np.arange(rows, dtype=np.int64) * rowset.width
+            + rowset.offsets[c] + 2)
+        index = (np.repeat(starts - offsets[:-1], lengths)
+            + np.arange(offsets[-1], dtype=np.int64))
+        buffer = np.frombuffer( rowset.buffer, dtype=np.uint8 )
+        validity, count = _validity( mask )
+        return pa.Array.from_buffers( type, rows,
+            [validity, pa.py_buffer(offsets.astype(np.int32)),
+                pa.py_buffer(buffer[index])], count )
+    return _checked( build )
+
+
+def _unicode( rowset, c, mask ):
+    '''build a string Array from an IIAPI_NCHA_TYPE or IIAPI_NVCH_TYPE column'''
+
+    ##  Arrow strings are UTF-8: the UTF-16 units of all the rows are
+    ##  decoded and encoded again as one string, and the offset of each
+    ##  value is found from the UTF-8 length of each unit (two for each
+    ##  unit of a surrogate pair)
+    units, offsets = arrays.utf16( rowset, c, mask )
+    data = str( units, 'utf-16-le' ).encode( 'utf-8' )
+    sizes = np.where( units < 0x80, 1, np.where(units < 0x800, 2,
+        np.where((units >= 0xd800) & (units <= 0xdfff), 2, 3)) )
+    lengths = np.zeros( len(units) + 1, dtype=np.int64 )
+    np.cumsum( sizes, out=lengths[1:] )
+    validity, count = _validity( mask )
+    return pa.Array.from_buffers( pa.string(), rowset.rowsReturned,
+        [validity, pa.py_buffer(lengths[offsets].astype(np.int32)),
+            pa.py_buffer(data)], count )
+
+
+def unicode_strings( rowset, c, mask=None ):
+    '''return an IIAPI_NCHA_TYPE or IIAPI_NVCH_TYPE column of the fetched
+    rows as an Arrow StringArray'''
+
+    if mask is None:
+        mask = np.ascontiguousarray( nulls(rowset, rowset.rowsReturned)[:, c] )
+    return _unicode( rowset, c, mask )
+
+
+def _decimal128( type, scaled, mask ):
+    '''build a decimal128 Array from int64 values scaled by 10**scale'''
+
+    ##  a decimal128 is a little-endian 128-bit integer of the scaled
+    ##  value: the int64 and its sign extension
+    values = np.empty( (len(scaled), 2), dtype='<i8' )
+    values[:, 0] = scaled
+    values[:, 1] = scaled >> 63
+    validity, count = _validity( mask )
+    return pa.Array.from_buffers( type, len(scaled),
+        [validity, pa.py_buffer(values)], count )
+
+
+def _decimal( rowset, c, mask ):
+    descriptor = rowset.descriptors[c]
+    length = descriptor.ds_length
+    precision = descriptor.ds_precision
+    scale = descriptor.ds_scale
+    if precision <= arrays.SCALED_MAX_PRECISION:
+        scaled = arrays.unpack_decimals( _bytes(rowset, c, length),
+            precision )
+        return _decimal128( _decimal_type(descriptor), scaled, mask )
+    data = _bytes( rowset, c, length ).tobytes()
+    values = [None if mask[row] else datatypes.decimal_value(
+        data[row * length:(row + 1) * length], precision, scale)
+        for row in range(rowset.rowsReturned)]
+    return pa.array( values, type=_decimal_type(descriptor) )
+
+
+def _decimal_type( descriptor ):
+    if descriptor.ds_precision > 38:
+        return pa.decimal256( descriptor.ds_precision, descriptor.ds_scale )
+    return pa.decimal128( descriptor.ds_precision, descriptor.ds_scale )
+
+
+##  MONEY holds 14 digits, two of them after the point
+_MONEY_PRECISION = 14
+
+def _money_type( descriptor ):
+    return pa.decimal128( descriptor.ds_precision or _MONEY_PRECISION, 2 )
+
+
+def _money( rowset, c, mask ):
+    ##  money is a double holding the number of cents
+    cents = np.rint( _view(rowset, c, '=f8') ).astype( np.int64 )
+    return _decimal128( _money_type(rowset.descriptors[c]), cents, mask )
+
+
+def _ansi_date( rowset, c, mask ):
+    return pa.array( arrays.ansi_dates(rowset, c, mask), type=pa.date32(),
+        mask=mask )
+
+
+def _time( rowset, c, mask ):
+    return pa.array( arrays.times(rowset, c, mask).view(np.int64),
+        type=pa.time64('ns'), mask=mask )
+
+
+def _timestamp( type ):
+    def build( rowset, c, mask ):
+        return pa.array( arrays.timestamps(rowset, c, mask), type=type,
+            mask=mask )
+    return build
+
+
+def _months( rowset, c, mask ):
+    ##  a month_day_nano_interval is (int32 months, int32 days, int64
+    ##  nanoseconds); only the months are set
+    months = arrays.intervals( rowset, c, mask ).astype( np.int64 )
+    values = np.zeros( len(months), dtype=[('months', '<i4'),
+        ('days', '<i4'), ('nanoseconds', '<i8')] )
+    values['months'] = months
+    validity, count = _validity( mask )
+    return pa.Array.from_buffers( pa.month_day_nano_interval(), len(months),
+        [validity, pa.py_buffer(values)], count )
+
+
+def _duration( rowset, c, mask ):
+    return pa.array( arrays.intervals(rowset, c, mask), type=pa.duration('ns'),
+        mask=mask )
+
+
+def _ingres_date( rowset, c, mask ):
+    ##  the empty date is NULL
+    values = arrays.ingres_dates( rowset, c, mask )
+    return pa.array( values, type=pa.timestamp('ms', tz='UTC'),
+        mask=mask | np.isnat(values) )
+
+
+##  times and timestamps with a time zone are kept in UTC; Arrow has one
+##  time zone per column, so their individual time zones are dropped
+_UTC = pa.timestamp('ns', tz='UTC')
+
+TYPES = {
+    IIAPI_INT_TYPE: lambda d: {1: pa.int8(), 2: pa.int16(), 4: pa.int32(),
+        8: pa.int64()}[d.ds_length],
+    IIAPI_FLT_TYPE: lambda d: {4: pa.float32(), 8: pa.float64()}[d.ds_length],
+    IIAPI_MNY_TYPE: _money_type,
+    IIAPI_BOOL_TYPE: lambda d: pa.bool_(),
+    IIAPI_DEC_TYPE: _decimal_type,
+    IIAPI_CHA_TYPE: lambda d: _TEXT,
+    IIAPI_CHR_TYPE: lambda d: _TEXT,
+    IIAPI_VCH_TYPE: lambda d: _TEXT,
+    IIAPI_TXT_TYPE: lambda d: _TEXT,
+    IIAPI_LTXT_TYPE: lambda d: _TEXT,
+    IIAPI_NCHA_TYPE: lambda d: pa.string(),
+    IIAPI_NVCH_TYPE: lambda d: pa.string(),
+    IIAPI_BYTE_TYPE: lambda d: pa.binary(),
+    IIAPI_VBYTE_TYPE: lambda d: pa.binary(),
+    IIAPI_DTE_TYPE: lambda d: pa.timestamp('ms', tz='UTC'),
+    IIAPI_DATE_TYPE: lambda d: pa.date32(),
+    IIAPI_TIME_TYPE: lambda d: pa.time64('ns'),
+    IIAPI_TMWO_TYPE: lambda d: pa.time64('ns'),
+    IIAPI_TMTZ_TYPE: lambda d: pa.time64('ns'),
+    IIAPI_TS_TYPE: lambda d: _UTC,
+    IIAPI_TSWO_TYPE: lambda d: pa.timestamp('ns'),
+    IIAPI_TSTZ_TYPE: lambda d: _UTC,
+    IIAPI_INTYM_TYPE: lambda d: pa.month_day_nano_interval(),
+    IIAPI_INTDS_TYPE: lambda d: pa.duration('ns'),
+}
+
+BUILDERS = {
+    IIAPI_INT_TYPE: lambda d: _numeric( f'=i{d.ds_length}' ),
+    IIAPI_FLT_TYPE: lambda d: _numeric( f'=f{d.ds_length}' ),
+    IIAPI_MNY_TYPE: lambda d: _money,
+    IIAPI_BOOL_TYPE: lambda d: _numeric( np.bool_ ),
+    IIAPI_DEC_TYPE: lambda d: _decimal,
+    IIAPI_CHA_TYPE: lambda d: _fixed( _TEXT ),
+    IIAPI_CHR_TYPE: lambda d: _fixed( _TEXT ),
+    IIAPI_VCH_TYPE: lambda d: _varying( _TEXT ),
+    IIAPI_TXT_TYPE: lambda d: _varying( _TEXT ),
+    IIAPI_LTXT_TYPE: lambda d: _varying( _TEXT ),
+    IIAPI_NCHA_TYPE: lambda d: _unicode,
+    IIAPI_NVCH_TYPE: lambda d: _unicode,
+    IIAPI_BYTE_TYPE: lambda d: _fixed( pa.binary() ),
+    IIAPI_VBYTE_TYPE: lambda d: _varying( pa.binary() ),
+    IIAPI_DTE_TYPE: lambda d: _ingres_date,
+    IIAPI_DATE_TYPE: lambda d: _ansi_date,
+    IIAPI_TIME_TYPE: lambda d: _time,
+    IIAPI_TMWO_TYPE: lambda d: _time,
+    IIAPI_TMTZ_TYPE: lambda d: _time,
+    IIAPI_TS_TYPE: lambda d: _timestamp( _UTC ),
+    IIAPI_TSWO_TYPE: lambda d: _timestamp( pa.timestamp('ns') ),
+    IIAPI_TSTZ_TYPE: lambda d: _timestamp( _UTC ),
+    IIAPI_INTYM_TYPE: lambda d: _months,
+    IIAPI_INTDS_TYPE: lambda d: _duration,
+}
+
+
+def _name( rowset, c ):
+    name = rowset.names[c]
+    return name.decode(errors='replace') if name else f'col{c + 1}'
+
+
+def arrow_type( descriptor ):
+    '''return the Arrow type of a column; other types are exported as binary'''
+
+    type = TYPES.get( descriptor.ds_dataType )
+    return type( descriptor ) if type else pa.binary()
+
+
+def schema( rowset ):
+    '''return the Arrow schema of the RowSet'''
+
+    return pa.schema( [pa.field(_name(rowset, c), arrow_type(descriptor),
+        nullable=bool(descriptor.ds_nullable))
+        for c, descriptor in enumerate(rowset.descriptors)] )
+
+
+def _builder( descriptor ):
+    builder = BUILDERS.get( descriptor.ds_dataType )
+    return builder( descriptor ) if builder else _fixed( pa.binary() )
+
+
+def record_batch( rowset, arrowSchema=None ):
+    '''return the rows fetched into the RowSet as an Arrow RecordBatch'''
+
+    if arrowSchema is None:
+        arrowSchema = schema( rowset )
+    mask = nulls( rowset, rowset.rowsReturned )
+    columns = [
+        _builder(descriptor)( rowset, c, np.ascontiguousarray(mask[:, c]) )
+        for c, descriptor in enumerate(rowset.descriptors)]
+    return pa.RecordBatch.from_arrays( columns, schema=arrowSchema )
+
+
+def reader( stmtHandle, rowCount=None, size=None, wait=None ):
+    '''stream the result of a statement as an Arrow RecordBatchReader'''
+
+    ##  uses pyngres.blocking; in an asyncio application build the
+    ##  record_batch() of each RowSet from pyngres.asyncio.fetch() instead
+    rowset = blocking.describe( stmtHandle, rowCount, size, wait=wait )
+    if rowset is None:
+        return pa.RecordBatchReader.from_batches( pa.schema([]), [] )
+    arrowSchema = schema( rowset )
+    batches = (record_batch(batch, arrowSchema)
+        for batch in blocking.batches(rowset, wait=wait))
+    return pa.RecordBatchReader.from_batches( arrowSchema, batches )
+
+
+class BatchWriter(object):
+    '''a copy_into() sink writing each RowSet as a RecordBatch
+
+    writer is anything with a write_batch() method, e.g. a
+    pyarrow.parquet.ParquetWriter or a pyarrow.ipc.RecordBatchFileWriter;
+    open() is called with the Arrow schema of the first RowSet to create
+    it, and the caller closes it when the COPY is done.'''
+
+    def __init__( self, open ):
+        self.open = open
+        self.writer = None
+        self.arrowSchema = None
+
+
+    def __call__( self, rowset ):
+        if self.writer is None:
+            self.arrowSchema = schema( rowset )
+            self.writer = self.open( self.arrowSchema )
+        self.writer.write_batch( record_batch(rowset, self.arrowSchema) )
+
+
+    def close( self ):
+        if self.writer is not None:
+            self.writer.close()
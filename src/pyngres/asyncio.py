@@ -5,12 +5,22 @@ non-blocking Python asyncio-aware Actian Vector/X/Ingres OpenAPI
 '''
 
 
+import os
 from functools import wraps
 from loguru import logger
 import asyncio
+import weakref
 import pyngres as py
+from . import arena as _arena
+from . import driver
 from .IIAPI_CONSTANTS import *
 from .IIAPI_PARM import *
+from . import bulk
+from . import copy
+from . import prepared
+from . import repeat
+from .errors import OpenAPIError, check
+from .rowset import RowSet
 ##  the following functions are synchronous and not awaitable; we just
 ##  import them into the pyngres.asyncio namespace
 from pyngres import ( IIapi_convertData, IIapi_formatData, IIapi_getColumnInfo, 
@@ -36,33 +46,126 @@ else:
     logger.disable(_name)
 
 
-_NOWAIT = py.IIAPI_WAITPARM()
-_NOWAIT.wt_timeout = 1
-
+##  IIAPI_CALLBACK_MODE=ON has the pyngres.driver thread issue and wait for
+##  OpenAPI calls instead of polling the OpenAPI from the event loop; it
+##  can also be changed at run-time
+IIAPI_CALLBACK_MODE = ('IIAPI_CALLBACK_MODE' in os.environ
+    and os.environ['IIAPI_CALLBACK_MODE'] == 'ON')
 
-def _IIapi_yield_to_OpenAPI( future ):
-    py.IIapi_wait( _NOWAIT )
-    future.set_result(True)
-    return future
 
+##  the pump polls the OpenAPI without blocking the event loop; when a poll
+##  completes nothing it sleeps before the next, twice as long each time,
+##  up to IIAPI_POLL_MAX_DELAY milliseconds, so that a long query doesn't
+##  keep the event loop busy
+IIAPI_POLL_MAX_DELAY = float(os.environ.get('IIAPI_POLL_MAX_DELAY', 5.0))
+_POLL_DELAY = 0.0001
 
-async def _IIapi_complete( future ):
-    await asyncio.sleep(0.0)
-    _IIapi_yield_to_OpenAPI( future )
-    await future
+_NOWAIT = py.IIAPI_WAITPARM()
+_NOWAIT.wt_timeout = 0
+
+
+def _IIapi_settle( future, exception ):
+    if future.done():
+        return
+    if exception:
+        future.set_exception( exception )
+    else:
+        future.set_result(True)
+
+
+class _IIapi_pump(object):
+    '''the one task that polls the OpenAPI on behalf of an event loop'''
+
+    ##  each call installs a gp_callback that settles its own future, so
+    ##  one IIapi_wait() per tick completes all the concurrent calls and
+    ##  wakes only the ones that have completed; a new call ends the
+    ##  pump's sleep, so it is polled for at once
+
+    def __init__( self, loop ):
+        self.loop = loop
+        self.inflight = 0
+        self.polled = []
+        self.task = None
+        ##  the sleep before the next poll (in seconds), and the future
+        ##  the pump is sleeping on
+        self.delay = 0.0
+        self.idle = None
+
+
+    def issue( self, IIapi_function, pcb, future ):
+        def finished( exception ):
+            self.inflight -= 1
+            _IIapi_settle( future, exception )
+        completion = driver.Completion( pcb, finished )
+        self.inflight += 1
+        if driver.issue( IIapi_function, pcb, completion ):
+            ##  the application installed its own gp_callback
+            self.polled.append( completion )
+        self.delay = 0.0
+        if self.idle is not None:
+            _IIapi_settle( self.idle, None )
+        if self.inflight and not self.task:
+            self.task = self.loop.create_task( self.run() )
+
+
+    async def sleep( self ):
+        '''wait for the delay to pass, or for a new call to be issued'''
+
+        self.idle = self.loop.create_future()
+        timer = self.loop.call_later( self.delay, _IIapi_settle, self.idle,
+            None )
+        try:
+            await self.idle
+        finally:
+            timer.cancel()
+            self.idle = None
+
+
+    async def run( self ):
+        try:
+            while self.inflight:
+                if self.delay:
+                    await self.sleep()
+                else:
+                    await asyncio.sleep(0.0)
+                inflight = self.inflight
+                py.IIapi_wait( _NOWAIT )
+                if self.polled:
+                    self.polled = driver.poll( self.polled )
+                if self.inflight < inflight:
+                    self.delay = 0.0
+                else:
+                    self.delay = min( max(2 * self.delay, _POLL_DELAY),
+                        IIAPI_POLL_MAX_DELAY / 1000.0 )
+        finally:
+            self.task = None
+
+
+_pumps = weakref.WeakKeyDictionary()
+
+
+def _IIapi_pump_for( loop ):
+    try:
+        return _pumps[loop]
+    except KeyError:
+        pump = _pumps[loop] = _IIapi_pump( loop )
+        return pump
 
 
 def _IIapi_awaitable( IIapi_function ):
     '''make a pyngres function awaitable'''
     @wraps(IIapi_function)
     async def awaitable( pcb ):
-        loop = asyncio.get_event_loop()
-        genParm = pcb.genParm()
-        IIapi_function( pcb )
-        ##  poll for completion of the the OpenAPI
-        while not genParm.gp_completed:
-            future = loop.create_future()
-            await _IIapi_complete( future) 
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        if IIAPI_CALLBACK_MODE:
+            ##  the driver thread issues the call and its callback wakes us
+            notify = lambda exception: loop.call_soon_threadsafe(
+                _IIapi_settle, future, exception )
+            driver.driver().submit( IIapi_function, pcb, notify )
+        else:
+            _IIapi_pump_for( loop ).issue( IIapi_function, pcb, future )
+        await future
     return awaitable
 
 
@@ -213,3 +316,113 @@ def IIapi_xaPrepare(pcb):
 @_IIapi_awaitable
 def IIapi_xaRollback(pcb):
 	py.IIapi_xaRollback( pcb )
+
+
+##  higher-level helpers
+
+
+async def _converse( conversation ):
+    '''make the OpenAPI calls of a conversation; return its result'''
+
+    ##  a conversation yields (function name, parameter block)
+    while True:
+        try:
+            name, pcb = next( conversation )
+        except StopIteration as stop:
+            return stop.value
+        await globals()[name]( pcb )
+
+
+async def describe( stmtHandle, rowCount=None, size=None, arena=None,
+    expected=None ):
+    '''return a RowSet for the result of a statement (None if it has none)'''
+
+    ##  the RowSet comes from the arena, if one is given, and the caller
+    ##  releases it to that arena when done with it; if the number of rows
+    ##  of the result is expected, it holds no more than that
+
+    gdp = IIAPI_GETDESCRPARM()
+    gdp.gd_stmtHandle = stmtHandle
+    await IIapi_getDescriptor( gdp )
+    if check( 'IIapi_getDescriptor', gdp ) == IIAPI_ST_NO_DATA:
+        return None
+    if not gdp.gd_descriptorCount:
+        return None
+    if arena is not None:
+        return arena.rowset( gdp, rowCount, size, expected )
+    return RowSet( gdp, rowCount, size, expected )
+
+
+async def batches( rowset ):
+    '''refill the RowSet with IIapi_getColumns() and yield it until done'''
+
+    ##  the views() of one batch are released before the next is fetched
+    while True:
+        rowset.expire()
+        await IIapi_getColumns( rowset.gcp )
+        status = check( 'IIapi_getColumns', rowset.gcp )
+        if rowset.rowsReturned:
+            yield rowset
+        if status == IIAPI_ST_NO_DATA:
+            break
+
+
+async def fetch( stmtHandle, rowCount=None, size=None, arena=None,
+    expected=None ):
+    '''yield RowSets of the result, fetched many rows per IIapi_getColumns()'''
+
+    ##  the same RowSet is refilled and yielded again, so copy the rows()
+    ##  of one batch before asking for the next; it is released to the
+    ##  arena (by default the shared one) for reuse when the fetch ends
+    arena = arena or _arena.shared
+    rowset = await describe( stmtHandle, rowCount, size, arena, expected )
+    if rowset is None:
+        return
+    try:
+        async for batch in batches( rowset ):
+            yield batch
+    finally:
+        arena.release( rowset )
+
+
+async def executemany( connHandle, queryText, rows, tranHandle=None,
+    batchSize=None, flags=0 ):
+    '''execute queryText for each row of parameters, in IIapi_batch()es'''
+
+    return await _converse( bulk.executemany(connHandle, queryText, rows,
+        tranHandle, batchSize, flags) )
+
+
+async def execute_prepared( cache, queryText, values=(), tranHandle=None,
+    sink=None ):
+    '''execute queryText, prepared once by a PreparedCache'''
+
+    ##  sink is called synchronously, between the awaited OpenAPI calls
+    return await _converse( prepared.execute(cache, queryText, values,
+        tranHandle, sink) )
+
+
+async def execute_repeated( cache, queryText, values=(), tranHandle=None,
+    sink=None ):
+    '''execute queryText, defined once as a repeat query by a RepeatCache'''
+
+    ##  sink is called synchronously, between the awaited OpenAPI calls
+    return await _converse( repeat.execute(cache, queryText, values,
+        tranHandle, sink) )
+
+
+async def copy_from( connHandle, queryText, rows, tranHandle=None,
+    rowCount=None, size=None ):
+    '''load rows with COPY ... FROM PROGRAM, many per IIapi_putColumns()'''
+
+    return await _converse( copy.copy_from(connHandle, queryText, rows,
+        tranHandle, rowCount, size) )
+
+
+async def copy_into( connHandle, queryText, sink, tranHandle=None,
+    rowCount=None, size=None ):
+    '''unload rows with COPY ... INTO PROGRAM, passing each RowSet to sink'''
+
+    ##  sink is called synchronously, between the awaited OpenAPI calls
+    return await _converse( copy.copy_into(connHandle, queryText, sink,
+        tranHandle, rowCount, size) )
@@ -0,0 +1,12 @@
+##  Copyright (c) 2024 Rational Commerce Ltd.
+
+'''
+benchmarks for pyngres
+
+Each benchmark is a module that can be run with python -m, e.g.
+
+    python -m pyngres.bench.threads [vnode::]dbname
+    python -m pyngres.bench.overhead [vnode::]dbname --json results.json
+    python -m pyngres.bench.bulk [vnode::]dbname --rows 10000
+    python -m pyngres.bench.decode [vnode::]dbname --query 'SELECT ...'
+'''
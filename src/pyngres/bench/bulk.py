@@ -0,0 +1,114 @@
+##  Copyright (c) 2024 Rational Commerce Ltd.
+
+'''
+compare the rows per second inserted one at a time, by executemany(), and
+by copy_from()
+
+The single-row path makes an IIapi_query(), IIapi_setDescriptor(),
+IIapi_putParms(), IIapi_getQueryInfo(), and IIapi_close() round-trip for
+every row; executemany() sends the rows in IIapi_batch()es of each of the
+given sizes; copy_from() sends blocks of rows with IIapi_putColumns(). The
+rows are inserted into a session temporary table, which is created first,
+and the transaction is rolled back after each run.
+
+Command syntax:
+    python -m pyngres.bench.bulk [vnode::]dbname[/server_class]
+        [--rows 10000] [--batch 10,100,1000]
+'''
+
+
+import argparse
+import time
+import pyngres.blocking as py
+from pyngres.parameters import Parameters
+from pyngres.bench.threads import initialize, connect, disconnect, execute
+
+
+CREATE = (b'DECLARE GLOBAL TEMPORARY TABLE session.pyngres_bulk '
+    b'(id INTEGER8, name VARCHAR(32), amount FLOAT8) '
+    b'ON COMMIT PRESERVE ROWS WITH NORECOVERY')
+INSERT = b'INSERT INTO session.pyngres_bulk VALUES (~V, ~V, ~V)'
+COPY = b'COPY TABLE session.pyngres_bulk () FROM PROGRAM'
+
+
+def generate( rows ):
+    return [(row, f'row {row}', row * 1.5) for row in range(rows)]
+
+
+def single( connHandle, tranHandle, rows ):
+    '''insert the rows one at a time; return the transaction handle'''
+
+    parameters = Parameters( 3 )
+    qyp = py.IIAPI_QUERYPARM()
+    gqp = py.IIAPI_GETQINFOPARM()
+    clp = py.IIAPI_CLOSEPARM()
+    for row in rows:
+        qyp.qy_connHandle = connHandle
+        qyp.qy_queryType = py.IIAPI_QT_QUERY
+        qyp.qy_queryText = INSERT
+        qyp.qy_parameters = True
+        qyp.qy_tranHandle = tranHandle
+        qyp.qy_stmtHandle = None
+        py.IIapi_query( qyp )
+        py.check( 'IIapi_query', qyp )
+        tranHandle = qyp.qy_tranHandle
+        parameters.set( row )
+        parameters.bind( qyp.qy_stmtHandle )
+        py.IIapi_setDescriptor( parameters.sdp )
+        py.IIapi_putParms( parameters.ppp )
+        gqp.gq_stmtHandle = qyp.qy_stmtHandle
+        py.IIapi_getQueryInfo( gqp )
+        py.check( 'IIapi_getQueryInfo', gqp )
+        clp.cl_stmtHandle = qyp.qy_stmtHandle
+        py.IIapi_close( clp )
+    return tranHandle
+
+
+def rollback( tranHandle ):
+    rbp = py.IIAPI_ROLLBACKPARM()
+    rbp.rb_tranHandle = tranHandle
+    py.IIapi_rollback( rbp )
+
+
+def main( argv=None ):
+    parser = argparse.ArgumentParser( prog='python -m pyngres.bench.bulk',
+        description='single-row inserts versus executemany()' )
+    parser.add_argument( 'target', help='[vnode::]dbname[/server_class]' )
+    parser.add_argument( '--rows', type=int, default=10000 )
+    parser.add_argument( '--batch', default='10,100,1000',
+        help='comma-separated executemany() batch sizes' )
+    args = parser.parse_args( argv )
+
+    rows = generate( args.rows )
+    envHandle = initialize()
+    connHandle = connect( args.target.encode(), envHandle, None )
+    tranHandle = execute( connHandle, None, CREATE, None )
+    ##  the temporary table has to outlive the rollbacks
+    cmp = py.IIAPI_COMMITPARM()
+    cmp.cm_tranHandle = tranHandle
+    py.IIapi_commit( cmp )
+
+    print(f'{"method":<20}{"rows/s":>12}{"speed-up":>10}')
+    start = time.perf_counter()
+    rollback( single(connHandle, None, rows) )
+    baseline = args.rows / (time.perf_counter() - start)
+    print(f'{"single-row":<20}{baseline:>12.1f}{1.0:>9.2f}x')
+    for size in [int(size) for size in args.batch.split(',')]:
+        start = time.perf_counter()
+        results = py.executemany( connHandle, INSERT, rows, batchSize=size )
+        rate = args.rows / (time.perf_counter() - start)
+        rollback( results.tranHandle )
+        if results.failures():
+            raise RuntimeError(f'{len(results.failures())} inserts failed')
+        name = f'executemany({size})'
+        print(f'{name:<20}{rate:>12.1f}{rate / baseline:>9.2f}x')
+    start = time.perf_counter()
+    result = py.copy_from( connHandle, COPY, rows )
+    rate = args.rows / (time.perf_counter() - start)
+    rollback( result.tranHandle )
+    print(f'{"copy_from()":<20}{rate:>12.1f}{rate / baseline:>9.2f}x')
+    disconnect( connHandle, None, None )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+##  Copyright (c) 2024 Rational Commerce Ltd.
+
+'''
+compare decoding fetched rows with pyngres.decoders and with
+IIapi_convertData()
+
+The result of the query is fetched into RowSets, and each batch is decoded
+both ways: by RowSet.values(), and by converting each value to a VARCHAR
+with IIapi_convertData() (reusing one IIAPI_CONVERTPARM) and then parsing
+it with int() or float() as its type requires. Only the decoding is timed,
+not the fetching.
+
+Command syntax:
+    python -m pyngres.bench.decode [vnode::]dbname[/server_class]
+        [--query 'SELECT ...']
+'''
+
+
+import argparse
+import ctypes as C
+import time
+import pyngres.blocking as py
+from pyngres.bench.threads import initialize, connect, disconnect
+
+
+QUERY = b'SELECT * FROM iirelation'
+
+##  the length of the VARCHAR each value is converted to
+_TEXT_LENGTH = 256
+
+
+def _parser( dataType ):
+    if dataType == py.IIAPI_INT_TYPE:
+        return int
+    if dataType in (py.IIAPI_FLT_TYPE, py.IIAPI_MNY_TYPE):
+        return float
+    return lambda text: text
+
+
+def converted( rowset ):
+    '''decode the rows one value at a time with IIapi_convertData()'''
+
+    cvp = py.IIAPI_CONVERTPARM()
+    cvp.cv_dstDesc.ds_dataType = py.IIAPI_VCH_TYPE
+    cvp.cv_dstDesc.ds_nullable = True
+    cvp.cv_dstDesc.ds_length = _TEXT_LENGTH
+    cvp.cv_dstDesc.ds_columnType = py.IIAPI_COL_TUPLE
+    text = C.create_string_buffer( _TEXT_LENGTH )
+    cvp.cv_dstValue.dv_value = C.addressof(text)
+    parsers = [_parser(descriptor.ds_dataType)
+        for descriptor in rowset.descriptors]
+    count = rowset.columnCount
+    rows = []
+    for row in range(rowset.rowsReturned):
+        values = []
+        for c in range(count):
+            datavalue = rowset.columnData[row * count + c]
+            if datavalue.dv_null:
+                values.append( None )
+                continue
+            cvp.cv_srcDesc = rowset.descriptors[c]
+            cvp.cv_srcValue = datavalue
+            cvp.cv_dstValue.dv_length = _TEXT_LENGTH
+            py.IIapi_convertData( cvp )
+            length = int.from_bytes( text.raw[:2], 'little' )
+            values.append( parsers[c](text.raw[2:2 + length].decode()) )
+        rows.append( tuple(values) )
+    return rows
+
+
+def main( argv=None ):
+    parser = argparse.ArgumentParser( prog='python -m pyngres.bench.decode',
+        description='pyngres.decoders versus IIapi_convertData()' )
+    parser.add_argument( 'target', help='[vnode::]dbname[/server_class]' )
+    parser.add_argument( '--query', default=QUERY.decode() )
+    args = parser.parse_args( argv )
+
+    envHandle = initialize()
+    connHandle = connect( args.target.encode(), envHandle, None )
+    qyp = py.IIAPI_QUERYPARM()
+    qyp.qy_connHandle = connHandle
+    qyp.qy_queryType = py.IIAPI_QT_QUERY
+    qyp.qy_queryText = args.query.encode()
+    py.IIapi_query( qyp )
+    py.check( 'IIapi_query', qyp )
+
+    values = 0
+    decoding = converting = 0.0
+    for rowset in py.fetch( qyp.qy_stmtHandle ):
+        values += rowset.rowsReturned * rowset.columnCount
+        start = time.perf_counter()
+        rowset.values()
+        decoding += time.perf_counter() - start
+        start = time.perf_counter()
+        converted( rowset )
+        converting += time.perf_counter() - start
+    clp = py.IIAPI_CLOSEPARM()
+    clp.cl_stmtHandle = qyp.qy_stmtHandle
+    py.IIapi_close( clp )
+    disconnect( connHandle, qyp.qy_tranHandle, None )
+
+    if not values:
+        raise RuntimeError('the query returned no rows')
+    baseline = values / converting
+    rate = values / decoding
+    print(f'{"method":<20}{"values/s":>14}{"speed-up":>10}')
+    print(f'{"IIapi_convertData()":<20}{baseline:>14.1f}{1.0:>9.2f}x')
+    print(f'{"RowSet.values()":<20}{rate:>14.1f}{rate / baseline:>9.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,497 @@
+##  Copyright (c) 2024 Rational Commerce Ltd.
+
+'''
+measure what pyngres, pyngres.blocking, and pyngres.asyncio add to each
+OpenAPI call
+
+The micro-benchmarks time the Python machinery of a single call: the ctypes
+foreign function call itself, the traced() and debugged() wrappers, the
+IIAPI parameter block accessors, and asyncio future handling. The
+macro-benchmarks time complete OpenAPI conversations (connect, query, fetch
+N rows one at a time or in batches, put N parameters) using each of the
+modules in turn.
+
+Run against pyngres.loopback to isolate the Python overhead from the DBMS:
+
+    IIAPI_BACKEND=pyngres.loopback python -m pyngres.bench.overhead loopback
+
+Command syntax:
+    python -m pyngres.bench.overhead [vnode::]dbname[/server_class]
+        [--rows 1000] [--parms 100] [--repeat 5] [--micro-only]
+        [--json results.json] [--compare baseline.json]
+
+Against a real DBMS the --fetch-query should return at least --rows rows.
+'''
+
+
+import argparse
+import asyncio
+import ctypes as C
+import ctypes.util
+import datetime
+import importlib.metadata
+import json
+import platform
+import statistics
+import sys
+import time
+import pyngres as py
+import pyngres.blocking as blocking
+import pyngres.asyncio as aio
+from pyngres.rowset import RowSet
+
+
+##  benchmark results are recorded in seconds per operation
+class Result(object):
+    '''the timings of one benchmark'''
+
+    def __init__( self, name, unit, number, timings ):
+        self.name = name
+        self.unit = unit
+        self.number = number
+        self.best = min(timings)
+        self.median = statistics.median(timings)
+        self.repeat = len(timings)
+
+
+    def asdict( self ):
+        return dict(name=self.name, unit=self.unit, number=self.number,
+            repeat=self.repeat, best=self.best, median=self.median)
+
+
+def measure( function, number, repeat ):
+    '''return the seconds per call of function() for each repetition'''
+
+    timings = []
+    for r in range(repeat):
+        start = time.perf_counter()
+        for n in range(number):
+            function()
+        timings.append( (time.perf_counter() - start) / number )
+    return timings
+
+
+##  micro-benchmarks
+
+def _libc():
+    '''return the C runtime library, for a baseline foreign function call'''
+
+    if sys.platform == 'win32':
+        return C.cdll.msvcrt
+    return C.CDLL( ctypes.util.find_library('c') )
+
+
+def micro( number, repeat ):
+    '''time the per-call machinery of pyngres'''
+
+    results = []
+    def bench( name, function, unit='call' ):
+        timings = measure( function, number, repeat )
+        results.append( Result(f'micro.{name}', unit, number, timings) )
+
+    ##  memset(pcb, 0, 0) touches nothing but is bound exactly the way the
+    ##  OpenAPI functions are, so it prices the ctypes call of a parameter
+    ##  block
+    memset = py.bind_function( _libc(), 'memset', C.c_void_p,
+        [C.POINTER(py.IIAPI_WAITPARM), C.c_int, C.c_size_t] )
+    wtp = py.IIAPI_WAITPARM()
+    wtp.wt_timeout = 0
+    bench( 'ctypes.call', lambda: memset(wtp, 0, 0) )
+
+    traced = py.traced( memset )
+    bench( 'pyngres.traced', lambda: traced(wtp, 0, 0) )
+
+    def call( pcb ):
+        memset( pcb, 0, 0 )
+    debugged = py.debugged( call )
+    bench( 'python.call', lambda: call(wtp) )
+    bench( 'pyngres.debugged', lambda: debugged(wtp) )
+
+    ##  with nothing in flight IIapi_wait() returns at once
+    bench( 'pyngres.IIapi_wait', lambda: py.IIapi_wait(wtp) )
+
+    qyp = py.IIAPI_QUERYPARM()
+    genParm = qyp.qy_genParm
+    bench( 'IIAPI.attribute', lambda: qyp.qy_stmtHandle )
+    bench( 'IIAPI.field_by_suffix', lambda: qyp.field_by_suffix('stmtHandle') )
+    bench( 'IIAPI.genParm', lambda: qyp.genParm() )
+    bench( 'IIAPI.stmtHandle', lambda: qyp.stmtHandle() )
+    bench( 'IIAPI._stmtHandle', lambda: qyp._stmtHandle )
+    bench( 'IIAPI._genParm', lambda: qyp._genParm )
+    bench( 'IIAPI_GENPARM.gp_completed', lambda: genParm.gp_completed )
+
+    async def futures():
+        ##  the future every pyngres.asyncio call creates, settles, and awaits
+        loop = asyncio.get_running_loop()
+        timings = []
+        for r in range(repeat):
+            start = time.perf_counter()
+            for n in range(number):
+                future = loop.create_future()
+                aio._IIapi_settle( future, None )
+                await future
+            timings.append( (time.perf_counter() - start) / number )
+        return timings
+    results.append( Result('micro.asyncio.future', 'call', number,
+        asyncio.run(futures())) )
+
+    return results
+
+
+##  macro-benchmarks: each conversation is a generator yielding the OpenAPI
+##  calls to make as (function name, parameter block), so the same
+##  conversation can be run by each of the modules
+
+class Session(object):
+    '''the connection used by the conversations'''
+
+    def __init__( self, target, envHandle ):
+        self.target = target
+        self.envHandle = envHandle
+        self.connHandle = None
+        self.tranHandle = None
+        self.rows = 0
+
+
+def connect( session ):
+    cop = py.IIAPI_CONNPARM()
+    cop.co_target = session.target
+    cop.co_connHandle = session.envHandle
+    cop.co_type = py.IIAPI_CT_SQL
+    cop.co_timeout = -1
+    yield 'IIapi_connect', cop
+    if cop.co_genParm.gp_status != py.IIAPI_ST_SUCCESS:
+        raise RuntimeError(f'cannot connect to {session.target.decode()}')
+    session.connHandle = cop.co_connHandle
+
+
+def disconnect( session ):
+    if session.tranHandle:
+        rbp = py.IIAPI_ROLLBACKPARM()
+        rbp.rb_tranHandle = session.tranHandle
+        yield 'IIapi_rollback', rbp
+        session.tranHandle = None
+    dcp = py.IIAPI_DISCONNPARM()
+    dcp.dc_connHandle = session.connHandle
+    yield 'IIapi_disconnect', dcp
+    session.connHandle = None
+
+
+def reconnect( session ):
+    '''connect and disconnect a second session'''
+
+    other = Session( session.target, session.envHandle )
+    yield from connect( other )
+    yield from disconnect( other )
+
+
+def _query( session, queryText, parameters=False ):
+    qyp = py.IIAPI_QUERYPARM()
+    qyp.qy_connHandle = session.connHandle
+    qyp.qy_queryType = py.IIAPI_QT_QUERY
+    qyp.qy_queryText = queryText
+    qyp.qy_parameters = parameters
+    qyp.qy_tranHandle = session.tranHandle
+    yield 'IIapi_query', qyp
+    if qyp.qy_genParm.gp_status >= py.IIAPI_ST_ERROR:
+        raise RuntimeError(f'{queryText.decode()} failed')
+    session.tranHandle = qyp.qy_tranHandle
+    return qyp.qy_stmtHandle
+
+
+def _finish( stmtHandle ):
+    gqp = py.IIAPI_GETQINFOPARM()
+    gqp.gq_stmtHandle = stmtHandle
+    yield 'IIapi_getQueryInfo', gqp
+    clp = py.IIAPI_CLOSEPARM()
+    clp.cl_stmtHandle = stmtHandle
+    yield 'IIapi_close', clp
+
+
+def query( session, queryText ):
+    '''execute a query and discard its result'''
+
+    stmtHandle = yield from _query( session, queryText )
+    yield from _finish( stmtHandle )
+
+
+def fetch( session, queryText, rows ):
+    '''fetch up to rows rows, one at a time, the way the examples do'''
+
+    stmtHandle = yield from _query( session, queryText )
+    gdp = py.IIAPI_GETDESCRPARM()
+    gdp.gd_stmtHandle = stmtHandle
+    yield 'IIapi_getDescriptor', gdp
+    count = gdp.gd_descriptorCount
+    columnData = (py.IIAPI_DATAVALUE * count)()
+    buffers = [C.create_string_buffer(gdp.gd_descriptor[i].ds_length)
+        for i in range(count)]
+    for i in range(count):
+        columnData[i].dv_value = C.addressof(buffers[i])
+    gcp = py.IIAPI_GETCOLPARM()
+    gcp.gc_stmtHandle = stmtHandle
+    gcp.gc_rowCount = 1
+    gcp.gc_columnCount = count
+    gcp.gc_columnData = columnData
+    fetched = 0
+    while fetched < rows:
+        yield 'IIapi_getColumns', gcp
+        if gcp.gc_genParm.gp_status >= py.IIAPI_ST_NO_DATA:
+            break
+        fetched += gcp.gc_rowsReturned
+    session.rows += fetched
+    yield from _finish( stmtHandle )
+
+
+def fetch_batched( session, queryText, rows ):
+    '''fetch up to rows rows, as many at a time as fit in a RowSet'''
+
+    stmtHandle = yield from _query( session, queryText )
+    gdp = py.IIAPI_GETDESCRPARM()
+    gdp.gd_stmtHandle = stmtHandle
+    yield 'IIapi_getDescriptor', gdp
+    ##  the RowSet need hold no more than the rows fetched
+    rowset = RowSet( gdp, expected=rows )
+    fetched = 0
+    while fetched < rows:
+        yield 'IIapi_getColumns', rowset.gcp
+        fetched += rowset.rowsReturned
+        if rowset.status >= py.IIAPI_ST_NO_DATA:
+            break
+    session.rows += fetched
+    yield from _finish( stmtHandle )
+
+
+def put( session, parms ):
+    '''send parms integer parameters with one IIapi_putParms()'''
+
+    queryText = ('SELECT ' + ', '.join(['~V'] * parms)).encode()
+    stmtHandle = yield from _query( session, queryText, parameters=True )
+    descriptors = (py.IIAPI_DESCRIPTOR * parms)()
+    parmData = (py.IIAPI_DATAVALUE * parms)()
+    values = (C.c_int * parms)( *range(parms) )
+    for i in range(parms):
+        descriptors[i].ds_dataType = py.IIAPI_INT_TYPE
+        descriptors[i].ds_length = C.sizeof(C.c_int)
+        descriptors[i].ds_columnType = py.IIAPI_COL_QPARM
+        parmData[i].dv_length = C.sizeof(C.c_int)
+        parmData[i].dv_value = C.addressof(values) + i * C.sizeof(C.c_int)
+    sdp = py.IIAPI_SETDESCRPARM()
+    sdp.sd_stmtHandle = stmtHandle
+    sdp.sd_descriptorCount = parms
+    sdp.sd_descriptor = descriptors
+    yield 'IIapi_setDescriptor', sdp
+    ppp = py.IIAPI_PUTPARMPARM()
+    ppp.pp_stmtHandle = stmtHandle
+    ppp.pp_parmCount = parms
+    ppp.pp_parmData = parmData
+    yield 'IIapi_putParms', ppp
+    yield from _finish( stmtHandle )
+
+
+##  the modules are compared by how they run a conversation
+
+_WAIT = py.IIAPI_WAITPARM()
+_WAIT.wt_timeout = -1
+
+
+def run_pyngres( conversation ):
+    '''call pyngres functions followed by an IIapi_wait() loop'''
+
+    for name, pcb in conversation:
+        getattr(py, name)( pcb )
+        genParm = pcb._genParm
+        while not genParm.gp_completed:
+            py.IIapi_wait( _WAIT )
+
+
+def run_blocking( conversation ):
+    for name, pcb in conversation:
+        getattr(blocking, name)( pcb )
+
+
+async def run_asyncio( conversation ):
+    for name, pcb in conversation:
+        await getattr(aio, name)( pcb )
+
+
+MODES = ('pyngres', 'blocking', 'asyncio', 'asyncio-callback')
+
+
+def macro( session, mode, benchmarks, repeat ):
+    '''time the conversations using the given mode'''
+
+    ##  each benchmark is (name, conversation, number, perRow); fetch is
+    ##  measured per row, the rest per conversation
+    def result( name, number, perRow, timings ):
+        ops = (session.rows // repeat if perRow else number) or 1
+        return Result( f'macro.{mode}.{name}',
+            'row' if perRow else 'conversation', ops,
+            [timing / ops for timing in timings] )
+
+    if mode.startswith('asyncio'):
+        aio.IIAPI_CALLBACK_MODE = (mode == 'asyncio-callback')
+
+        async def run_all():
+            await run_asyncio( connect(session) )
+            results = []
+            try:
+                for name, conversation, number, perRow in benchmarks:
+                    session.rows = 0
+                    timings = []
+                    for r in range(repeat):
+                        start = time.perf_counter()
+                        for n in range(number):
+                            await run_asyncio( conversation() )
+                        timings.append( time.perf_counter() - start )
+                    results.append( result(name, number, perRow, timings) )
+            finally:
+                await run_asyncio( disconnect(session) )
+            return results
+        return asyncio.run( run_all() )
+
+    run = run_blocking if mode == 'blocking' else run_pyngres
+    run( connect(session) )
+    results = []
+    try:
+        for name, conversation, number, perRow in benchmarks:
+            session.rows = 0
+            timings = []
+            for r in range(repeat):
+                start = time.perf_counter()
+                for n in range(number):
+                    run( conversation() )
+                timings.append( time.perf_counter() - start )
+            results.append( result(name, number, perRow, timings) )
+    finally:
+        run( disconnect(session) )
+    return results
+
+
+##  reporting
+
+def _duration( seconds ):
+    for unit, scale in (('s', 1.0), ('ms', 1e-3), ('us', 1e-6)):
+        if seconds >= scale:
+            return f'{seconds / scale:.2f} {unit}'
+    return f'{seconds / 1e-9:.1f} ns'
+
+
+def report( results, baseline=None ):
+    '''print a table of the results, compared with a baseline if given'''
+
+    previous = {}
+    if baseline:
+        previous = {result['name']: result for result in baseline['results']}
+    width = max(len(result.name) for result in results)
+    heading = f'{"benchmark":<{width}}  {"per":<12} {"best":>10} {"median":>10}'
+    if previous:
+        heading += f' {"baseline":>10} {"change":>8}'
+    print(heading)
+    for result in results:
+        line = (f'{result.name:<{width}}  {result.unit:<12} '
+            f'{_duration(result.best):>10} {_duration(result.median):>10}')
+        if result.name in previous:
+            before = previous[result.name]['best']
+            line += (f' {_duration(before):>10}'
+                f' {(result.best - before) / before:>+8.1%}')
+        print(line)
+
+
+def document( results, args ):
+    '''return the results as a JSON-serializable dict'''
+
+    try:
+        version = importlib.metadata.version('pyngres')
+    except importlib.metadata.PackageNotFoundError:
+        version = None
+    backend = py.IIAPI_BACKEND or py.api_pathname
+    latency = None
+    if py.IIAPI_BACKEND == 'pyngres.loopback':
+        from pyngres import loopback
+        latency = loopback.settings['latency']
+    return dict(
+        pyngres=version,
+        python=platform.python_version(),
+        implementation=platform.python_implementation(),
+        platform=platform.platform(),
+        backend=backend,
+        latency=latency,
+        timestamp=datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        parameters=dict(rows=args.rows, parms=args.parms,
+            number=args.number, calls=args.calls, repeat=args.repeat),
+        results=[result.asdict() for result in results],
+    )
+
+
+def main( argv=None ):
+    parser = argparse.ArgumentParser( prog='python -m pyngres.bench.overhead',
+        description='per-call overhead of pyngres, pyngres.blocking, '
+            'and pyngres.asyncio' )
+    parser.add_argument( 'target', help='[vnode::]dbname[/server_class]' )
+    parser.add_argument( '--rows', type=int, default=1000,
+        help='rows fetched by the fetch benchmark' )
+    parser.add_argument( '--parms', type=int, default=100,
+        help='parameters sent by the put benchmark' )
+    parser.add_argument( '--number', type=int, default=100000,
+        help='calls timed by each micro-benchmark repetition' )
+    parser.add_argument( '--calls', type=int, default=200,
+        help='conversations timed by each macro-benchmark repetition '
+            '(fetch times one per hundred)' )
+    parser.add_argument( '--repeat', type=int, default=5 )
+    parser.add_argument( '--query', default="SELECT dbmsinfo('username')" )
+    parser.add_argument( '--fetch-query', default='SELECT * FROM iicolumns' )
+    parser.add_argument( '--mode', action='append', choices=MODES,
+        help='the default is all of them' )
+    parser.add_argument( '--micro-only', action='store_true' )
+    parser.add_argument( '--json', metavar='FILE',
+        help='write the results to FILE (- for stdout)' )
+    parser.add_argument( '--compare', metavar='FILE',
+        help='compare with the results previously written to FILE' )
+    args = parser.parse_args( argv )
+
+    if py.IIAPI_BACKEND == 'pyngres.loopback':
+        from pyngres import loopback
+        loopback.configure( rows=args.rows )
+
+    inp = py.IIAPI_INITPARM()
+    inp.in_version = py.IIAPI_VERSION_11
+    inp.in_timeout = -1
+    py.IIapi_initialize( inp )
+
+    results = micro( args.number, args.repeat )
+    if not args.micro_only:
+        session = Session( args.target.encode(), inp.in_envHandle )
+        queryText = args.query.encode()
+        fetchText = args.fetch_query.encode()
+        calls = args.calls
+        benchmarks = [
+            ('connect', lambda: reconnect(session), calls, False),
+            ('query', lambda: query(session, queryText), calls, False),
+            (f'fetch{args.rows}', lambda: fetch(session, fetchText, args.rows),
+                max(1, calls // 100), True),
+            (f'batch{args.rows}',
+                lambda: fetch_batched(session, fetchText, args.rows),
+                max(1, calls // 100), True),
+            (f'put{args.parms}', lambda: put(session, args.parms), calls,
+                False),
+        ]
+        for mode in args.mode or MODES:
+            results += macro( session, mode, benchmarks, args.repeat )
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+    if args.json == '-':
+        json.dump( document(results, args), sys.stdout, indent=2 )
+        print()
+    else:
+        report( results, baseline )
+        if args.json:
+            with open(args.json, 'w') as file:
+                json.dump( document(results, args), file, indent=2 )
+
+
+if __name__ == '__main__':
+    main()
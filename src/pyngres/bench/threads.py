@@ -0,0 +1,154 @@
+##  Copyright (c) 2024 Rational Commerce Ltd.
+
+'''
+measure how pyngres.blocking scales with the number of threads
+
+Each thread opens its own session and then repeatedly executes a query
+(IIapi_query(), IIapi_getQueryInfo(), IIapi_close()) using each of the
+pyngres.blocking wait strategies in turn.
+
+Command syntax:
+    python -m pyngres.bench.threads [vnode::]dbname[/server_class]
+        [--threads 1,2,4,8,16] [--calls 200] [--query 'SELECT ...']
+'''
+
+
+import argparse
+import threading
+import time
+import pyngres.blocking as py
+
+
+STRATEGIES = {
+    'busy': py.BusyWait,
+    'backoff': py.BackoffWait,
+    'event': py.EventWait,
+}
+
+
+def initialize():
+    inp = py.IIAPI_INITPARM()
+    inp.in_version = py.IIAPI_VERSION_11
+    inp.in_timeout = -1
+    py.IIapi_initialize( inp )
+    return inp.in_envHandle
+
+
+def connect( target, envHandle, wait ):
+    cop = py.IIAPI_CONNPARM()
+    cop.co_target = target
+    cop.co_connHandle = envHandle
+    cop.co_type = py.IIAPI_CT_SQL
+    cop.co_timeout = -1
+    py.IIapi_connect( cop, wait=wait )
+    if cop.co_genParm.gp_status != py.IIAPI_ST_SUCCESS:
+        raise RuntimeError(f'cannot connect to {target.decode()}')
+    return cop.co_connHandle
+
+
+def disconnect( connHandle, tranHandle, wait ):
+    if tranHandle:
+        rbp = py.IIAPI_ROLLBACKPARM()
+        rbp.rb_tranHandle = tranHandle
+        py.IIapi_rollback( rbp, wait=wait )
+    dcp = py.IIAPI_DISCONNPARM()
+    dcp.dc_connHandle = connHandle
+    py.IIapi_disconnect( dcp, wait=wait )
+
+
+def execute( connHandle, tranHandle, queryText, wait ):
+    '''execute the query once; return the transaction handle'''
+
+    qyp = py.IIAPI_QUERYPARM()
+    qyp.qy_connHandle = connHandle
+    qyp.qy_queryType = py.IIAPI_QT_QUERY
+    qyp.qy_queryText = queryText
+    qyp.qy_tranHandle = tranHandle
+    py.IIapi_query( qyp, wait=wait )
+    gqp = py.IIAPI_GETQINFOPARM()
+    gqp.gq_stmtHandle = qyp.qy_stmtHandle
+    py.IIapi_getQueryInfo( gqp, wait=wait )
+    clp = py.IIAPI_CLOSEPARM()
+    clp.cl_stmtHandle = qyp.qy_stmtHandle
+    py.IIapi_close( clp, wait=wait )
+    return qyp.qy_tranHandle
+
+
+def run( target, envHandle, queryText, nthreads, calls, wait ):
+    '''return the calls per second achieved by nthreads threads'''
+
+    ready = threading.Barrier( nthreads + 1 )
+    finished = threading.Barrier( nthreads + 1 )
+    failures = []
+
+    ##  a worker that fails breaks both barriers, so that neither the other
+    ##  workers nor the main thread wait for it forever; the main thread
+    ##  then re-raises the first failure
+    def worker():
+        connHandle = tranHandle = None
+        try:
+            connHandle = connect( target, envHandle, wait )
+            ready.wait()
+            for call in range(calls):
+                tranHandle = execute( connHandle, tranHandle, queryText,
+                    wait )
+            finished.wait()
+        except threading.BrokenBarrierError:
+            pass
+        except Exception as exception:
+            failures.append( exception )
+            ready.abort()
+            finished.abort()
+        if connHandle:
+            disconnect( connHandle, tranHandle, wait )
+
+    threads = [threading.Thread(target=worker) for n in range(nthreads)]
+    for thread in threads:
+        thread.start()
+    try:
+        ready.wait()
+        start = time.perf_counter()
+        finished.wait()
+        elapsed = time.perf_counter() - start
+    except threading.BrokenBarrierError:
+        elapsed = None
+    for thread in threads:
+        thread.join()
+    if failures:
+        raise failures[0]
+    return nthreads * calls / elapsed
+
+
+def main( argv=None ):
+    parser = argparse.ArgumentParser( prog='python -m pyngres.bench.threads',
+        description='thread scaling of the pyngres.blocking wait strategies' )
+    parser.add_argument( 'target', help='[vnode::]dbname[/server_class]' )
+    parser.add_argument( '--threads', default='1,2,4,8,16',
+        help='comma-separated thread counts' )
+    parser.add_argument( '--calls', type=int, default=200,
+        help='queries executed by each thread' )
+    parser.add_argument( '--query', default="SELECT dbmsinfo('username')" )
+    parser.add_argument( '--strategy', action='append',
+        choices=sorted(STRATEGIES), help='the default is all of them' )
+    args = parser.parse_args( argv )
+
+    target = args.target.encode()
+    queryText = args.query.encode()
+    counts = [int(count) for count in args.threads.split(',')]
+    strategies = args.strategy or list(STRATEGIES)
+    envHandle = initialize()
+
+    print(f'{"strategy":<10}{"threads":>8}{"queries/s":>12}{"scaling":>9}')
+    for name in strategies:
+        wait = STRATEGIES[name]()
+        baseline = None
+        for nthreads in counts:
+            rate = run( target, envHandle, queryText, nthreads, args.calls,
+                wait )
+            baseline = baseline or rate
+            print(f'{name:<10}{nthreads:>8}{rate:>12.1f}'
+                f'{rate / baseline:>8.2f}x')
+
+
+if __name__ == '__main__':
+    main()
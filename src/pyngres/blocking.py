@@ -6,11 +6,21 @@ Blocking Actian Vector/X/Ingres OpenAPI
 
 
 import os
+import threading
+import time
 from functools import wraps
 from loguru import logger
 import pyngres as py
+from . import arena as _arena
+from . import driver
 from .IIAPI_CONSTANTS import *
 from .IIAPI_PARM import *
+from . import bulk
+from . import copy
+from . import prepared
+from . import repeat
+from .errors import OpenAPIError, check
+from .rowset import RowSet
 ##  the following functions are fundamentally synchronous; we just
 ##  import them into the pyngres.syncio namespace
 from pyngres import ( IIapi_convertData, IIapi_formatData, IIapi_getColumnInfo, 
@@ -33,19 +43,115 @@ else:
     logger.disable(_name)
 
 
-_NOWAIT = py.IIAPI_WAITPARM()
-_NOWAIT.wt_timeout = -1
+class BusyWait(object):
+    '''wait in IIapi_wait() until the OpenAPI call is complete'''
 
+    def __init__( self, timeout=-1 ):
+        self.timeout = timeout
 
-def _IIapi_blocking( IIapi_function ):
-    '''make a pyngres function block until it is complete'''
-    @wraps(IIapi_function)
-    def blocker( pcb ):
-        genParm = pcb.genParm()
+
+    def complete( self, IIapi_function, pcb ):
+        '''call IIapi_function(pcb) and wait; return the number of waits'''
+
+        genParm = pcb._genParm
+        ##  strategies are shared by threads, so the IIAPI_WAITPARM isn't
+        wtp = py.IIAPI_WAITPARM()
+        wtp.wt_timeout = self.timeout
         IIapi_function( pcb )
         ##  poll for completion of the the OpenAPI
+        waits = 0
+        while not genParm.gp_completed:
+            py.IIapi_wait( wtp )
+            waits += 1
+        return waits
+
+
+class BackoffWait(object):
+    '''spin briefly, then back off exponentially, then block'''
+
+    ##  short calls are caught by spinning on zero-timeout waits; longer
+    ##  ones wait with timeouts doubling from initial to maximum ms (giving
+    ##  up the CPU and the GIL for longer each time) before finally waiting
+    ##  without a timeout
+
+    def __init__( self, spin=20, initial=1, maximum=64 ):
+        self.spin = spin / 1000000.0
+        self.initial = initial
+        self.maximum = maximum
+
+
+    def complete( self, IIapi_function, pcb ):
+        '''call IIapi_function(pcb) and wait; return the number of waits'''
+
+        genParm = pcb._genParm
+        wtp = py.IIAPI_WAITPARM()
+        IIapi_function( pcb )
+        waits = 0
+        if not genParm.gp_completed and self.spin:
+            wtp.wt_timeout = 0
+            deadline = time.perf_counter() + self.spin
+            while not genParm.gp_completed and time.perf_counter() < deadline:
+                py.IIapi_wait( wtp )
+                waits += 1
+        timeout = self.initial
+        while not genParm.gp_completed and timeout <= self.maximum:
+            wtp.wt_timeout = timeout
+            py.IIapi_wait( wtp )
+            waits += 1
+            timeout *= 2
+        wtp.wt_timeout = -1
         while not genParm.gp_completed:
-            py.IIapi_wait( _NOWAIT )
+            py.IIapi_wait( wtp )
+            waits += 1
+        return waits
+
+
+class EventWait(object):
+    '''have the driver thread make the call; sleep until it calls back'''
+
+    ##  the calling thread sleeps on a threading.Event, with the GIL
+    ##  released for the whole call, while the pyngres.driver thread waits
+    ##  for the OpenAPI on behalf of every thread; N threads can therefore
+    ##  have N calls in flight at once
+
+    def complete( self, IIapi_function, pcb ):
+        '''call IIapi_function(pcb) and wait; return the number of waits'''
+
+        completed = threading.Event()
+        outcome = []
+        def notify( exception ):
+            outcome.append( exception )
+            completed.set()
+        driver.driver().submit( IIapi_function, pcb, notify )
+        completed.wait()
+        if outcome[0]:
+            raise outcome[0]
+        return 1
+
+
+##  the wait strategy used by calls that don't specify one; IIAPI_WAIT=BACKOFF
+##  or IIAPI_WAIT=EVENT selects BackoffWait() or EventWait() in place of 
+##  BusyWait()
+IIAPI_WAIT_STRATEGIES = {
+    'BUSY': BusyWait,
+    'BACKOFF': BackoffWait,
+    'EVENT': EventWait,
+}
+IIAPI_WAIT = (os.environ.get('IIAPI_WAIT') or 'BUSY').upper()
+if IIAPI_WAIT not in IIAPI_WAIT_STRATEGIES:
+    raise ValueError(f'IIAPI_WAIT={IIAPI_WAIT} isn\'t one of '
+        f'{", ".join(IIAPI_WAIT_STRATEGIES)}')
+IIAPI_WAIT_STRATEGY = IIAPI_WAIT_STRATEGIES[IIAPI_WAIT]()
+
+
+def _IIapi_blocking( IIapi_function ):
+    '''make a pyngres function block until it is complete'''
+    @wraps(IIapi_function)
+    def blocker( pcb, wait=None ):
+        ##  wait is the strategy for this call only; the number of times
+        ##  it had to wait is returned
+        strategy = wait or IIAPI_WAIT_STRATEGY
+        return strategy.complete( IIapi_function, pcb )
     return blocker
 
 
@@ -204,3 +310,108 @@ def IIapi_xaRollback(pcb):
 	py.IIapi_xaRollback( pcb )
 
 
+##  higher-level helpers
+
+
+def _converse( conversation, wait=None ):
+    '''make the OpenAPI calls of a conversation; return its result'''
+
+    ##  a conversation yields (function name, parameter block)
+    while True:
+        try:
+            name, pcb = next( conversation )
+        except StopIteration as stop:
+            return stop.value
+        globals()[name]( pcb, wait=wait )
+
+
+def describe( stmtHandle, rowCount=None, size=None, arena=None, wait=None,
+    expected=None ):
+    '''return a RowSet for the result of a statement (None if it has none)'''
+
+    ##  the RowSet comes from the arena, if one is given, and the caller
+    ##  releases it to that arena when done with it; if the number of rows
+    ##  of the result is expected, it holds no more than that
+
+    gdp = IIAPI_GETDESCRPARM()
+    gdp.gd_stmtHandle = stmtHandle
+    IIapi_getDescriptor( gdp, wait=wait )
+    if check( 'IIapi_getDescriptor', gdp ) == IIAPI_ST_NO_DATA:
+        return None
+    if not gdp.gd_descriptorCount:
+        return None
+    if arena is not None:
+        return arena.rowset( gdp, rowCount, size, expected )
+    return RowSet( gdp, rowCount, size, expected )
+
+
+def batches( rowset, wait=None ):
+    '''refill the RowSet with IIapi_getColumns() and yield it until done'''
+
+    ##  the views() of one batch are released before the next is fetched
+    while True:
+        rowset.expire()
+        IIapi_getColumns( rowset.gcp, wait=wait )
+        status = check( 'IIapi_getColumns', rowset.gcp )
+        if rowset.rowsReturned:
+            yield rowset
+        if status == IIAPI_ST_NO_DATA:
+            break
+
+
+def fetch( stmtHandle, rowCount=None, size=None, arena=None, wait=None,
+    expected=None ):
+    '''yield RowSets of the result, fetched many rows per IIapi_getColumns()'''
+
+    ##  the same RowSet is refilled and yielded again, so copy the rows()
+    ##  of one batch before asking for the next; it is released to the
+    ##  arena (by default the shared one) for reuse when the fetch ends
+    arena = arena or _arena.shared
+    rowset = describe( stmtHandle, rowCount, size, arena, wait=wait,
+        expected=expected )
+    if rowset is None:
+        return
+    try:
+        yield from batches( rowset, wait=wait )
+    finally:
+        arena.release( rowset )
+
+
+def executemany( connHandle, queryText, rows, tranHandle=None,
+    batchSize=None, flags=0, wait=None ):
+    '''execute queryText for each row of parameters, in IIapi_batch()es'''
+
+    return _converse( bulk.executemany(connHandle, queryText, rows,
+        tranHandle, batchSize, flags), wait=wait )
+
+
+def execute_prepared( cache, queryText, values=(), tranHandle=None,
+    sink=None, wait=None ):
+    '''execute queryText, prepared once by a PreparedCache'''
+
+    return _converse( prepared.execute(cache, queryText, values, tranHandle,
+        sink), wait=wait )
+
+
+def execute_repeated( cache, queryText, values=(), tranHandle=None,
+    sink=None, wait=None ):
+    '''execute queryText, defined once as a repeat query by a RepeatCache'''
+
+    return _converse( repeat.execute(cache, queryText, values, tranHandle,
+        sink), wait=wait )
+
+
+def copy_from( connHandle, queryText, rows, tranHandle=None, rowCount=None,
+    size=None, wait=None ):
+    '''load rows with COPY ... FROM PROGRAM, many per IIapi_putColumns()'''
+
+    return _converse( copy.copy_from(connHandle, queryText, rows,
+        tranHandle, rowCount, size), wait=wait )
+
+
+def copy_into( connHandle, queryText, sink, tranHandle=None, rowCount=None,
+    size=None, wait=None ):
+    '''unload rows with COPY ... INTO PROGRAM, passing each RowSet to sink'''
+
+    return _converse( copy.copy_into(connHandle, queryText, sink,
+        tranHandle, rowCount, size), wait=wait )
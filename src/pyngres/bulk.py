@@ -0,0 +1,160 @@
+##  Copyright (c) 2024 Rational Commerce Ltd.
+
+'''
+execute a statement for many sets of parameters using IIapi_batch()
+
+Instead of an IIapi_query() and IIapi_putParms() round-trip for each row,
+up to batchSize statements are queued with IIapi_batch() (each followed by
+IIapi_setDescriptor() and IIapi_putParms()) and sent together; the
+outcome of each one is then collected with IIapi_getQueryInfo().
+
+pyngres.blocking.executemany() and pyngres.asyncio.executemany() run the
+conversation:
+
+    results = executemany( connHandle, b'INSERT INTO t VALUES (~V, ~V)',
+        rows, tranHandle=tranHandle )
+    tranHandle = results.tranHandle
+
+The Parameters come from the shared pyngres.arena, and go back to it.
+'''
+
+
+import os
+from .IIAPI_CONSTANTS import *
+from .IIAPI_PARM import *
+from . import arena
+from .errors import check, error_info
+
+
+##  the number of statements sent in each batch
+IIAPI_BATCH_SIZE = int(os.environ.get('IIAPI_BATCH_SIZE', 1000))
+
+
+class Results(object):
+    '''the outcome of each statement executed by executemany()'''
+
+    def __init__( self, tranHandle=None ):
+        self.tranHandle = tranHandle
+        ##  the gp_status and gq_rowCount from IIapi_getQueryInfo() for
+        ##  each statement (the row count is -1 if it wasn't reported)
+        self.status = []
+        self.rowCount = []
+        ##  the IIapi_getErrorInfo() messages of the failed statements
+        self.errors = {}
+
+
+    def __len__( self ):
+        return len(self.status)
+
+
+    @property
+    def rows( self ):
+        '''the total number of rows affected'''
+
+        return sum(count for count in self.rowCount if count > 0)
+
+
+    def failures( self ):
+        '''return the indexes of the statements that failed'''
+
+        return [index for index, status in enumerate(self.status)
+            if status >= IIAPI_ST_ERROR]
+
+
+def _chunks( rows, size ):
+    chunk = []
+    for row in rows:
+        chunk.append( row )
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def executemany( connHandle, queryText, rows, tranHandle=None,
+    batchSize=None, flags=0, queryType=IIAPI_QT_QUERY ):
+    '''the conversation executing queryText once for each row of values'''
+
+    ##  yields (function name, parameter block) for the caller to call,
+    ##  and returns the Results
+    results = Results( tranHandle )
+    ##  the Parameters in use, kept from one batch to the next
+    parameters = [None]
+    try:
+        for chunk in _chunks( rows, batchSize or IIAPI_BATCH_SIZE ):
+            yield from _batch( connHandle, queryText, chunk, flags,
+                queryType, results, parameters )
+    finally:
+        if parameters[0] is not None:
+            arena.shared.release( parameters[0] )
+    return results
+
+
+def _batch( connHandle, queryText, chunk, flags, queryType, results,
+    parameters ):
+    ##  the conversation sending one batch and collecting its outcome
+    bap = IIAPI_BATCHPARM()
+    bap.ba_connHandle = connHandle
+    bap.ba_queryType = queryType
+    bap.ba_queryText = queryText
+    bap.ba_flags = flags
+    bap.ba_tranHandle = results.tranHandle
+    bap.ba_stmtHandle = None
+    try:
+        for row in chunk:
+            bap.ba_parameters = len(row) > 0
+            ##  the first IIapi_batch() returns the statement handle the
+            ##  others add their statements to
+            yield 'IIapi_batch', bap
+            check( 'IIapi_batch', bap )
+            results.tranHandle = bap.ba_tranHandle
+            if not row:
+                continue
+            if parameters[0] is None or parameters[0].count != len(row):
+                if parameters[0] is not None:
+                    arena.shared.release( parameters[0] )
+                    parameters[0] = None
+                parameters[0] = arena.shared.parameters( len(row) )
+            values = parameters[0]
+            values.set( row )
+            values.bind( bap.ba_stmtHandle )
+            yield 'IIapi_setDescriptor', values.sdp
+            check( 'IIapi_setDescriptor', values.sdp )
+            for ppp in values.puts():
+                yield 'IIapi_putParms', ppp
+                check( 'IIapi_putParms', ppp )
+
+        ##  each IIapi_getQueryInfo() reports on the next statement
+        gqp = IIAPI_GETQINFOPARM()
+        gqp.gq_stmtHandle = bap.ba_stmtHandle
+        while True:
+            yield 'IIapi_getQueryInfo', gqp
+            status = gqp.gq_genParm.gp_status
+            if status == IIAPI_ST_NO_DATA:
+                break
+            if status >= IIAPI_ST_ERROR:
+                if status > IIAPI_ST_ERROR:
+                    ##  the batch can't continue
+                    check( 'IIapi_getQueryInfo', gqp )
+                results.errors[len(results.status)] = error_info(
+                    gqp.gq_genParm.gp_errorHandle )
+            results.status.append( status )
+            if gqp.gq_mask & IIAPI_GQ_ROW_COUNT:
+                results.rowCount.append( gqp.gq_rowCount )
+            else:
+                results.rowCount.append( -1 )
+    except Exception:
+        ##  cancel the batch, so the connection can be used again
+        if bap.ba_stmtHandle:
+            cnp = IIAPI_CANCELPARM()
+            cnp.cn_stmtHandle = bap.ba_stmtHandle
+            yield 'IIapi_cancel', cnp
+            clp = IIAPI_CLOSEPARM()
+            clp.cl_stmtHandle = bap.ba_stmtHandle
+            yield 'IIapi_close', clp
+        raise
+    clp = IIAPI_CLOSEPARM()
+    clp.cl_stmtHandle = bap.ba_stmtHandle
+    yield 'IIapi_close', clp
+    check( 'IIapi_close', clp )
@@ -0,0 +1,417 @@
+##  Copyright (c) 2024 Rational Commerce Ltd.
+
+'''
+load and unload tables with COPY ... FROM|INTO PROGRAM
+
+After IIapi_query() of a COPY statement, IIapi_getCopyMap() describes the
+rows the DBMS expects or sends (cp_dbmsDescr). A CopyBuffer encodes rows
+of Python values into that layout, and sends as many whole rows as fit in
+its buffer with each IIapi_putColumns(), encoding them a column at a time
+(the integer, float, money and boolean columns with one strided copy
+each); the rows of a COPY INTO are
+fetched into a RowSet, many with each IIapi_getColumns(). Either way a
+large table takes tens of calls instead of one call per row.
+
+pyngres.blocking and pyngres.asyncio run the conversations:
+
+    result = copy_from( connHandle, b'COPY TABLE t () FROM PROGRAM', rows,
+        tranHandle=tranHandle )
+    result = copy_into( connHandle, b'COPY TABLE t () INTO PROGRAM', sink,
+        tranHandle=result.tranHandle )
+    tranHandle = result.tranHandle
+
+The rows loaded can be any iterable of tuples; from_columns() turns
+columns (e.g. NumPy arrays, or the columns of an Arrow table) into rows.
+The sink unloading them is called with the RowSet of each batch.
+'''
+
+
+import array
+import ctypes as C
+import decimal
+import itertools
+import os
+import struct
+from .IIAPI_CONSTANTS import *
+from .IIAPI_PARM import *
+from . import datatypes
+from .errors import check
+from .rowset import RowSet, _point
+
+
+##  the size (in bytes) of the value buffer of a CopyBuffer; the number of
+##  rows sent by each IIapi_putColumns() is as many as will fit
+IIAPI_COPY_SIZE = int(os.environ.get('IIAPI_COPY_SIZE', 1 << 20))
+
+##  pc_columnCount is an II_INT2
+IIAPI_COPY_MAX_COLUMNS = 32767
+
+##  each value is aligned for the widest of the binary types
+_ALIGNMENT = 8
+
+_INTS = {1: 'b', 2: 'h', 4: 'i', 8: 'q'}
+_FLOATS = {4: 'f', 8: 'd'}
+_LENGTH = struct.Struct('=H')
+
+
+def _packer( descriptor ):
+    '''return the (array typecode, conversion) of a fixed-width column
+    whose values are written a column at a time (None for the others)'''
+
+    dataType = descriptor.ds_dataType
+    length = descriptor.ds_length
+    if dataType == IIAPI_INT_TYPE:
+        return _INTS[length], int
+    if dataType == IIAPI_FLT_TYPE:
+        return _FLOATS[length], float
+    if dataType == IIAPI_MNY_TYPE:
+        ##  money is kept as a float8 number of cents
+        return 'd', lambda value: float(value) * 100.0
+    if dataType == IIAPI_BOOL_TYPE:
+        return 'B', lambda value: int(bool(value))
+    return None
+
+
+def _writer( descriptor, view ):
+    '''return write(offset, value), which encodes a value into the view
+
+    write() returns the length of the encoded value. The encoding is the
+    DBMS format of the column the descriptor describes. The columns of
+    _packer() are written without one.'''
+
+    dataType = descriptor.ds_dataType
+    length = descriptor.ds_length
+
+    def put( offset, raw, limit=length ):
+        if len(raw) > limit:
+            raise ValueError(f'a value of {len(raw)} bytes is too long for '
+                f'a column of {limit}')
+        view[offset:offset + len(raw)] = raw
+        return len(raw)
+
+    def fixed( encode, pad ):
+        ##  CHAR, NCHAR and BYTE are padded to the width of the column
+        def write( offset, value ):
+            raw = encode( value )
+            put( offset, raw )
+            view[offset + len(raw):offset + length] = pad * (
+                (length - len(raw)) // len(pad))
+            return length
+        return write
+
+    def varying( encode, unit=1 ):
+        ##  VARCHAR, NVARCHAR, TEXT and VARBYTE are prefixed by a length,
+        ##  in characters
+        def write( offset, value ):
+            raw = encode( value )
+            put( offset + 2, raw, length - 2 )
+            _LENGTH.pack_into( view, offset, len(raw) // unit )
+            return len(raw) + 2
+        return write
+
+    def text( value ):
+        return value if isinstance(value, (bytes, bytearray)) else \
+            str(value).encode()
+
+    def utf16( value ):
+        if isinstance(value, (bytes, bytearray)):
+            value = value.decode()
+        return value.encode( 'utf-16-le' )
+
+    if dataType == IIAPI_DEC_TYPE:
+        precision = descriptor.ds_precision
+        scale = descriptor.ds_scale
+        return lambda offset, value: put( offset, datatypes.decimal_bytes(
+            decimal.Decimal(value), precision, scale ) )
+    if dataType in (IIAPI_CHA_TYPE, IIAPI_CHR_TYPE):
+        return fixed( text, b' ' )
+    if dataType == IIAPI_BYTE_TYPE:
+        return fixed( bytes, b'\x00' )
+    if dataType == IIAPI_NCHA_TYPE:
+        return fixed( utf16, ' '.encode('utf-16-le') )
+    if dataType in (IIAPI_VCH_TYPE, IIAPI_TXT_TYPE, IIAPI_LTXT_TYPE):
+        return varying( text )
+    if dataType == IIAPI_VBYTE_TYPE:
+        return varying( bytes )
+    if dataType == IIAPI_NVCH_TYPE:
+        return varying( utf16, 2 )
+    if dataType == IIAPI_DTE_TYPE:
+        return lambda offset, value: put( offset,
+            datatypes.ingres_date_bytes(value) )
+    if dataType == IIAPI_DATE_TYPE:
+        return lambda offset, value: put( offset,
+            datatypes.ansi_date_bytes(value) )
+    if dataType in (IIAPI_TIME_TYPE, IIAPI_TMWO_TYPE, IIAPI_TMTZ_TYPE):
+        return lambda offset, value: put( offset,
+            datatypes.time_bytes(value) )
+    if dataType in (IIAPI_TS_TYPE, IIAPI_TSWO_TYPE, IIAPI_TSTZ_TYPE):
+        return lambda offset, value: put( offset,
+            datatypes.timestamp_bytes(value) )
+    return None
+
+
+def _name( descriptor ):
+    return (descriptor.ds_columnName or b'').decode( errors='replace' )
+
+
+class CopyBuffer(object):
+    '''the buffers for sending many rows with each IIapi_putColumns()'''
+
+    def __init__( self, gmp, rowCount=None, size=None ):
+        ##  gmp is a completed IIAPI_GETCOPYMAPPARM; rowCount overrides the
+        ##  number of rows that fit in size bytes
+        copyMap = gmp.gm_copyMap
+        count = copyMap.cp_dbmsCount
+        if count <= 0:
+            raise ValueError('the COPY statement has no columns')
+        ##  the copy map belongs to the OpenAPI, so keep a copy
+        descriptors = (IIAPI_DESCRIPTOR * count)()
+        C.memmove( descriptors, copyMap.cp_dbmsDescr,
+            C.sizeof(IIAPI_DESCRIPTOR) * count )
+        self.names = [descriptor.ds_columnName for descriptor in descriptors]
+        for descriptor in descriptors:
+            if descriptor.ds_dataType in IIAPI_LONG_TYPES:
+                raise ValueError(f'{_name(descriptor)} is a long column, '
+                    'which COPY can\'t load in blocks of rows')
+            descriptor.ds_columnName = None
+        self.descriptors = descriptors
+        self.stmtHandle = gmp.gm_stmtHandle
+        self.columnCount = count
+
+        ##  lay each row out as consecutive aligned values
+        offsets = []
+        width = 0
+        for descriptor in descriptors:
+            offsets.append( width )
+            width += -(-descriptor.ds_length // _ALIGNMENT) * _ALIGNMENT
+        self.offsets = offsets
+        self.width = width
+        if rowCount is None:
+            rowCount = (size or IIAPI_COPY_SIZE) // width
+        self.rowCount = max(1, min(rowCount, IIAPI_COPY_MAX_COLUMNS // count))
+
+        self.buffer = C.create_string_buffer( self.rowCount * width )
+        self.view = memoryview(self.buffer).cast('B')
+        self.columnData = (IIAPI_DATAVALUE * (self.rowCount * count))()
+        _point( self.columnData, C.addressof(self.buffer), offsets, width,
+            self.rowCount )
+        ##  the dv_null and dv_length members of columnData, written a
+        ##  batch at a time
+        raw = memoryview(self.columnData).cast( 'B' )
+        null = IIAPI_DATAVALUE.dv_null
+        length = IIAPI_DATAVALUE.dv_length
+        size = C.sizeof(IIAPI_DATAVALUE)
+        self.dvNull = raw.cast( 'i' )[null.offset // 4::size // 4]
+        self.dvLength = raw.cast( 'H' )[length.offset // 2::size // 2]
+        ##  the buffer as an array of each type of _packer()
+        self.typed = {}
+
+        self.writers = []
+        self.packers = []
+        for descriptor in descriptors:
+            packer = _packer( descriptor )
+            writer = _writer( descriptor, self.view )
+            if packer is None and writer is None:
+                raise ValueError(f'{_name(descriptor)} has a data type '
+                    f'({descriptor.ds_dataType}) COPY can\'t load')
+            if packer is not None and packer[0] not in self.typed:
+                self.typed[packer[0]] = self.view.cast( packer[0] )
+            self.packers.append( packer )
+            self.writers.append( writer )
+        self.nullable = [bool(descriptor.ds_nullable)
+            for descriptor in descriptors]
+
+        self.pcp = IIAPI_PUTCOLPARM()
+        self.pcp.pc_stmtHandle = self.stmtHandle
+        self.pcp.pc_columnData = self.columnData
+        self.pcp.pc_columnCount = 0
+        self.pcp.pc_moreSegments = False
+
+
+    def __len__( self ):
+        return self.pcp.pc_columnCount // self.columnCount
+
+
+    def fill( self, rows ):
+        '''encode up to rowCount rows from an iterator; return how many'''
+
+        count = self.columnCount
+        chunk = list(itertools.islice( rows, self.rowCount ))
+        for row in chunk:
+            if len(row) != count:
+                raise ValueError(f'{len(row)} values given for {count} '
+                    'columns')
+        filled = len(chunk)
+        self.pcp.pc_columnCount = filled * count
+        if not filled:
+            return 0
+
+        ##  the rows are encoded a column at a time; the dv_null and
+        ##  dv_length of each value are gathered (row by row, as in
+        ##  columnData) and written at the end
+        width = self.width
+        nulls = array.array( 'i', [0] ) * (filled * count)
+        lengths = array.array( 'H', [0] ) * (filled * count)
+        for c, values in enumerate(zip(*chunk)):
+            offset = self.offsets[c]
+            if None in values:
+                if not self.nullable[c]:
+                    name = (self.names[c] or b'').decode( errors='replace' )
+                    raise ValueError(f'{name} can\'t be NULL')
+                nulls[c::count] = array.array( 'i',
+                    [value is None for value in values] )
+            packer = self.packers[c]
+            if packer is None:
+                write = self.writers[c]
+                lengths[c::count] = array.array( 'H', [0 if value is None
+                    else write(row * width + offset, value)
+                    for row, value in enumerate(values)] )
+                continue
+            ##  one strided copy into the buffer; the offsets and the
+            ##  width are multiples of the size of the type
+            code, convert = packer
+            typed = self.typed[code]
+            start = offset // typed.itemsize
+            step = width // typed.itemsize
+            typed[start:start + step * filled:step] = array.array( code,
+                [0 if value is None else convert(value) for value in values] )
+            length = self.descriptors[c].ds_length
+            lengths[c::count] = array.array( 'H', [0 if value is None
+                else length for value in values] )
+        self.dvNull[:filled * count] = nulls
+        self.dvLength[:filled * count] = lengths
+        return filled
+
+
+def from_columns( columns ):
+    '''return an iterator of rows from a sequence of columns
+
+    Each column can be a list, a NumPy array (a masked array for NULLs),
+    or an Arrow array; NULLs become None.'''
+
+    values = []
+    for column in columns:
+        if hasattr(column, 'to_pylist'):
+            column = column.to_pylist()
+        elif hasattr(column, 'tolist'):
+            column = column.tolist()
+        values.append( column )
+    return zip(*values)
+
+
+class CopyResult(object):
+    '''the outcome of a COPY statement'''
+
+    def __init__( self, tranHandle=None, rowCount=-1 ):
+        self.tranHandle = tranHandle
+        self.rowCount = rowCount
+
+
+def _query( connHandle, queryText, tranHandle ):
+    qyp = IIAPI_QUERYPARM()
+    qyp.qy_connHandle = connHandle
+    qyp.qy_queryType = IIAPI_QT_QUERY
+    qyp.qy_queryText = queryText
+    qyp.qy_parameters = False
+    qyp.qy_tranHandle = tranHandle
+    qyp.qy_stmtHandle = None
+    yield 'IIapi_query', qyp
+    check( 'IIapi_query', qyp )
+    return qyp
+
+
+def _copy_map( stmtHandle, copyFrom ):
+    gmp = IIAPI_GETCOPYMAPPARM()
+    gmp.gm_stmtHandle = stmtHandle
+    yield 'IIapi_getCopyMap', gmp
+    check( 'IIapi_getCopyMap', gmp )
+    if bool(gmp.gm_copyMap.cp_copyFrom) != copyFrom:
+        direction = 'FROM' if copyFrom else 'INTO'
+        raise ValueError(f'not a COPY ... {direction} PROGRAM statement')
+    return gmp
+
+
+def _abandon( stmtHandle ):
+    ##  cancel the COPY, so the connection can be used again
+    cnp = IIAPI_CANCELPARM()
+    cnp.cn_stmtHandle = stmtHandle
+    yield 'IIapi_cancel', cnp
+    clp = IIAPI_CLOSEPARM()
+    clp.cl_stmtHandle = stmtHandle
+    yield 'IIapi_close', clp
+
+
+def _finish( stmtHandle, result ):
+    gqp = IIAPI_GETQINFOPARM()
+    gqp.gq_stmtHandle = stmtHandle
+    yield 'IIapi_getQueryInfo', gqp
+    status = gqp.gq_genParm.gp_status
+    if status < IIAPI_ST_ERROR and gqp.gq_mask & IIAPI_GQ_ROW_COUNT:
+        result.rowCount = gqp.gq_rowCount
+    clp = IIAPI_CLOSEPARM()
+    clp.cl_stmtHandle = stmtHandle
+    yield 'IIapi_close', clp
+    check( 'IIapi_getQueryInfo', gqp )
+    check( 'IIapi_close', clp )
+    return result
+
+
+def copy_from( connHandle, queryText, rows, tranHandle=None, rowCount=None,
+    size=None ):
+    '''the conversation loading rows with a COPY ... FROM PROGRAM statement'''
+
+    ##  yields (function name, parameter block) for the caller to call,
+    ##  and returns the CopyResult
+    qyp = yield from _query( connHandle, queryText, tranHandle )
+    result = CopyResult( qyp.qy_tranHandle )
+    try:
+        gmp = yield from _copy_map( qyp.qy_stmtHandle, True )
+        copyBuffer = CopyBuffer( gmp, rowCount, size )
+        rows = iter(rows)
+        while copyBuffer.fill( rows ):
+            yield 'IIapi_putColumns', copyBuffer.pcp
+            check( 'IIapi_putColumns', copyBuffer.pcp )
+    except Exception:
+        yield from _abandon( qyp.qy_stmtHandle )
+        raise
+    return (yield from _finish( qyp.qy_stmtHandle, result ))
+
+
+def _describe( gmp ):
+    ##  a RowSet is made from the descriptors of IIapi_getDescriptor(); the
+    ##  copy map has the same descriptors for the rows of a COPY INTO
+    gdp = IIAPI_GETDESCRPARM()
+    gdp.gd_stmtHandle = gmp.gm_stmtHandle
+    gdp.gd_descriptorCount = gmp.gm_copyMap.cp_dbmsCount
+    gdp.gd_descriptor = gmp.gm_copyMap.cp_dbmsDescr
+    return gdp
+
+
+def copy_into( connHandle, queryText, sink, tranHandle=None, rowCount=None,
+    size=None ):
+    '''the conversation unloading rows with a COPY ... INTO PROGRAM statement
+
+    sink( rowset ) is called with a RowSet of each batch of rows. The same
+    RowSet is refilled for the next batch, so however many rows there are,
+    the memory used stays the same.'''
+
+    ##  yields (function name, parameter block) for the caller to call,
+    ##  and returns the CopyResult
+    qyp = yield from _query( connHandle, queryText, tranHandle )
+    result = CopyResult( qyp.qy_tranHandle, 0 )
+    try:
+        gmp = yield from _copy_map( qyp.qy_stmtHandle, False )
+        rowset = RowSet( _describe(gmp), rowCount, size )
+        while True:
+            rowset.expire()
+            yield 'IIapi_getColumns', rowset.gcp
+            status = check( 'IIapi_getColumns', rowset.gcp )
+            if rowset.rowsReturned:
+                result.rowCount += rowset.rowsReturned
+                sink( rowset )
+            if status == IIAPI_ST_NO_DATA:
+                break
+    except Exception:
+        yield from _abandon( qyp.qy_stmtHandle )
+        raise
+    return (yield from _finish( qyp.qy_stmtHandle, result ))
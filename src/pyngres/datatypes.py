@@ -0,0 +1,270 @@
+##  Copyright (c) 2024 Rational Commerce Ltd.
+
+'''
+decode the raw OpenAPI values of Ingres data types into Python objects
+
+The OpenAPI returns decimal and temporal values in the internal DBMS
+format. The layouts are those of the ADF structures in iiadf.h.
+'''
+
+
+import datetime
+import decimal
+import functools
+import struct
+from .IIAPI_CONSTANTS import *
+
+
+DECIMAL_MAX_PRECISION = 39
+
+##  the sign nibbles of a packed decimal; any other sign is positive
+_MINUS = ('b', 'd')
+
+
+##  the context for scaling, which has to hold every digit of a DECIMAL
+_CONTEXT = decimal.Context(prec=2 * DECIMAL_MAX_PRECISION)
+
+
+def decimal_scaled( raw ):
+    '''decode an IIAPI_DEC_TYPE value as an integer scaled by 10**scale'''
+
+    ##  one digit per nibble, the sign in the last nibble
+    digits = raw.hex()
+    value = int(digits[:-1] or '0')
+    if digits[-1] in _MINUS:
+        return -value
+    return value
+
+
+def decimal_value( raw, precision, scale ):
+    '''decode an IIAPI_DEC_TYPE value (packed decimal)'''
+
+    return decimal.Decimal(decimal_scaled( raw )).scaleb( -scale, _CONTEXT )
+
+
+def scaled_bytes( value, precision ):
+    '''encode an integer (a decimal scaled by 10**scale) as an
+    IIAPI_DEC_TYPE value of the given precision'''
+
+    if value < 0:
+        digits = str(-value)
+        sign = 'd'
+    else:
+        digits = str(value)
+        sign = 'c'
+    if len(digits) > precision:
+        raise ValueError(f'{value} has more than {precision} digits')
+    ##  a packed decimal has an odd number of digits, ahead of the sign
+    return bytes.fromhex(digits.zfill( precision | 1 ) + sign)
+
+
+def decimal_bytes( value, precision, scale ):
+    '''encode a Decimal as an IIAPI_DEC_TYPE value of the given precision'''
+
+    ##  rounded (half to even) to scale digits after the point
+    scaled = value.scaleb( scale, _CONTEXT ).to_integral_value(
+        context=_CONTEXT )
+    try:
+        return scaled_bytes( int(scaled), precision )
+    except ValueError:
+        raise ValueError(f'{value} does not fit DECIMAL({precision},{scale})'
+            ) from None
+
+
+def decimal_precision( value ):
+    '''return the (precision, scale) needed to hold a Decimal'''
+
+    sign, digits, exponent = value.as_tuple()
+    scale = max(0, -exponent)
+    integers = max(1, len(digits) + exponent)
+    return min(integers + scale, DECIMAL_MAX_PRECISION), scale
+
+
+##  AD_DATENTRNL (IIAPI_DTE_TYPE); dn_highday is signed, for intervals
+_DTE = struct.Struct('=BbhhHi')
+AD_DN_ABSOLUTE = 0x01
+AD_DN_INTERVAL = 0x02
+AD_DN_DAYSPEC = 0x10
+AD_DN_TIMESPEC = 0x20
+
+##  AD_ADATE (IIAPI_DATE_TYPE)
+_ADATE = struct.Struct('=hbB')
+##  AD_INTYM (IIAPI_INTYM_TYPE) and AD_INTDS (IIAPI_INTDS_TYPE)
+_INTYM = struct.Struct('=hb')
+_INTDS = struct.Struct('=iii')
+##  AD_TIME (IIAPI_TIME_TYPE, IIAPI_TMWO_TYPE, IIAPI_TMTZ_TYPE)
+_TIME = struct.Struct('=iibb')
+##  AD_TIMESTAMP (IIAPI_TS_TYPE, IIAPI_TSWO_TYPE, IIAPI_TSTZ_TYPE)
+_TIMESTAMP = struct.Struct('=hbBiibb')
+
+
+def ingres_date_value( raw ):
+    '''decode an IIAPI_DTE_TYPE value
+
+    Returns None for the empty date, a timedelta for an interval, a date
+    for an absolute date without a time, and otherwise a datetime (in UTC,
+    which is how Ingres keeps it).'''
+
+    status, highday, year, month, lowday, time = _DTE.unpack( raw )
+    day = (highday << 16) | lowday
+    if status & AD_DN_INTERVAL:
+        ##  years and months have to be approximated as days
+        days = year * 365 + month * 30 + day
+        return datetime.timedelta(days=days, milliseconds=time)
+    if not status & AD_DN_ABSOLUTE:
+        return None
+    if not status & AD_DN_TIMESPEC:
+        return datetime.date(year, month, day)
+    seconds, milliseconds = divmod(time, 1000)
+    minutes, second = divmod(seconds, 60)
+    hour, minute = divmod(minutes, 60)
+    return datetime.datetime(year, month, day, hour, minute, second,
+        milliseconds * 1000, datetime.timezone.utc)
+
+
+def ingres_date_bytes( value ):
+    '''encode a date, datetime or timedelta as an IIAPI_DTE_TYPE value
+
+    A naive datetime is taken to be in UTC.'''
+
+    if isinstance(value, datetime.timedelta):
+        milliseconds = value // datetime.timedelta(milliseconds=1)
+        days, time = divmod(abs(milliseconds), 86400000)
+        if milliseconds < 0:
+            days, time = -days, -time
+        status = AD_DN_INTERVAL | AD_DN_DAYSPEC | AD_DN_TIMESPEC
+        return _DTE.pack( status, days >> 16, 0, 0, days & 0xffff, time )
+    if not isinstance(value, datetime.datetime):
+        return _DTE.pack( AD_DN_ABSOLUTE, 0, value.year, value.month,
+            value.day, 0 )
+    if value.tzinfo is not None:
+        value = value.astimezone( datetime.timezone.utc )
+    time = ((value.hour * 60 + value.minute) * 60 + value.second) * 1000
+    time += value.microsecond // 1000
+    return _DTE.pack( AD_DN_ABSOLUTE | AD_DN_TIMESPEC, 0, value.year,
+        value.month, value.day, time )
+
+
+def ansi_date_value( raw ):
+    '''decode an IIAPI_DATE_TYPE value'''
+
+    year, month, day = _ADATE.unpack( raw )
+    return datetime.date(year, month, day)
+
+
+def ansi_date_bytes( value ):
+    '''encode a date as an IIAPI_DATE_TYPE value'''
+
+    return _ADATE.pack( value.year, value.month, value.day )
+
+
+def interval_ym_value( raw ):
+    '''decode an IIAPI_INTYM_TYPE value as a number of months'''
+
+    years, months = _INTYM.unpack( raw )
+    return years * 12 + months
+
+
+def interval_ds_value( raw ):
+    '''decode an IIAPI_INTDS_TYPE value as a timedelta'''
+
+    days, seconds, nanoseconds = _INTDS.unpack( raw )
+    return datetime.timedelta(days, seconds, nanoseconds // 1000)
+
+
+def interval_ds_bytes( value ):
+    '''encode a timedelta as an IIAPI_INTDS_TYPE value'''
+
+    ##  the days, seconds, and nanoseconds all have the sign of the value
+    microseconds = value // datetime.timedelta(microseconds=1)
+    magnitude = abs(microseconds)
+    seconds, microsecond = divmod(magnitude, 1000000)
+    days, seconds = divmod(seconds, 86400)
+    if microseconds < 0:
+        days, seconds, microsecond = -days, -seconds, -microsecond
+    return _INTDS.pack( days, seconds, microsecond * 1000 )
+
+
+##  the few time zones in use are made once
+@functools.lru_cache( maxsize=None )
+def _timezone( tzhour, tzminute ):
+    return datetime.timezone(
+        datetime.timedelta(hours=tzhour, minutes=tzminute))
+
+
+##  times and timestamps with a time zone (and with the local time zone)
+##  are kept in UTC, along with the displacement of the time zone they
+##  were given in; those without a time zone are kept as given
+
+
+def time_value( raw, dataType=IIAPI_TMWO_TYPE ):
+    '''decode an IIAPI_TIME_TYPE, IIAPI_TMWO_TYPE or IIAPI_TMTZ_TYPE value'''
+
+    seconds, nanoseconds, tzhour, tzminute = _TIME.unpack( raw )
+    if dataType == IIAPI_TMTZ_TYPE:
+        ##  shift the UTC time into its own zone
+        seconds = (seconds + tzhour * 3600 + tzminute * 60) % 86400
+        tzinfo = _timezone( tzhour, tzminute )
+    elif dataType == IIAPI_TMWO_TYPE:
+        tzinfo = None
+    else:
+        tzinfo = datetime.timezone.utc
+    minutes, second = divmod(seconds, 60)
+    hour, minute = divmod(minutes, 60)
+    return datetime.time(hour, minute, second, nanoseconds // 1000, tzinfo)
+
+
+def time_bytes( value ):
+    '''encode a time as an IIAPI_TMWO_TYPE or IIAPI_TMTZ_TYPE value'''
+
+    tzhour = tzminute = 0
+    offset = value.utcoffset()
+    seconds = value.hour * 3600 + value.minute * 60 + value.second
+    if offset is not None:
+        ##  kept in UTC, with the displacement of its own time zone
+        minutes = int(offset.total_seconds()) // 60
+        tzhour, tzminute = _displacement( minutes )
+        seconds = (seconds - minutes * 60) % 86400
+    return _TIME.pack( seconds, value.microsecond * 1000, tzhour, tzminute )
+
+
+def _displacement( minutes ):
+    '''return the (tzhour, tzminute) of a time zone displacement'''
+
+    hours = int(minutes / 60)
+    return hours, minutes - hours * 60
+
+
+def timestamp_value( raw, dataType=IIAPI_TSWO_TYPE ):
+    '''decode an IIAPI_TS_TYPE, IIAPI_TSWO_TYPE or IIAPI_TSTZ_TYPE value'''
+
+    (year, month, day, seconds, nanoseconds,
+        tzhour, tzminute) = _TIMESTAMP.unpack( raw )
+    minutes, second = divmod(seconds, 60)
+    hour, minute = divmod(minutes, 60)
+    if dataType == IIAPI_TSWO_TYPE:
+        return datetime.datetime(year, month, day, hour, minute, second,
+            nanoseconds // 1000)
+    value = datetime.datetime(year, month, day, hour, minute, second,
+        nanoseconds // 1000, datetime.timezone.utc)
+    if dataType == IIAPI_TSTZ_TYPE and (tzhour or tzminute):
+        return value.astimezone( _timezone(tzhour, tzminute) )
+    return value
+
+
+def timestamp_bytes( value ):
+    '''encode a datetime as an IIAPI_TSWO_TYPE or IIAPI_TSTZ_TYPE value'''
+
+    ##  a naive datetime is a TIMESTAMP WITHOUT TIME ZONE, an aware one a
+    ##  TIMESTAMP WITH TIME ZONE
+
+    tzhour = tzminute = 0
+    offset = value.utcoffset()
+    if offset is not None:
+        ##  kept in UTC, with the displacement of its own time zone
+        minutes = int(offset.total_seconds()) // 60
+        tzhour, tzminute = _displacement( minutes )
+        value = value.astimezone( datetime.timezone.utc )
+    seconds = value.hour * 3600 + value.minute * 60 + value.second
+    return _TIMESTAMP.pack( value.year, value.month, value.day, seconds,
+        value.microsecond * 1000, tzhour, tzminute )
@@ -0,0 +1,274 @@
+##  Copyright (c) 2024 Rational Commerce Ltd.
+
+'''
+decode fetched rows straight into Python values
+
+Rather than calling IIapi_convertData() for each value, a RowDecoder is
+compiled once for each shape of result (the ds_dataType, ds_length,
+ds_precision and ds_scale of its columns): a struct.Struct unpacking a
+whole row of the RowSet buffer at once, and a converter for each column
+that struct can't decode by itself. decode() unpacks every row fetched in
+one pass, converts a column at a time, and returns tuples of Python
+values (None for NULL):
+
+    for rowset in pyngres.blocking.fetch( stmtHandle ):
+        for row in rowset.values():
+            ...
+
+Each data type decodes to
+
+    IIAPI_INT_TYPE, IIAPI_FLT_TYPE          int, float
+    IIAPI_MNY_TYPE, IIAPI_DEC_TYPE          Decimal
+    IIAPI_BOOL_TYPE                         bool
+    IIAPI_CHA/CHR/VCH/TXT/LTXT_TYPE         str (IIAPI_ENCODING)
+    IIAPI_NCHA_TYPE, IIAPI_NVCH_TYPE        str
+    IIAPI_BYTE_TYPE, IIAPI_VBYTE_TYPE       bytes
+    IIAPI_DTE_TYPE                          datetime, date, timedelta or None
+    IIAPI_DATE_TYPE                         date
+    IIAPI_TIME/TMWO/TMTZ_TYPE               time
+    IIAPI_TS/TSWO/TSTZ_TYPE                 datetime
+    IIAPI_INTYM_TYPE                        int (months)
+    IIAPI_INTDS_TYPE                        timedelta
+    IIAPI_UUID_TYPE                         UUID
+    IIAPI_IPV4_TYPE, IIAPI_IPV6_TYPE        IPv4Address, IPv6Address
+    locators                                int
+
+and anything else (e.g. IIAPI_LOGKEY_TYPE) to its raw bytes. decoder()
+returns the function decoding one raw value of a type, e.g. one from
+RowSet.rows().
+'''
+
+
+import ctypes as C
+import decimal
+import functools
+import ipaddress
+import os
+import struct
+import sys
+import uuid
+from .IIAPI_CONSTANTS import *
+from .IIAPI_PARM import IIAPI_DATAVALUE
+from . import datatypes
+
+
+##  the character set of character (not Unicode) columns
+IIAPI_ENCODING = os.environ.get('IIAPI_ENCODING', 'utf-8')
+
+_LENGTH = struct.Struct('=H')
+
+##  each value is aligned for the widest of the binary types
+_ALIGNMENT = 8
+
+
+##  each entry returns the (struct format, converter) of a column from its
+##  (length, precision, scale); the converter is None if struct decodes it
+
+def _integer( length, precision, scale ):
+    return {1: 'b', 2: 'h', 4: 'i', 8: 'q'}[length], None
+
+
+def _float( length, precision, scale ):
+    return {4: 'f', 8: 'd'}[length], None
+
+
+def _money( length, precision, scale ):
+    ##  money is a double holding the number of cents
+    return 'd', lambda cents: decimal.Decimal(round(cents)).scaleb( -2 )
+
+
+def _bool( length, precision, scale ):
+    return '?', None
+
+
+def _decimal( length, precision, scale ):
+    return f'{length}s', lambda raw: datatypes.decimal_value( raw,
+        precision, scale )
+
+
+def _text( length, precision, scale ):
+    return f'{length}s', lambda raw: raw.decode( IIAPI_ENCODING )
+
+
+def _varying_text( length, precision, scale ):
+    unpack = _LENGTH.unpack_from
+    return f'{length}s', lambda raw: raw[2:2 + unpack(raw)[0]].decode(
+        IIAPI_ENCODING )
+
+
+def _bytes( length, precision, scale ):
+    return f'{length}s', None
+
+
+def _varying_bytes( length, precision, scale ):
+    unpack = _LENGTH.unpack_from
+    return f'{length}s', lambda raw: raw[2:2 + unpack(raw)[0]]
+
+
+def _unicode( length, precision, scale ):
+    return f'{length}s', lambda raw: raw.decode( 'utf-16-le' )
+
+
+def _varying_unicode( length, precision, scale ):
+    ##  the length is in UTF-16 characters
+    unpack = _LENGTH.unpack_from
+    return f'{length}s', lambda raw: raw[2:2 + 2 * unpack(raw)[0]].decode(
+        'utf-16-le' )
+
+
+def _with_type( convert, dataType ):
+    return lambda length, precision, scale: (f'{length}s',
+        lambda raw: convert( raw, dataType ))
+
+
+def _raw( convert ):
+    return lambda length, precision, scale: (f'{length}s', convert)
+
+
+##  a UUID is kept as a struct of integers, in the machine's byte order
+if sys.byteorder == 'little':
+    _uuid = lambda raw: uuid.UUID( bytes_le=raw )
+else:
+    _uuid = lambda raw: uuid.UUID( bytes=raw )
+
+
+def _locator( length, precision, scale ):
+    return 'i', None
+
+
+DECODERS = {
+    IIAPI_INT_TYPE: _integer,
+    IIAPI_FLT_TYPE: _float,
+    IIAPI_MNY_TYPE: _money,
+    IIAPI_BOOL_TYPE: _bool,
+    IIAPI_DEC_TYPE: _decimal,
+    IIAPI_CHA_TYPE: _text,
+    IIAPI_CHR_TYPE: _text,
+    IIAPI_VCH_TYPE: _varying_text,
+    IIAPI_TXT_TYPE: _varying_text,
+    IIAPI_LTXT_TYPE: _varying_text,
+    IIAPI_NCHA_TYPE: _unicode,
+    IIAPI_NVCH_TYPE: _varying_unicode,
+    IIAPI_BYTE_TYPE: _bytes,
+    IIAPI_VBYTE_TYPE: _varying_bytes,
+    IIAPI_DTE_TYPE: _raw( datatypes.ingres_date_value ),
+    IIAPI_DATE_TYPE: _raw( datatypes.ansi_date_value ),
+    IIAPI_TIME_TYPE: _with_type( datatypes.time_value, IIAPI_TIME_TYPE ),
+    IIAPI_TMWO_TYPE: _with_type( datatypes.time_value, IIAPI_TMWO_TYPE ),
+    IIAPI_TMTZ_TYPE: _with_type( datatypes.time_value, IIAPI_TMTZ_TYPE ),
+    IIAPI_TS_TYPE: _with_type( datatypes.timestamp_value, IIAPI_TS_TYPE ),
+    IIAPI_TSWO_TYPE: _with_type( datatypes.timestamp_value,
+        IIAPI_TSWO_TYPE ),
+    IIAPI_TSTZ_TYPE: _with_type( datatypes.timestamp_value,
+        IIAPI_TSTZ_TYPE ),
+    IIAPI_INTYM_TYPE: _raw( datatypes.interval_ym_value ),
+    IIAPI_INTDS_TYPE: _raw( datatypes.interval_ds_value ),
+    IIAPI_UUID_TYPE: _raw( _uuid ),
+    IIAPI_IPV4_TYPE: _raw( ipaddress.IPv4Address ),
+    IIAPI_IPV6_TYPE: _raw( ipaddress.IPv6Address ),
+    IIAPI_LCLOC_TYPE: _locator,
+    IIAPI_LBLOC_TYPE: _locator,
+    IIAPI_LNLOC_TYPE: _locator,
+}
+
+
+@functools.lru_cache( maxsize=None )
+def _column( dataType, length, precision, scale ):
+    ##  the (struct format, converter) of a column
+    entry = DECODERS.get( dataType, _bytes )
+    return entry( length, precision, scale )
+
+
+def decoder( dataType, length, precision=0, scale=0 ):
+    '''return a function decoding one raw value of the given type'''
+
+    format, convert = _column( dataType, length, precision, scale )
+    if format.endswith( 's' ):
+        return convert or bytes
+    unpack = struct.Struct( '=' + format ).unpack_from
+    if convert is None:
+        return lambda raw: unpack( raw )[0]
+    return lambda raw: convert( unpack(raw)[0] )
+
+
+##  the dv_null member of each IIAPI_DATAVALUE, as a struct format
+_NULL = {1: 'b', 2: 'h', 4: 'i'}[IIAPI_DATAVALUE.dv_null.size]
+
+
+class RowDecoder(object):
+    '''decodes the rows of RowSets of one shape'''
+
+    def __init__( self, shape ):
+        ##  shape is a RowSet.shape: the (dataType, nullable, length,
+        ##  precision, scale) of each column
+        self.shape = shape
+        row = ['=']
+        nulls = ['=']
+        size = C.sizeof(IIAPI_DATAVALUE)
+        self.converters = []
+        self.nullable = []
+        for (dataType, nullable, length, precision, scale) in shape:
+            format, convert = _column( dataType, length, precision, scale )
+            padding = -(-length // _ALIGNMENT) * _ALIGNMENT - length
+            row.append( format + 'x' * padding )
+            self.converters.append( convert )
+            ##  only a nullable column can be NULL, so only its dv_null
+            ##  is looked at
+            self.nullable.append( bool(nullable) )
+            if nullable:
+                nulls.append( 'x' * IIAPI_DATAVALUE.dv_null.offset + _NULL
+                    + 'x' * (size - IIAPI_DATAVALUE.dv_null.offset
+                    - IIAPI_DATAVALUE.dv_null.size) )
+            else:
+                nulls.append( 'x' * size )
+        self.row = struct.Struct( ''.join(row) )
+        self.nulls = struct.Struct( ''.join(nulls) ) if any(
+            self.nullable) else None
+
+
+    def decode( self, rowset ):
+        '''return the rows fetched into the RowSet as tuples of values'''
+
+        rows = rowset.rowsReturned
+        if not rows:
+            return []
+        buffer = memoryview(rowset.buffer).cast( 'B' )
+        columns = list(zip(*self.row.iter_unpack(
+            buffer[:rows * rowset.width])))
+        if self.nulls is not None:
+            columnData = memoryview(rowset.columnData).cast( 'B' )
+            nulls = list(zip(*self.nulls.iter_unpack(
+                columnData[:rows * self.nulls.size])))
+        else:
+            nulls = ()
+        n = 0
+        for c, convert in enumerate(self.converters):
+            if self.nullable[c]:
+                ##  the value of a NULL is whatever was in the buffer, so
+                ##  it is never converted
+                flags = nulls[n]
+                n += 1
+                if any(flags):
+                    if convert is None:
+                        columns[c] = [None if null else value
+                            for value, null in zip(columns[c], flags)]
+                    else:
+                        columns[c] = [None if null else convert(value)
+                            for value, null in zip(columns[c], flags)]
+                    continue
+            if convert is not None:
+                columns[c] = list(map(convert, columns[c]))
+        return list(zip(*columns))
+
+
+@functools.lru_cache( maxsize=256 )
+def row_decoder( shape ):
+    '''return the (shared) RowDecoder for RowSets of the given shape'''
+
+    return RowDecoder( shape )
+
+
+def decode( rowset ):
+    '''return the rows fetched into the RowSet as tuples of Python values'''
+
+    return row_decoder( rowset.shape ).decode( rowset )
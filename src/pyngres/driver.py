@@ -0,0 +1,171 @@
+##  Copyright (c) 2024 Rational Commerce Ltd.
+
+'''
+drive the completion of many concurrent OpenAPI calls with one IIapi_wait()
+'''
+
+
+import os
+import queue
+import threading
+from loguru import logger
+import pyngres as py
+from pyngres import IIapi_callback, IIapi_getCallbackPtr, IIapi_getClosurePtr
+
+
+##  how long (in milliseconds) the driver thread waits in IIapi_wait()
+##  before it looks for newly submitted requests
+IIAPI_DRIVER_TIMEOUT = int(os.environ.get('IIAPI_DRIVER_TIMEOUT', 2))
+
+
+class Completion(object):
+    '''route the completion of one OpenAPI call to a notify function'''
+
+    __slots__ = ('genParm', 'notify', 'closure', 'done')
+
+    def __init__( self, pcb, notify ):
+        ##  notify(exception) is called exactly once; exception is None
+        ##  unless the OpenAPI function raised one
+        self.genParm = pcb._genParm
+        self.notify = notify
+        self.closure = None
+        self.done = False
+
+
+    def install( self ):
+        '''install our gp_callback unless the application has its own'''
+
+        genParm = self.genParm
+        if genParm.gp_callback:
+            return False
+        self.closure = IIapi_getClosurePtr( self )
+        genParm.gp_callback = _IIapi_completedPtr
+        genParm.gp_closure = self.closure
+        return True
+
+
+    def complete( self, exception=None ):
+        '''the OpenAPI call is complete; notify whoever is waiting'''
+
+        if self.done:
+            return
+        self.done = True
+        if self.closure:
+            ##  the parameter block may be reused by the application
+            self.genParm.gp_callback = None
+            self.genParm.gp_closure = None
+            self.closure = None
+        try:
+            self.notify( exception )
+        except Exception:
+            logger.exception('OpenAPI completion notification failed')
+
+
+@IIapi_callback
+def _IIapi_completed( closure, genParm ):
+    '''OpenAPI callback to complete a Completion'''
+    closure.contents.value.complete()
+
+
+_IIapi_completedPtr = IIapi_getCallbackPtr( _IIapi_completed )
+
+
+def issue( IIapi_function, pcb, completion ):
+    '''call an OpenAPI function; return True if it has to be polled'''
+
+    callback = completion.install()
+    try:
+        IIapi_function( pcb )
+    except Exception as exception:
+        completion.complete( exception )
+        return False
+    ##  the call may already be complete (e.g. if IIAPI_DEBUG_ONERROR
+    ##  made it synchronous)
+    if completion.genParm.gp_completed:
+        completion.complete()
+        return False
+    return not callback
+
+
+def poll( completions ):
+    '''complete the polled completions that are done; return the others'''
+
+    for completion in completions:
+        if completion.genParm.gp_completed:
+            completion.complete()
+    return [completion for completion in completions if not completion.done]
+
+
+class Driver(threading.Thread):
+    '''issue OpenAPI calls and wait for their completion in one thread'''
+
+    ##  the OpenAPI only completes a request in the thread that issued it,
+    ##  so requests are submitted to the driver, which issues them itself;
+    ##  it blocks in IIapi_wait() (with the GIL released) while any are in
+    ##  flight, and sleeps on its request queue when none are
+
+    def __init__( self, timeout=None ):
+        super().__init__( name='pyngres-driver', daemon=True )
+        self.requests = queue.SimpleQueue()
+        self.wtp = py.IIAPI_WAITPARM()
+        self.wtp.wt_timeout = (IIAPI_DRIVER_TIMEOUT if timeout is None
+            else timeout)
+        self.inflight = 0
+        self.polled = []
+
+
+    def submit( self, IIapi_function, pcb, notify ):
+        '''have the driver call IIapi_function(pcb); notify when complete'''
+
+        ##  NB notify(exception) is called in the driver thread
+        self.requests.put( (IIapi_function, pcb, notify) )
+
+
+    def _issue( self, IIapi_function, pcb, notify ):
+        def finished( exception ):
+            self.inflight -= 1
+            notify( exception )
+        completion = Completion( pcb, finished )
+        self.inflight += 1
+        if issue( IIapi_function, pcb, completion ):
+            self.polled.append( completion )
+
+
+    def run( self ):
+        requests = self.requests
+        while True:
+            try:
+                request = requests.get( block=not self.inflight )
+            except queue.Empty:
+                request = None
+            while request:
+                self._issue( *request )
+                try:
+                    request = requests.get_nowait()
+                except queue.Empty:
+                    request = None
+            if self.inflight:
+                try:
+                    py.IIapi_wait( self.wtp )
+                except Exception:
+                    ##  the driver must outlive anything that goes wrong
+                    logger.exception('IIapi_wait() failed')
+                if self.polled:
+                    self.polled = poll( self.polled )
+
+
+_driver = None
+_driver_lock = threading.Lock()
+
+
+def driver():
+    '''return the driver thread shared by the whole process'''
+
+    global _driver
+    if _driver is None:
+        with _driver_lock:
+            if _driver is None:
+                thread = Driver()
+                thread.start()
+                _driver = thread
+    return _driver
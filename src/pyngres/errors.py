@@ -0,0 +1,58 @@
+##  Copyright (c) 2024 Rational Commerce Ltd.
+
+'''
+exceptions raised by the higher-level pyngres helpers
+
+The IIapi_* functions never raise; they report their outcome in gp_status
+like the OpenAPI does. Helpers that hide a whole sequence of OpenAPI calls
+(e.g. fetch()) have nowhere to return a status, so they raise OpenAPIError
+instead.
+'''
+
+
+import pyngres as py
+
+
+class OpenAPIError(RuntimeError):
+    '''an OpenAPI call failed'''
+
+    def __init__( self, function, status, messages=() ):
+        self.function = function
+        self.status = status
+        ##  messages are (SQLSTATE, errorCode, message) from IIapi_getErrorInfo()
+        self.messages = list(messages)
+        name = py.IIAPI_ST_MSG.get(status, status)
+        diagnostic = f'{function}() returned {name}'
+        if self.messages:
+            diagnostic += ': ' + '; '.join(
+                message for SQLSTATE, errorCode, message in self.messages)
+        super().__init__( diagnostic )
+
+
+def error_info( errorHandle ):
+    '''return the (SQLSTATE, errorCode, message) reported for errorHandle'''
+
+    messages = []
+    if not errorHandle:
+        return messages
+    gep = py.IIAPI_GETEINFOPARM()
+    gep.ge_errorHandle = errorHandle
+    while True:
+        py.IIapi_getErrorInfo( gep )
+        if gep.ge_status != py.IIAPI_ST_SUCCESS:
+            break
+        message = gep.ge_message or b''
+        message = message.decode(errors='replace')
+        messages.append( (gep.ge_SQLSTATE.decode(), gep.ge_errorCode, message) )
+    return messages
+
+
+def check( function, pcb ):
+    '''raise OpenAPIError if the completed call failed; return its status'''
+
+    genParm = pcb._genParm
+    status = genParm.gp_status
+    if status >= py.IIAPI_ST_ERROR:
+        raise OpenAPIError( function, status,
+            error_info(genParm.gp_errorHandle) )
+    return status
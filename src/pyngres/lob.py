@@ -0,0 +1,484 @@
+##  Copyright (c) 2024 Rational Commerce Ltd.
+
+'''
+stream long (BLOB) column values a segment at a time
+
+The value of a long column (IIAPI_LVCH_TYPE, IIAPI_LBYTE_TYPE,
+IIAPI_LNVCH_TYPE, ...) arrives in segments: each IIapi_getColumns() returns
+one, and sets gc_moreSegments until the last. fetch() (for threads, using
+pyngres.blocking) and afetch() (for asyncio, using pyngres.asyncio) yield
+the rows of a result one at a time; the long columns of a Row are
+LobReaders, which fetch each segment into the same buffer as it is needed,
+so a value of any size can be copied in constant memory:
+
+    for row in fetch( stmtHandle ):
+        name = row[0]
+        with open( name, 'wb' ) as file:
+            shutil.copyfileobj( row[1], file )
+
+The columns of a row can only be fetched in order: getting a column passes
+the ones before it, and the unread part of a long column that is passed is
+fetched and discarded. A LobReader is a forward-only file; seek() can skip
+ahead but not go back. The value of an IIAPI_LNVCH_TYPE column is read as
+UTF-16 bytes, which io.TextIOWrapper( io.BufferedReader(reader),
+encoding='utf-16-le' ) decodes as it goes. A NULL long column is None
+rather than a LobReader. The other columns are decoded as
+RowSet.values() decodes them (see pyngres.decoders).
+
+Each segment holds at most IIAPI_MAX_SEGMENT_LEN bytes, which has to agree
+with the IIAPI_EP_MAX_SEGMENT_LEN set with IIapi_setEnvParam() (if any).
+
+A long value is sent the same way, as a Lob parameter (from
+pyngres.parameters) reading a file or an iterator a chunk at a time:
+
+    execute_prepared( cache, b'INSERT INTO docs VALUES (?, ?)',
+        (name, Lob(open(path, 'rb'))), tranHandle=tranHandle )
+'''
+
+
+import ctypes as C
+import io
+import os
+import struct
+from .IIAPI_CONSTANTS import *
+from .IIAPI_PARM import *
+from .errors import check
+from . import decoders
+from .parameters import Lob
+import pyngres.blocking as blocking
+import pyngres.asyncio as aio
+
+
+##  the most bytes of a long value in each segment
+IIAPI_MAX_SEGMENT_LEN = int(os.environ.get('IIAPI_MAX_SEGMENT_LEN',
+    IIAPI_SEGMENT_LEN))
+
+##  a segment starts with its length (in characters for IIAPI_LNVCH_TYPE)
+_LENGTH = struct.Struct('=H')
+
+##  each value is aligned for the widest of the binary types
+_ALIGNMENT = 8
+
+
+class _Cursor(object):
+    '''the position in a result fetched a column (or segment) at a time'''
+
+    def __init__( self, gdp, segmentLength=None ):
+        count = gdp.gd_descriptorCount
+        descriptors = (IIAPI_DESCRIPTOR * count)()
+        C.memmove( descriptors, gdp.gd_descriptor,
+            C.sizeof(IIAPI_DESCRIPTOR) * count )
+        self.names = [descriptor.ds_columnName for descriptor in descriptors]
+        for descriptor in descriptors:
+            descriptor.ds_columnName = None
+        self.descriptors = descriptors
+        self.columnCount = count
+        self.long = [descriptor.ds_dataType in IIAPI_LONG_TYPES
+            for descriptor in descriptors]
+
+        ##  the values of the other columns are fetched into one buffer,
+        ##  each run of them between long columns with one IIapi_getColumns()
+        offsets = []
+        width = 0
+        for descriptor, long in zip(descriptors, self.long):
+            offsets.append( width )
+            if not long:
+                width += -(-descriptor.ds_length // _ALIGNMENT) * _ALIGNMENT
+        self.buffer = C.create_string_buffer( max(width, 1) )
+        self.columnData = (IIAPI_DATAVALUE * count)()
+        self.datavalues = list(self.columnData)
+        address = C.addressof(self.buffer)
+        for datavalue, offset in zip(self.datavalues, offsets):
+            datavalue.dv_value = address + offset
+        self.addresses = [address + offset for offset in offsets]
+        self.decoders = [None if long else decoders.decoder(
+            descriptor.ds_dataType, descriptor.ds_length,
+            descriptor.ds_precision, descriptor.ds_scale)
+            for descriptor, long in zip(descriptors, self.long)]
+        self.runs = {}
+        start = 0
+        while start < count:
+            end = start
+            while end < count and not self.long[end]:
+                end += 1
+            if end > start:
+                self.runs[start] = (end, C.cast(C.byref(self.columnData,
+                    start * C.sizeof(IIAPI_DATAVALUE)),
+                    C.POINTER(IIAPI_DATAVALUE)))
+            start = end + 1
+
+        ##  every segment is fetched into the same buffer
+        segmentLength = segmentLength or IIAPI_MAX_SEGMENT_LEN
+        self.segment = C.create_string_buffer( segmentLength + _LENGTH.size )
+        self.view = memoryview(self.segment).cast( 'B' )
+        self.segmentData = (IIAPI_DATAVALUE * 1)()
+        self.segmentValue = self.segmentData[0]
+        self.segmentValue.dv_value = C.addressof(self.segment)
+
+        gcp = IIAPI_GETCOLPARM()
+        gcp.gc_stmtHandle = gdp.gd_stmtHandle
+        gcp.gc_rowCount = 1
+        self.gcp = gcp
+
+        ##  the row being fetched, the values of its columns fetched so far
+        ##  (a long column is fetched once its first segment is), and the
+        ##  next column to be fetched
+        self.row = -1
+        self.values = []
+        self.column = 0
+        ##  whether the long column at self.column is being fetched, and
+        ##  has more segments; the unread part of its segment
+        self.inLong = False
+        self.more = False
+        self.start = self.end = 0
+        ##  whether the result is exhausted
+        self.done = False
+
+
+    def copy( self, view, offset ):
+        '''copy unread bytes of the segment into view[offset:]'''
+
+        count = min(len(view) - offset, self.end - self.start)
+        view[offset:offset + count] = self.view[self.start:self.start + count]
+        self.start += count
+        return count
+
+
+    def skip( self, count ):
+        '''pass over up to count unread bytes of the segment'''
+
+        count = min(count, self.end - self.start)
+        self.start += count
+        return count
+
+
+def _describe( stmtHandle ):
+    ##  the conversation getting the descriptors; returns the gdp, or None
+    ##  if the statement has no result
+    gdp = IIAPI_GETDESCRPARM()
+    gdp.gd_stmtHandle = stmtHandle
+    yield 'IIapi_getDescriptor', gdp
+    if check( 'IIapi_getDescriptor', gdp ) == IIAPI_ST_NO_DATA:
+        return None
+    if not gdp.gd_descriptorCount:
+        return None
+    return gdp
+
+
+def _columns( cursor ):
+    ##  the conversation fetching the run of columns at cursor.column
+    start = cursor.column
+    end, columnData = cursor.runs[start]
+    gcp = cursor.gcp
+    gcp.gc_columnCount = end - start
+    gcp.gc_columnData = columnData
+    yield 'IIapi_getColumns', gcp
+    if check( 'IIapi_getColumns', gcp ) == IIAPI_ST_NO_DATA:
+        cursor.done = True
+        return
+    for column in range(start, end):
+        datavalue = cursor.datavalues[column]
+        if datavalue.dv_null:
+            cursor.values.append( None )
+        else:
+            cursor.values.append( cursor.decoders[column](
+                C.string_at(cursor.addresses[column], datavalue.dv_length)) )
+    cursor.column = end
+
+
+def _segment( cursor ):
+    ##  the conversation fetching the next segment of the long column at
+    ##  cursor.column
+    gcp = cursor.gcp
+    gcp.gc_columnCount = 1
+    gcp.gc_columnData = cursor.segmentData
+    yield 'IIapi_getColumns', gcp
+    if check( 'IIapi_getColumns', gcp ) == IIAPI_ST_NO_DATA:
+        cursor.done = True
+        return
+    first = not cursor.inLong
+    cursor.inLong = True
+    cursor.more = bool(gcp.gc_moreSegments)
+    datavalue = cursor.segmentValue
+    if datavalue.dv_null:
+        cursor.start = cursor.end = 0
+        if first:
+            cursor.values.append( None )
+        return
+    length = _LENGTH.unpack_from( cursor.segment )[0]
+    if cursor.descriptors[cursor.column].ds_dataType == IIAPI_LNVCH_TYPE:
+        length *= 2
+    cursor.start = _LENGTH.size
+    cursor.end = _LENGTH.size + length
+    if first:
+        cursor.values.append( True )
+
+
+def _pass( cursor ):
+    ##  the conversation discarding the rest of the long column
+    while cursor.more:
+        yield from _segment( cursor )
+        if cursor.done:
+            return
+    cursor.inLong = False
+    cursor.start = cursor.end = 0
+    cursor.column += 1
+
+
+def _advance( cursor, index ):
+    ##  the conversation fetching the columns of the row up to index
+    while len(cursor.values) <= index and not cursor.done:
+        if cursor.inLong:
+            yield from _pass( cursor )
+        elif cursor.long[cursor.column]:
+            yield from _segment( cursor )
+        else:
+            yield from _columns( cursor )
+
+
+def _next( cursor ):
+    ##  the conversation starting the next row; returns False at the end
+    if cursor.row >= 0 and not cursor.done:
+        yield from _advance( cursor, cursor.columnCount - 1 )
+        if cursor.inLong:
+            yield from _pass( cursor )
+    if cursor.done:
+        return False
+    cursor.row += 1
+    cursor.values = []
+    cursor.column = 0
+    yield from _advance( cursor, 0 )
+    return not cursor.done
+
+
+class _Reader(object):
+    '''what LobReader and AsyncLobReader have in common'''
+
+    def __init__( self, cursor, column ):
+        self.cursor = cursor
+        self.row = cursor.row
+        self.column = column
+        self.position = 0
+        self.eof = False
+
+
+    def _current( self ):
+        '''whether the column is still being fetched'''
+
+        cursor = self.cursor
+        if (cursor.row == self.row and cursor.inLong
+            and cursor.column == self.column):
+            return True
+        if not self.eof:
+            raise ValueError('the column has been passed')
+        return False
+
+
+    def _fetch( self ):
+        '''whether another segment has to be fetched to read on'''
+
+        cursor = self.cursor
+        if cursor.start < cursor.end:
+            return False
+        if not cursor.more:
+            self.eof = True
+            return False
+        return True
+
+
+    def tell( self ):
+        return self.position
+
+
+class LobReader(_Reader, io.RawIOBase):
+    '''the value of a long column, read as a forward-only file'''
+
+    def __init__( self, cursor, column, wait=None ):
+        _Reader.__init__( self, cursor, column )
+        io.RawIOBase.__init__( self )
+        self.wait = wait
+
+
+    def readable( self ):
+        return True
+
+
+    def readinto( self, buffer ):
+        '''fill buffer with the next bytes of the value; return the count'''
+
+        view = memoryview(buffer).cast( 'B' )
+        count = 0
+        cursor = self.cursor
+        while count < len(view) and self._current():
+            if self._fetch():
+                blocking._converse( _segment(cursor), wait=self.wait )
+            elif self.eof:
+                break
+            else:
+                count += cursor.copy( view, count )
+        self.position += count
+        return count
+
+
+    def seek( self, offset, whence=io.SEEK_SET ):
+        '''skip forward to offset; return the new position'''
+
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence != io.SEEK_SET:
+            raise io.UnsupportedOperation('can\'t seek from the end')
+        if offset < self.position:
+            raise io.UnsupportedOperation('can\'t seek backwards')
+        cursor = self.cursor
+        while self.position < offset and self._current():
+            if self._fetch():
+                blocking._converse( _segment(cursor), wait=self.wait )
+            elif self.eof:
+                break
+            else:
+                self.position += cursor.skip( offset - self.position )
+        return self.position
+
+
+class AsyncLobReader(_Reader):
+    '''the value of a long column, read a segment at a time with await'''
+
+    async def readinto( self, buffer ):
+        '''fill buffer with the next bytes of the value; return the count'''
+
+        view = memoryview(buffer).cast( 'B' )
+        count = 0
+        cursor = self.cursor
+        while count < len(view) and self._current():
+            if self._fetch():
+                await aio._converse( _segment(cursor) )
+            elif self.eof:
+                break
+            else:
+                count += cursor.copy( view, count )
+        self.position += count
+        return count
+
+
+    async def read( self, size=-1 ):
+        '''return the next size bytes of the value (all of them if -1)'''
+
+        if size is not None and size >= 0:
+            buffer = bytearray(size)
+            count = await self.readinto( buffer )
+            del buffer[count:]
+            return bytes(buffer)
+        chunks = []
+        while True:
+            chunk = await self.read( IIAPI_MAX_SEGMENT_LEN )
+            if not chunk:
+                return b''.join(chunks)
+            chunks.append( chunk )
+
+
+    async def seek( self, offset, whence=io.SEEK_SET ):
+        '''skip forward to offset; return the new position'''
+
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence != io.SEEK_SET:
+            raise io.UnsupportedOperation('can\'t seek from the end')
+        if offset < self.position:
+            raise io.UnsupportedOperation('can\'t seek backwards')
+        cursor = self.cursor
+        while self.position < offset and self._current():
+            if self._fetch():
+                await aio._converse( _segment(cursor) )
+            elif self.eof:
+                break
+            else:
+                self.position += cursor.skip( offset - self.position )
+        return self.position
+
+
+class _Row(object):
+    '''what Row and AsyncRow have in common'''
+
+    def __init__( self, cursor ):
+        self.cursor = cursor
+        self.row = cursor.row
+        self.readers = {}
+
+
+    @property
+    def names( self ):
+        return self.cursor.names
+
+
+    def __len__( self ):
+        return self.cursor.columnCount
+
+
+    def _index( self, index ):
+        count = self.cursor.columnCount
+        if index < 0:
+            index += count
+        if not 0 <= index < count:
+            raise IndexError('column index out of range')
+        if self.cursor.row != self.row:
+            raise ValueError('the row has been passed')
+        return index
+
+
+    def _value( self, index, reader ):
+        value = self.cursor.values[index]
+        if not self.cursor.long[index] or value is None:
+            return value
+        if index not in self.readers:
+            self.readers[index] = reader( self.cursor, index )
+        return self.readers[index]
+
+
+class Row(_Row):
+    '''a row of a result with long columns, fetched as its columns are got'''
+
+    def __init__( self, cursor, wait=None ):
+        super().__init__( cursor )
+        self.wait = wait
+
+
+    def __getitem__( self, index ):
+        '''return the raw value of a column, or a LobReader'''
+
+        index = self._index( index )
+        blocking._converse( _advance(self.cursor, index), wait=self.wait )
+        return self._value( index,
+            lambda cursor, column: LobReader(cursor, column, self.wait) )
+
+
+class AsyncRow(_Row):
+    '''a row of a result with long columns, fetched as its columns are got'''
+
+    async def get( self, index ):
+        '''return the raw value of a column, or an AsyncLobReader'''
+
+        index = self._index( index )
+        await aio._converse( _advance(self.cursor, index) )
+        return self._value( index, AsyncLobReader )
+
+
+def fetch( stmtHandle, segmentLength=None, wait=None ):
+    '''yield the rows of a result with long columns, one at a time'''
+
+    gdp = blocking._converse( _describe(stmtHandle), wait=wait )
+    if gdp is None:
+        return
+    cursor = _Cursor( gdp, segmentLength )
+    while blocking._converse( _next(cursor), wait=wait ):
+        yield Row( cursor, wait )
+
+
+async def afetch( stmtHandle, segmentLength=None ):
+    '''yield the rows of a result with long columns, one at a time'''
+
+    gdp = await aio._converse( _describe(stmtHandle) )
+    if gdp is None:
+        return
+    cursor = _Cursor( gdp, segmentLength )
+    while await aio._converse( _next(cursor) ):
+        yield AsyncRow( cursor )
@@ -0,0 +1,1044 @@
+##  Copyright (c) 2024 Rational Commerce Ltd.
+
+'''
+loopback stand-in for the Actian Vector/X/Ingres OpenAPI
+
+pyngres binds this module instead of the native OpenAPI library when the
+IIAPI_BACKEND envar is set to pyngres.loopback. It implements the IIapi_*
+entry points in Python, completes the asynchronous ones after a
+configurable latency, and serves generated result sets, so the pyngres
+layers can be exercised and benchmarked without an Ingres installation.
+'''
+
+
+import ctypes as C
+import datetime
+import itertools
+import struct
+import threading
+import time
+import os
+from .IIAPI_CONSTANTS import *
+from .IIAPI_PARM import *
+
+
+##  the OpenAPI invokes callbacks as callback(closure, parmBlock); this
+##  mirrors pyngres.IIapi_callback (which can't be imported from here)
+_callback = C.CFUNCTYPE( None, C.POINTER(C.py_object), IIAPI_GENPARM )
+
+
+class Column(object):
+    '''describe one column of a loopback result set'''
+
+    def __init__( self, name, dataType, length, precision=0, scale=0,
+        nullable=False, value=None ):
+        self.name = name if isinstance(name, bytes) else name.encode()
+        self.dataType = dataType
+        self.length = length
+        self.precision = precision
+        self.scale = scale
+        self.nullable = nullable
+        ##  value(row) returns the raw OpenAPI value of the column for the
+        ##  given row number, or None for NULL
+        self.value = value if value else _generator(self)
+
+
+class Result(object):
+    '''the shape and size of a loopback result set'''
+
+    def __init__( self, columns, rows ):
+        self.columns = columns
+        self.rows = rows
+
+
+##  the default settings can be overridden by envars
+settings = dict(
+    latency = float(os.environ.get('IIAPI_LOOPBACK_LATENCY', 0.0)),
+    rows = int(os.environ.get('IIAPI_LOOPBACK_ROWS', 100)),
+    capture = False,
+    ##  the most bytes of a long value in each segment
+    segment = IIAPI_SEGMENT_LEN,
+)
+results = {}
+failures = {}
+captured = []
+calls = {}
+
+
+def configure( latency=None, rows=None, columns=None, capture=None ):
+    '''change the simulated latency and the default result set'''
+
+    global _default
+    if latency is not None:
+        settings['latency'] = latency
+    if rows is not None:
+        settings['rows'] = rows
+    if capture is not None:
+        settings['capture'] = capture
+    if columns is not None:
+        _default = columns
+    _default_result.columns = _default
+    _default_result.rows = settings['rows']
+
+
+def define( queryText, columns, rows ):
+    '''serve a specific result set for a specific query text'''
+
+    results[_normalize(queryText)] = Result( columns, rows )
+
+
+def fail( queryText, message, SQLSTATE=II_SS42000_SYN_OR_ACCESSERR ):
+    '''make a specific query text fail with an error'''
+
+    failures[_normalize(queryText)] = (message, SQLSTATE)
+
+
+def flush_repeated():
+    '''forget every repeat query, as the DBMS does when it flushes them'''
+
+    for object in list(_handles.values()):
+        if isinstance(object, _Connection):
+            object.repeated.clear()
+            object.flushed = True
+
+
+def reset():
+    '''forget all configuration, captured parameters, and call counts'''
+
+    results.clear()
+    failures.clear()
+    captured.clear()
+    calls.clear()
+    configure( latency=0.0, rows=100, columns=_columns(), capture=False )
+
+
+def _normalize( queryText ):
+    if isinstance(queryText, str):
+        queryText = queryText.encode()
+    return b' '.join(queryText.split()).upper()
+
+
+##  raw value generators for the default result set
+
+_EPOCH = datetime.date(2000, 1, 1)
+
+def _generator( column ):
+    '''return a function generating raw values for the column'''
+
+    dataType = column.dataType
+    length = column.length
+    nullable = column.nullable
+
+    if dataType == IIAPI_INT_TYPE:
+        fmt = {1: '=b', 2: '=h', 4: '=i', 8: '=q'}[length]
+        limit = 1 << (8 * length - 1)
+        encode = lambda row: struct.pack(fmt, row % limit)
+    elif dataType == IIAPI_FLT_TYPE:
+        fmt = {4: '=f', 8: '=d'}[length]
+        encode = lambda row: struct.pack(fmt, row + 0.5)
+    elif dataType == IIAPI_MNY_TYPE:
+        encode = lambda row: struct.pack('=d', row * 100.0 + 25.0)
+    elif dataType == IIAPI_BOOL_TYPE:
+        encode = lambda row: bytes((row % 2,))
+    elif dataType in (IIAPI_CHA_TYPE, IIAPI_CHR_TYPE, IIAPI_BYTE_TYPE):
+        encode = lambda row: f'row {row}'.encode().ljust(length)[:length]
+    elif dataType in (IIAPI_VCH_TYPE, IIAPI_TXT_TYPE, IIAPI_LTXT_TYPE,
+        IIAPI_VBYTE_TYPE):
+        def encode( row ):
+            value = f'row {row}'.encode()[:length - 2]
+            return struct.pack('=H', len(value)) + value
+    elif dataType == IIAPI_NCHA_TYPE:
+        encode = lambda row: (f'row {row}'.ljust(length // 2)
+            .encode('utf-16-le')[:length])
+    elif dataType == IIAPI_NVCH_TYPE:
+        def encode( row ):
+            value = f'row {row}'[:(length - 2) // 2]
+            return (struct.pack('=H', len(value))
+                + value.encode('utf-16-le'))
+    elif dataType in (IIAPI_LVCH_TYPE, IIAPI_LBYTE_TYPE):
+        ##  the whole value (of length bytes), sent in segments
+        pattern = bytes(range(256))
+        def encode( row ):
+            start = row % 256
+            value = (pattern[start:] + pattern[:start]) * (length // 256 + 1)
+            return value[:length]
+    elif dataType == IIAPI_LNVCH_TYPE:
+        def encode( row ):
+            value = f'row {row} ' * (length // 8 + 1)
+            return value[:length // 2].encode('utf-16-le')
+    elif dataType == IIAPI_DEC_TYPE:
+        ##  packed decimal: row + 0.5 (scaled), sign nibble 0xC or 0xD
+        def encode( row ):
+            value = (row * 10 + 5) * 10 ** column.scale // 10
+            digits = str(value).rjust(length * 2 - 1, '0')[-(length * 2 - 1):]
+            return bytes.fromhex(digits + ('d' if row % 3 == 2 else 'c'))
+    elif dataType == IIAPI_DTE_TYPE:
+        ##  an absolute date and time, row days and seconds after 2000-01-01
+        def encode( row ):
+            day = _EPOCH + datetime.timedelta(days=row)
+            return struct.pack('=BBhhHi', 0x21, day.day >> 16, day.year,
+                day.month, day.day & 0xffff, (row % 86400) * 1000)
+    elif dataType == IIAPI_DATE_TYPE:
+        def encode( row ):
+            day = _EPOCH + datetime.timedelta(days=row)
+            return struct.pack('=hbB', day.year, day.month, day.day)
+    elif dataType in (IIAPI_TIME_TYPE, IIAPI_TMWO_TYPE, IIAPI_TMTZ_TYPE):
+        encode = lambda row: struct.pack('=iibb', row % 86400, row * 1000,
+            0, 0)
+    elif dataType in (IIAPI_TS_TYPE, IIAPI_TSWO_TYPE, IIAPI_TSTZ_TYPE):
+        def encode( row ):
+            day = _EPOCH + datetime.timedelta(days=row)
+            return struct.pack('=hbBiibb', day.year, day.month, day.day,
+                row % 86400, row * 1000, 0, 0)
+    else:
+        encode = lambda row: bytes(length)
+
+    if not nullable:
+        return encode
+    ##  every seventh row of a nullable column is NULL
+    return lambda row: None if row % 7 == 6 else encode(row)
+
+
+def _columns():
+    return [
+        Column( b'id', IIAPI_INT_TYPE, 4 ),
+        Column( b'name', IIAPI_VCH_TYPE, 34, nullable=True ),
+        Column( b'amount', IIAPI_FLT_TYPE, 8 ),
+    ]
+
+
+_default = _columns()
+_default_result = Result( _default, settings['rows'] )
+
+
+##  handles are opaque non-zero addresses to the application
+_handles = {}
+_next_handle = itertools.count(0x1000, 0x10)
+
+
+def _new_handle( object ):
+    handle = next(_next_handle)
+    _handles[handle] = object
+    return handle
+
+
+def _lookup( handle, kind ):
+    object = _handles.get(handle)
+    if not isinstance(object, kind):
+        raise _Failure( IIAPI_ST_INVALID_HANDLE, 'invalid handle' )
+    return object
+
+
+class _Failure(Exception):
+    '''abandon an OpenAPI operation with the given status'''
+
+    def __init__( self, status, message, SQLSTATE=II_SS50000_MISC_ING_ERRORS ):
+        super().__init__( message )
+        self.status = status
+        self.message = message
+        self.SQLSTATE = SQLSTATE
+
+
+class _Environment(object):
+    pass
+
+
+class _Connection(object):
+
+    def __init__( self, target ):
+        self.target = target
+        self.prepared = {}
+        ##  the query text of each repeat query handle
+        self.repeated = {}
+        ##  whether the next IIapi_getQueryInfo() reports the repeat
+        ##  queries were flushed
+        self.flushed = False
+        ##  the IDs of the IIapi_setConnectParam() parameters, in order
+        self.parameters = []
+
+
+class _Transaction(object):
+
+    def __init__( self, connection ):
+        self.connection = connection
+
+
+class _Statement(object):
+
+    def __init__( self, connection, queryType, queryText, parameters ):
+        self.connection = connection
+        self.queryType = queryType
+        self.queryText = queryText
+        self.parameters = parameters
+        self.result = None
+        self.descriptors = None
+        self.row = 0
+        self.column = 0
+        self.rowCount = 0
+        self.parmDescr = []
+        self.parmValues = []
+        self.segments = []
+        ##  the row counts of the statements of a batch, still to be
+        ##  reported by IIapi_getQueryInfo()
+        self.batch = None
+        ##  the Result describing the table of a COPY statement
+        self.copy = None
+        self.copyFrom = False
+        ##  the number of service parameters (the repeat query handle) still
+        ##  to arrive, and whether the handle was unknown
+        self.service = 0
+        self.unknown = False
+        ##  the long value being sent in segments, and how much of it has
+        self.lob = None
+        self.offset = 0
+
+
+class _Errors(object):
+    '''the error information reported by IIapi_getErrorInfo()'''
+
+    def __init__( self, failure ):
+        self.messages = [failure]
+
+
+_PARMS = {
+    'IIapi_abort': IIAPI_ABORTPARM,
+    'IIapi_autocommit': IIAPI_AUTOPARM,
+    'IIapi_batch': IIAPI_BATCHPARM,
+    'IIapi_cancel': IIAPI_CANCELPARM,
+    'IIapi_catchEvent': IIAPI_CATCHEVENTPARM,
+    'IIapi_close': IIAPI_CLOSEPARM,
+    'IIapi_commit': IIAPI_COMMITPARM,
+    'IIapi_connect': IIAPI_CONNPARM,
+    'IIapi_disconnect': IIAPI_DISCONNPARM,
+    'IIapi_getColumns': IIAPI_GETCOLPARM,
+    'IIapi_getCopyMap': IIAPI_GETCOPYMAPPARM,
+    'IIapi_getDescriptor': IIAPI_GETDESCRPARM,
+    'IIapi_getEvent': IIAPI_GETEVENTPARM,
+    'IIapi_getQueryInfo': IIAPI_GETQINFOPARM,
+    'IIapi_modifyConnect': IIAPI_MODCONNPARM,
+    'IIapi_position': IIAPI_POSPARM,
+    'IIapi_prepareCommit': IIAPI_PREPCMTPARM,
+    'IIapi_putColumns': IIAPI_PUTCOLPARM,
+    'IIapi_putParms': IIAPI_PUTPARMPARM,
+    'IIapi_query': IIAPI_QUERYPARM,
+    'IIapi_rollback': IIAPI_ROLLBACKPARM,
+    'IIapi_savePoint': IIAPI_SAVEPTPARM,
+    'IIapi_scroll': IIAPI_SCROLLPARM,
+    'IIapi_setConnectParam': IIAPI_SETCONPRMPARM,
+    'IIapi_setDescriptor': IIAPI_SETDESCRPARM,
+    'IIapi_xaCommit': IIAPI_XACOMMITPARM,
+    'IIapi_xaStart': IIAPI_XASTARTPARM,
+    'IIapi_xaEnd': IIAPI_XAENDPARM,
+    'IIapi_xaPrepare': IIAPI_XAPREPPARM,
+    'IIapi_xaRollback': IIAPI_XAROLLPARM,
+}
+
+
+##  asynchronous operations are queued per thread: like the real OpenAPI,
+##  only the thread that made a request can complete it with IIapi_wait()
+_local = threading.local()
+
+
+def _queue():
+    try:
+        return _local.queue
+    except AttributeError:
+        _local.queue = []
+        return _local.queue
+
+
+def _parm( pcb ):
+    '''accept a parameter block or a pointer to one'''
+
+    return pcb.contents if hasattr(pcb, 'contents') else pcb
+
+
+def _count( name ):
+    calls[name] = calls.get(name, 0) + 1
+
+
+def _schedule( name, pcb, operation ):
+    '''start an asynchronous operation; operation() runs on completion'''
+
+    _count(name)
+    pcb = _parm(pcb)
+    if not isinstance(pcb, _PARMS[name]):
+        ##  as ctypes would, given the argtypes of the real function
+        raise C.ArgumentError( f'{name}() expects {_PARMS[name].__name__}' )
+    genParm = pcb._genParm
+    genParm.gp_completed = False
+    genParm.gp_status = IIAPI_ST_SUCCESS
+    genParm.gp_errorHandle = None
+    due = time.perf_counter() + settings['latency']
+    _queue().append( (due, pcb, genParm, operation) )
+
+
+def _complete( pcb, genParm, operation ):
+    try:
+        status = operation( pcb )
+    except _Failure as failure:
+        status = failure.status
+        genParm.gp_errorHandle = _new_handle( _Errors(failure) )
+    genParm.gp_status = status or IIAPI_ST_SUCCESS
+    genParm.gp_completed = True
+    if genParm.gp_callback:
+        callback = _callback( genParm.gp_callback )
+        closure = C.cast( C.c_void_p(genParm.gp_closure),
+            C.POINTER(C.py_object) )
+        callback( closure, genParm )
+
+
+def IIapi_wait( wtp ):
+    '''complete the operations of this thread that are due'''
+
+    _count('IIapi_wait')
+    wtp = _parm(wtp)
+    queue = _queue()
+    wtp.wt_status = IIAPI_ST_SUCCESS
+    if not queue:
+        return
+    now = time.perf_counter()
+    due = min(operation[0] for operation in queue)
+    if due > now:
+        timeout = wtp.wt_timeout
+        delay = due - now
+        if timeout >= 0:
+            delay = min(delay, timeout / 1000.0)
+        if delay > 0:
+            time.sleep(delay)
+        now = time.perf_counter()
+    ready = [operation for operation in queue if operation[0] <= now]
+    if not ready:
+        wtp.wt_status = IIAPI_ST_FAILURE
+        return
+    queue[:] = [operation for operation in queue if operation[0] > now]
+    for due, pcb, genParm, operation in ready:
+        _complete( pcb, genParm, operation )
+
+
+def _describe( columns, columnType=IIAPI_COL_TUPLE ):
+    '''return an IIAPI_DESCRIPTOR array describing the columns'''
+
+    descriptors = (IIAPI_DESCRIPTOR * len(columns))()
+    for descriptor, column in zip(descriptors, columns):
+        descriptor.ds_dataType = column.dataType
+        descriptor.ds_nullable = column.nullable
+        descriptor.ds_length = column.length
+        descriptor.ds_precision = column.precision
+        descriptor.ds_scale = column.scale
+        descriptor.ds_columnType = columnType
+        descriptor.ds_columnName = column.name
+    return descriptors
+
+
+def _copy_value( datavalue, value ):
+    '''copy a raw value (or None for NULL) into an IIAPI_DATAVALUE'''
+
+    if value is None:
+        datavalue.dv_null = True
+        datavalue.dv_length = 0
+        return
+    datavalue.dv_null = False
+    datavalue.dv_length = len(value)
+    C.memmove( datavalue.dv_value, value, len(value) )
+
+
+def _read_value( datavalue ):
+    '''copy a raw value (or None for NULL) out of an IIAPI_DATAVALUE'''
+
+    if datavalue.dv_null:
+        return None
+    return C.string_at( datavalue.dv_value, datavalue.dv_length )
+
+
+##  synchronous entry points
+
+def IIapi_initialize( inp ):
+    _count('IIapi_initialize')
+    inp = _parm(inp)
+    inp.in_envHandle = _new_handle( _Environment() )
+    inp.in_status = IIAPI_ST_SUCCESS
+
+
+def IIapi_terminate( tmp ):
+    _count('IIapi_terminate')
+    _parm(tmp).tm_status = IIAPI_ST_SUCCESS
+
+
+def IIapi_releaseEnv( rep ):
+    _count('IIapi_releaseEnv')
+    rep = _parm(rep)
+    _handles.pop( rep.re_envHandle, None )
+    rep.re_status = IIAPI_ST_SUCCESS
+
+
+def IIapi_setEnvParam( sep ):
+    _count('IIapi_setEnvParam')
+    sep = _parm(sep)
+    if sep.se_paramID == IIAPI_EP_MAX_SEGMENT_LEN:
+        settings['segment'] = C.c_int32.from_address( sep.se_paramValue ).value
+    sep.se_status = IIAPI_ST_SUCCESS
+
+
+def IIapi_registerXID( rgp ):
+    _count('IIapi_registerXID')
+    rgp = _parm(rgp)
+    rgp.rg_tranIdHandle = _new_handle( _Environment() )
+    rgp.rg_status = IIAPI_ST_SUCCESS
+
+
+def IIapi_releaseXID( rlp ):
+    _count('IIapi_releaseXID')
+    rlp = _parm(rlp)
+    _handles.pop( rlp.rl_tranIdHandle, None )
+    rlp.rl_status = IIAPI_ST_SUCCESS
+
+
+def IIapi_getColumnInfo( gip ):
+    _count('IIapi_getColumnInfo')
+    gip = _parm(gip)
+    gip.gi_mask = 0
+    gip.gi_status = IIAPI_ST_SUCCESS
+
+
+def IIapi_getErrorInfo( gep ):
+    _count('IIapi_getErrorInfo')
+    gep = _parm(gep)
+    errors = _handles.get( gep.ge_errorHandle )
+    if not isinstance(errors, _Errors) or not errors.messages:
+        gep.ge_status = IIAPI_ST_NO_DATA
+        return
+    failure = errors.messages.pop(0)
+    gep.ge_type = IIAPI_GE_ERROR
+    gep.ge_SQLSTATE = failure.SQLSTATE.encode()
+    gep.ge_errorCode = failure.status
+    gep.ge_message = failure.message.encode()
+    gep.ge_serverInfoAvail = False
+    gep.ge_status = IIAPI_ST_SUCCESS
+
+
+def IIapi_convertData( cvp ):
+    '''convert numeric and character values to character'''
+
+    _count('IIapi_convertData')
+    cvp = _parm(cvp)
+    source = _read_value( cvp.cv_srcValue )
+    if source is None:
+        cvp.cv_dstValue.dv_null = True
+        cvp.cv_status = IIAPI_ST_SUCCESS
+        return
+    srcType = cvp.cv_srcDesc.ds_dataType
+    if srcType == IIAPI_INT_TYPE:
+        fmt = {1: '=b', 2: '=h', 4: '=i', 8: '=q'}[len(source)]
+        text = str(struct.unpack(fmt, source)[0])
+    elif srcType == IIAPI_FLT_TYPE:
+        fmt = {4: '=f', 8: '=d'}[len(source)]
+        text = repr(struct.unpack(fmt, source)[0])
+    elif srcType in IIAPI_VAR_TYPES or srcType == IIAPI_TXT_TYPE:
+        text = source[2:].decode()
+    else:
+        text = source.decode()
+    value = text.encode()
+    dstLength = cvp.cv_dstDesc.ds_length
+    if cvp.cv_dstDesc.ds_dataType in IIAPI_VAR_TYPES:
+        value = value[:dstLength - 2]
+        value = struct.pack('=H', len(value)) + value
+    else:
+        value = value.ljust(dstLength)[:dstLength]
+    _copy_value( cvp.cv_dstValue, value )
+    cvp.cv_status = IIAPI_ST_SUCCESS
+
+
+def IIapi_formatData( fdp ):
+    _count('IIapi_formatData')
+    fdp = _parm(fdp)
+    cvp = IIAPI_CONVERTPARM()
+    cvp.cv_srcDesc = fdp.fd_srcDesc
+    cvp.cv_srcValue = fdp.fd_srcValue
+    cvp.cv_dstDesc = fdp.fd_dstDesc
+    cvp.cv_dstValue = fdp.fd_dstValue
+    IIapi_convertData( cvp )
+    fdp.fd_dstValue = cvp.cv_dstValue
+    fdp.fd_status = cvp.cv_status
+
+
+##  asynchronous entry points
+
+def IIapi_connect( cop ):
+    def connect( cop ):
+        if isinstance(_handles.get(cop.co_connHandle), _Connection):
+            ##  the handle came from IIapi_setConnectParam()
+            _handles[cop.co_connHandle].target = cop.co_target
+        else:
+            cop.co_connHandle = _new_handle( _Connection(cop.co_target) )
+        cop.co_tranHandle = None
+        cop.co_apiLevel = IIAPI_LEVEL_5
+    _schedule( 'IIapi_connect', cop, connect )
+
+
+def IIapi_disconnect( dcp ):
+    def disconnect( dcp ):
+        _lookup( dcp.dc_connHandle, _Connection )
+        _handles.pop( dcp.dc_connHandle )
+    _schedule( 'IIapi_disconnect', dcp, disconnect )
+
+
+def IIapi_abort( abp ):
+    def abort( abp ):
+        _handles.pop( abp.ab_connHandle, None )
+    _schedule( 'IIapi_abort', abp, abort )
+
+
+def IIapi_modifyConnect( mcp ):
+    def modify( mcp ):
+        _lookup( mcp.mc_connHandle, _Connection )
+    _schedule( 'IIapi_modifyConnect', mcp, modify )
+
+
+def IIapi_setConnectParam( scp ):
+    def set( scp ):
+        if not isinstance(_handles.get(scp.sc_connHandle), _Connection):
+            ##  the first parameter for a connection (given no handle, or
+            ##  the environment handle) creates its handle
+            scp.sc_connHandle = _new_handle( _Connection(None) )
+        _handles[scp.sc_connHandle].parameters.append( scp.sc_paramID )
+    _schedule( 'IIapi_setConnectParam', scp, set )
+
+
+def IIapi_autocommit( acp ):
+    def autocommit( acp ):
+        if acp.ac_tranHandle:
+            _handles.pop( acp.ac_tranHandle, None )
+            acp.ac_tranHandle = None
+        else:
+            connection = _lookup( acp.ac_connHandle, _Connection )
+            acp.ac_tranHandle = _new_handle( _Transaction(connection) )
+    _schedule( 'IIapi_autocommit', acp, autocommit )
+
+
+def _end_transaction( tranHandle ):
+    transaction = _lookup( tranHandle, _Transaction )
+    _handles.pop( tranHandle )
+    ##  statements prepared in the transaction are discarded with it
+    prepared = transaction.connection.prepared
+    for name, (queryText, preparedIn) in list(prepared.items()):
+        if preparedIn == tranHandle:
+            del prepared[name]
+
+
+def IIapi_commit( cmp ):
+    def commit( cmp ):
+        _end_transaction( cmp.cm_tranHandle )
+    _schedule( 'IIapi_commit', cmp, commit )
+
+
+def IIapi_rollback( rbp ):
+    def rollback( rbp ):
+        if rbp.rb_savePointHandle:
+            _lookup( rbp.rb_tranHandle, _Transaction )
+        else:
+            _end_transaction( rbp.rb_tranHandle )
+    _schedule( 'IIapi_rollback', rbp, rollback )
+
+
+def IIapi_savePoint( spp ):
+    def savepoint( spp ):
+        _lookup( spp.sp_tranHandle, _Transaction )
+        spp.sp_savePointHandle = _new_handle( _Environment() )
+    _schedule( 'IIapi_savePoint', spp, savepoint )
+
+
+def IIapi_prepareCommit( prp ):
+    def prepare( prp ):
+        _lookup( prp.pr_tranHandle, _Transaction )
+    _schedule( 'IIapi_prepareCommit', prp, prepare )
+
+
+def _transaction( connection, tranHandle ):
+    '''return the transaction handle, starting a transaction if need be'''
+
+    if tranHandle:
+        _lookup( tranHandle, _Transaction )
+        return tranHandle
+    return _new_handle( _Transaction(connection) )
+
+
+def _copy( queryText ):
+    '''return (Result, copyFrom) for a COPY ... FROM|INTO PROGRAM statement'''
+
+    ##  the table is described by the Result defined for the statement,
+    ##  or is the default result set
+    key = _normalize( queryText or b'' )
+    words = key.split()
+    if not words or words[0] != b'COPY':
+        return None, False
+    if words[-1] != b'PROGRAM' or words[-2] not in (b'FROM', b'INTO'):
+        raise _Failure( IIAPI_ST_ERROR, 'only COPY ... FROM|INTO PROGRAM '
+            'is supported', II_SS42000_SYN_OR_ACCESSERR )
+    return results.get(key, _default_result), words[-2] == b'FROM'
+
+
+def _result( queryType, queryText ):
+    '''return the Result (if any) a query produces'''
+
+    key = _normalize( queryText or b'' )
+    if key in results:
+        return results[key]
+    if queryType in (IIAPI_QT_OPEN, IIAPI_QT_SELECT_SINGLETON):
+        return _default_result
+    if key.startswith(b'SELECT'):
+        return _default_result
+    return None
+
+
+def _prepared( connection, queryType, queryText ):
+    '''return the text of a prepared statement being executed or opened'''
+
+    words = (queryText or b'').split()
+    if queryType == IIAPI_QT_EXEC:
+        if len(words) != 2 or words[0].upper() != b'EXECUTE':
+            return queryText
+        name = words[1]
+    elif queryType == IIAPI_QT_OPEN and len(words) == 1:
+        name = words[0]
+    else:
+        return queryText
+    if name not in connection.prepared:
+        raise _Failure( IIAPI_ST_ERROR, f'statement {name.decode()} is not '
+            'prepared', II_SS26000_INV_SQL_STMT_NAME )
+    return connection.prepared[name][0]
+
+
+def _repeat( statement, value ):
+    '''resolve the handle of a repeat query being executed'''
+
+    handle = struct.unpack( 'P', value )[0]
+    queryText = statement.connection.repeated.get( handle )
+    if queryText is None:
+        ##  the DBMS reports it rather than failing the query
+        statement.unknown = True
+        return
+    key = _normalize( queryText )
+    if key in failures:
+        message, SQLSTATE = failures[key]
+        raise _Failure( IIAPI_ST_ERROR, message, SQLSTATE )
+    statement.queryText = queryText
+    statement.result = _result( IIAPI_QT_QUERY, queryText )
+
+
+def IIapi_query( qyp ):
+    def query( qyp ):
+        connection = _lookup( qyp.qy_connHandle, _Connection )
+        queryText = _prepared( connection, qyp.qy_queryType,
+            qyp.qy_queryText )
+        key = _normalize( queryText or b'' )
+        if key in failures:
+            message, SQLSTATE = failures[key]
+            raise _Failure( IIAPI_ST_ERROR, message, SQLSTATE )
+        qyp.qy_tranHandle = _transaction( connection, qyp.qy_tranHandle )
+        if key.startswith(b'PREPARE '):
+            ##  PREPARE name FROM statement
+            name, FROM, text = queryText.split( None, 3 )[1:]
+            connection.prepared[name] = (text, qyp.qy_tranHandle)
+        statement = _Statement( connection, qyp.qy_queryType, queryText,
+            qyp.qy_parameters )
+        statement.copy, statement.copyFrom = _copy( queryText )
+        if qyp.qy_queryType in (IIAPI_QT_DEF_REPEAT_QUERY,
+            IIAPI_QT_EXEC_REPEAT_QUERY):
+            ##  a repeat query is executed once its handle arrives
+            pass
+        elif statement.copy is None:
+            statement.result = _result( qyp.qy_queryType, queryText )
+        elif not statement.copyFrom:
+            ##  the rows of a COPY INTO are fetched like a result set
+            statement.result = statement.copy
+        qyp.qy_stmtHandle = _new_handle( statement )
+    _schedule( 'IIapi_query', qyp, query )
+
+
+def IIapi_setDescriptor( sdp ):
+    def set( sdp ):
+        statement = _lookup( sdp.sd_stmtHandle, _Statement )
+        descriptors = [sdp.sd_descriptor[i]
+            for i in range(sdp.sd_descriptorCount)]
+        statement.service = sum(1 for descriptor in descriptors
+            if descriptor.ds_columnType == IIAPI_COL_SVCPARM)
+        statement.parmDescr = [ (descriptor.ds_dataType,
+            descriptor.ds_length) for descriptor in descriptors
+            if descriptor.ds_columnType != IIAPI_COL_SVCPARM ]
+    _schedule( 'IIapi_setDescriptor', sdp, set )
+
+
+def IIapi_putParms( ppp ):
+    def put( ppp ):
+        statement = _lookup( ppp.pp_stmtHandle, _Statement )
+        for i in range(ppp.pp_parmCount):
+            value = _read_value( ppp.pp_parmData[i] )
+            if statement.service:
+                statement.service -= 1
+                _repeat( statement, value )
+                continue
+            index = len(statement.parmValues)
+            if (value is not None and index < len(statement.parmDescr)
+                and statement.parmDescr[index][0] in IIAPI_LONG_TYPES):
+                ##  a long value arrives in segments (each starting with
+                ##  its length), which are only kept to be captured
+                if settings['capture']:
+                    statement.segments.append( value[2:] )
+                if ppp.pp_moreSegments:
+                    continue
+                value = b''.join(statement.segments)
+                statement.segments = []
+            statement.parmValues.append( value )
+        if (statement.queryType == IIAPI_QT_DEF_REPEAT_QUERY
+            or statement.unknown):
+            ##  the parameters only describe the repeat query (or it
+            ##  isn't executed)
+            statement.parmValues = []
+        elif len(statement.parmValues) >= len(statement.parmDescr):
+            statement.rowCount += 1
+            if settings['capture']:
+                captured.append( tuple(statement.parmValues) )
+            statement.parmValues = []
+    _schedule( 'IIapi_putParms', ppp, put )
+
+
+def IIapi_getDescriptor( gdp ):
+    def get( gdp ):
+        statement = _lookup( gdp.gd_stmtHandle, _Statement )
+        result = statement.result
+        if result is None:
+            gdp.gd_descriptorCount = 0
+            gdp.gd_descriptor = None
+            return IIAPI_ST_NO_DATA
+        if statement.descriptors is None:
+            statement.descriptors = _describe( result.columns )
+        gdp.gd_descriptorCount = len(result.columns)
+        gdp.gd_descriptor = statement.descriptors
+    _schedule( 'IIapi_getDescriptor', gdp, get )
+
+
+def _segment( statement, column, datavalue ):
+    '''copy the next segment of a long value; return whether more follow'''
+
+    if statement.lob is None:
+        statement.lob = column.value( statement.row )
+        statement.offset = 0
+        if statement.lob is None:
+            _copy_value( datavalue, None )
+            return False
+    lob = statement.lob
+    segment = lob[statement.offset:statement.offset + settings['segment']]
+    statement.offset += len(segment)
+    ##  the length of an IIAPI_LNVCH_TYPE segment is in characters
+    length = len(segment)
+    if column.dataType == IIAPI_LNVCH_TYPE:
+        length //= 2
+    _copy_value( datavalue, struct.pack('=H', length) + segment )
+    if statement.offset < len(lob):
+        return True
+    statement.lob = None
+    return False
+
+
+def IIapi_getColumns( gcp ):
+    def get( gcp ):
+        statement = _lookup( gcp.gc_stmtHandle, _Statement )
+        result = statement.result
+        gcp.gc_rowsReturned = 0
+        gcp.gc_moreSegments = False
+        if result is None or statement.row >= result.rows:
+            return IIAPI_ST_NO_DATA
+        columns = result.columns
+        count = gcp.gc_columnCount
+        rows = min(gcp.gc_rowCount, result.rows - statement.row)
+        span = range(statement.column, statement.column + count)
+        if any(columns[c].dataType in IIAPI_LONG_TYPES for c in span):
+            ##  long values are fetched a row (and a segment) at a time
+            for index, c in enumerate(span):
+                if columns[c].dataType not in IIAPI_LONG_TYPES:
+                    _copy_value( gcp.gc_columnData[index],
+                        columns[c].value(statement.row) )
+                elif _segment( statement, columns[c],
+                    gcp.gc_columnData[index] ):
+                    ##  the column stays current until its last segment
+                    gcp.gc_moreSegments = True
+                    gcp.gc_rowsReturned = 1
+                    return
+                statement.column += 1
+            if statement.column >= len(columns):
+                statement.column = 0
+                statement.row += 1
+            gcp.gc_rowsReturned = 1
+            statement.rowCount = statement.row
+            return
+        index = 0
+        for r in range(rows):
+            row = statement.row
+            for c in range(statement.column, statement.column + count):
+                value = columns[c].value( row )
+                _copy_value( gcp.gc_columnData[index], value )
+                index += 1
+            statement.column += count
+            if statement.column >= len(columns):
+                statement.column = 0
+                statement.row += 1
+        gcp.gc_rowsReturned = rows
+        statement.rowCount = statement.row
+    _schedule( 'IIapi_getColumns', gcp, get )
+
+
+def IIapi_getQueryInfo( gqp ):
+    def get( gqp ):
+        statement = _lookup( gqp.gq_stmtHandle, _Statement )
+        gqp.gq_flags = 0
+        gqp.gq_mask = IIAPI_GQ_ROW_COUNT
+        if statement.batch is not None:
+            ##  each call reports on the next statement of the batch
+            if not statement.batch:
+                gqp.gq_mask = 0
+                return IIAPI_ST_NO_DATA
+            gqp.gq_rowCount = statement.batch.pop(0)
+            return
+        gqp.gq_rowCount = statement.rowCount
+        connection = statement.connection
+        if connection.flushed:
+            connection.flushed = False
+            gqp.gq_flags |= IIAPI_GQF_FLUSH_QUERY_ID
+        if statement.queryType == IIAPI_QT_DEF_REPEAT_QUERY:
+            handle = next(_next_handle)
+            connection.repeated[handle] = statement.queryText
+            gqp.gq_mask |= IIAPI_GQ_REPEAT_QUERY_ID
+            gqp.gq_repeatQueryHandle = handle
+            gqp.gq_rowCount = 0
+        elif statement.unknown:
+            gqp.gq_flags |= IIAPI_GQF_UNKNOWN_REPEAT_QUERY
+        elif statement.result is not None:
+            if statement.row >= statement.result.rows:
+                gqp.gq_flags |= IIAPI_GQF_END_OF_DATA
+        elif statement.parmDescr == [] and statement.rowCount == 0:
+            ##  statements with no result and no parameters affect one row
+            if _normalize(statement.queryText or b'').startswith(
+                (b'INSERT', b'UPDATE', b'DELETE')):
+                gqp.gq_rowCount = 1
+    _schedule( 'IIapi_getQueryInfo', gqp, get )
+
+
+def IIapi_cancel( cnp ):
+    def cancel( cnp ):
+        statement = _lookup( cnp.cn_stmtHandle, _Statement )
+        if statement.result is not None:
+            statement.row = statement.result.rows
+    _schedule( 'IIapi_cancel', cnp, cancel )
+
+
+def IIapi_close( clp ):
+    def close( clp ):
+        _lookup( clp.cl_stmtHandle, _Statement )
+        _handles.pop( clp.cl_stmtHandle )
+    _schedule( 'IIapi_close', clp, close )
+
+
+def IIapi_position( pop ):
+    def position( pop ):
+        _lookup( pop.po_stmtHandle, _Statement )
+    _schedule( 'IIapi_position', pop, position )
+
+
+def IIapi_scroll( slp ):
+    def scroll( slp ):
+        _lookup( slp.sl_stmtHandle, _Statement )
+    _schedule( 'IIapi_scroll', slp, scroll )
+
+
+def IIapi_putColumns( pcp ):
+    def put( pcp ):
+        statement = _lookup( pcp.pc_stmtHandle, _Statement )
+        if statement.copy is None or not statement.copyFrom:
+            raise _Failure( IIAPI_ST_ERROR, 'not a COPY FROM statement' )
+        ##  any number of whole rows can be sent at a time
+        count = len(statement.copy.columns)
+        if pcp.pc_columnCount % count:
+            raise _Failure( IIAPI_ST_ERROR, f'{pcp.pc_columnCount} columns '
+                f'sent for rows of {count}' )
+        values = [ _read_value(pcp.pc_columnData[i])
+            for i in range(pcp.pc_columnCount) ]
+        for i in range(0, len(values), count):
+            statement.rowCount += 1
+            if settings['capture']:
+                captured.append( tuple(values[i:i + count]) )
+    _schedule( 'IIapi_putColumns', pcp, put )
+
+
+def IIapi_getCopyMap( gmp ):
+    def get( gmp ):
+        statement = _lookup( gmp.gm_stmtHandle, _Statement )
+        if statement.copy is None:
+            raise _Failure( IIAPI_ST_ERROR, 'not a COPY statement' )
+        if statement.descriptors is None:
+            statement.descriptors = _describe( statement.copy.columns )
+        copyMap = gmp.gm_copyMap
+        copyMap.cp_copyFrom = statement.copyFrom
+        copyMap.cp_flags = 0
+        copyMap.cp_errorCount = 0
+        copyMap.cp_fileName = None
+        copyMap.cp_logName = None
+        copyMap.cp_dbmsCount = len(statement.copy.columns)
+        copyMap.cp_dbmsDescr = statement.descriptors
+        copyMap.cp_fileCount = 0
+        copyMap.cp_fileDescr = None
+    _schedule( 'IIapi_getCopyMap', gmp, get )
+
+
+def IIapi_batch( bap ):
+    def batch( bap ):
+        connection = _lookup( bap.ba_connHandle, _Connection )
+        queryText = bap.ba_queryText
+        key = _normalize( queryText or b'' )
+        if key in failures:
+            message, SQLSTATE = failures[key]
+            raise _Failure( IIAPI_ST_ERROR, message, SQLSTATE )
+        bap.ba_tranHandle = _transaction( connection, bap.ba_tranHandle )
+        if bap.ba_stmtHandle:
+            ##  add the statement to the batch
+            statement = _lookup( bap.ba_stmtHandle, _Statement )
+        else:
+            statement = _Statement( connection, bap.ba_queryType, queryText,
+                bap.ba_parameters )
+            statement.batch = []
+            bap.ba_stmtHandle = _new_handle( statement )
+        ##  every statement of a batch affects one row
+        statement.batch.append( 1 )
+    _schedule( 'IIapi_batch', bap, batch )
+
+
+def IIapi_catchEvent( cep ):
+    def catch( cep ):
+        return IIAPI_ST_NO_DATA
+    _schedule( 'IIapi_catchEvent', cep, catch )
+
+
+def IIapi_getEvent( gvp ):
+    def get( gvp ):
+        return IIAPI_ST_NO_DATA
+    _schedule( 'IIapi_getEvent', gvp, get )
+
+
+def _xa( name ):
+    def xa( pcb ):
+        _schedule( name, pcb, lambda pcb: None )
+    xa.__name__ = name
+    return xa
+
+
+def IIapi_xaStart( xsp ):
+    def start( xsp ):
+        connection = _lookup( xsp.xs_connHandle, _Connection )
+        xsp.xs_tranHandle = _new_handle( _Transaction(connection) )
+    _schedule( 'IIapi_xaStart', xsp, start )
+
+
+IIapi_xaCommit = _xa('IIapi_xaCommit')
+IIapi_xaEnd = _xa('IIapi_xaEnd')
+IIapi_xaPrepare = _xa('IIapi_xaPrepare')
+IIapi_xaRollback = _xa('IIapi_xaRollback')
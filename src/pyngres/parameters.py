@@ -0,0 +1,457 @@
+##  Copyright (c) 2024 Rational Commerce Ltd.
+
+'''
+describe and send Python values as OpenAPI query parameters
+
+A Parameters object owns an IIAPI_SETDESCRPARM and an IIAPI_PUTPARMPARM
+for one set of parameters, and encodes a row of Python values into them:
+
+    parameters = Parameters( 2 )
+    parameters.set( ('Smith', 42) )
+    parameters.bind( stmtHandle )
+    IIapi_setDescriptor( parameters.sdp )
+    IIapi_putParms( parameters.ppp )
+
+The OpenAPI data type of each parameter is chosen from the Python type of
+its value; None is sent as a typeless NULL, and a Handle (e.g. the handle
+of a repeat query) as an IIAPI_COL_SVCPARM service parameter. A
+PackedDecimal (see pyngres.arrays.packed_decimals()) is sent as it is.
+
+A Lob is a long value (of any size) read from a file or an iterator and
+sent in segments, so it is never all in memory. A parameter set with a Lob
+takes more than one IIapi_putParms(): the parameters before it, then each
+segment (with pp_moreSegments set on all but the last), then the rest.
+puts() sets up the IIAPI_PUTPARMPARM for each call in turn:
+
+    parameters.set( (name, Lob(open(path, 'rb'))) )
+    ...
+    for ppp in parameters.puts():
+        IIapi_putParms( ppp )
+
+While each segment is sent a thread reads ahead from the source, so that
+reading a file overlaps sending it.
+'''
+
+
+import ctypes as C
+import datetime
+import decimal
+import queue
+import struct
+import threading
+from .IIAPI_CONSTANTS import *
+from .IIAPI_PARM import *
+from . import datatypes
+
+
+##  the longest value that can be sent without segmenting it
+IIAPI_MAX_PARM_LEN = 32000
+
+_INT8 = struct.Struct('=q')
+_POINTER = struct.Struct('P')
+_FLOAT8 = struct.Struct('=d')
+_LENGTH = struct.Struct('=H')
+
+##  each value is aligned for the widest of the binary types
+_ALIGNMENT = 8
+
+
+##  the bytes read from a Lob's source at a time, unless it says otherwise
+_READ_SIZE = 1 << 20
+
+
+class Handle(int):
+    '''an OpenAPI handle, sent as a service parameter'''
+
+
+class PackedDecimal(bytes):
+    '''an IIAPI_DEC_TYPE value, already packed'''
+
+    def __new__( cls, raw, precision, scale ):
+        value = super().__new__( cls, raw )
+        value.precision = precision
+        value.scale = scale
+        return value
+
+
+class Lob(object):
+    '''a long value read from a file or an iterator, sent in segments'''
+
+    ##  the source is a binary or text file (anything with read()), or an
+    ##  iterable of bytes or str chunks; str is encoded as UTF-8, or UTF-16
+    ##  for IIAPI_LNVCH_TYPE. Each segment holds segmentLength bytes (but
+    ##  the last), and the source is read readSize bytes at a time
+
+    def __init__( self, source, dataType=IIAPI_LBYTE_TYPE,
+        segmentLength=None, readSize=None, prefetch=True ):
+        if dataType not in (IIAPI_LBYTE_TYPE, IIAPI_LVCH_TYPE,
+            IIAPI_LNVCH_TYPE):
+            raise ValueError('a Lob must be an IIAPI_LBYTE_TYPE, '
+                'IIAPI_LVCH_TYPE or IIAPI_LNVCH_TYPE value')
+        self.source = source
+        self.dataType = dataType
+        self.segmentLength = segmentLength or (IIAPI_MAX_PARM_LEN
+            - _LENGTH.size)
+        if not 0 < self.segmentLength <= IIAPI_MAX_PARM_LEN - _LENGTH.size:
+            raise ValueError(f'a segment can hold 1 to '
+                f'{IIAPI_MAX_PARM_LEN - _LENGTH.size} bytes')
+        ##  a Unicode segment has to hold whole UTF-16 characters
+        self.unit = 2 if dataType == IIAPI_LNVCH_TYPE else 1
+        self.segmentLength -= self.segmentLength % self.unit
+        self.readSize = readSize or _READ_SIZE
+        self.prefetch = prefetch
+        ##  the bytes sent so far
+        self.length = 0
+        ##  where a seekable source starts, so it can be read again
+        try:
+            self.start = source.tell() if source.seekable() else None
+        except (AttributeError, OSError, ValueError):
+            self.start = None
+
+
+    def rewind( self ):
+        '''read the source again from the start, to send the value again;
+        return False if it can't be read again'''
+
+        source = self.source
+        if self.start is not None:
+            source.seek( self.start )
+        elif hasattr(source, 'read') or iter(source) is source:
+            ##  a stream that can't seek, or an iterator, has been used up
+            return False
+        self.length = 0
+        return True
+
+
+    def _encode( self, chunk ):
+        if isinstance(chunk, str):
+            return chunk.encode( 'utf-16-le' if self.unit == 2 else 'utf-8' )
+        return chunk
+
+
+    def _chunks( self ):
+        ##  the (non-empty) chunks of the source
+        source = self.source
+        read = getattr(source, 'read', None)
+        if read is not None:
+            while True:
+                chunk = self._encode( read(self.readSize) )
+                if not chunk:
+                    return
+                yield chunk
+        else:
+            for chunk in source:
+                chunk = self._encode( chunk )
+                if chunk:
+                    yield chunk
+
+
+    def _prefetched( self ):
+        ##  the chunks, read by a thread while the one before is sent; one
+        ##  is queued, and one more read, at a time
+        chunks = queue.Queue( 1 )
+        stop = threading.Event()
+
+        def read():
+            try:
+                for chunk in self._chunks():
+                    chunks.put( chunk )
+                    if stop.is_set():
+                        return
+                chunks.put( None )
+            except BaseException as exception:
+                chunks.put( exception )
+
+        thread = threading.Thread( target=read, name='pyngres Lob',
+            daemon=True )
+        thread.start()
+        try:
+            while True:
+                chunk = chunks.get()
+                if chunk is None:
+                    return
+                if isinstance(chunk, BaseException):
+                    raise chunk
+                yield chunk
+        finally:
+            ##  let the thread finish if the value is abandoned
+            stop.set()
+            try:
+                chunks.get_nowait()
+            except queue.Empty:
+                pass
+
+
+    def segments( self ):
+        '''yield each segment (a memoryview), and whether more follow'''
+
+        chunks = self._prefetched() if self.prefetch else self._chunks()
+        try:
+            pending = b''
+            for chunk in chunks:
+                view = memoryview(pending + chunk if pending else chunk)
+                ##  keep back at least one segment's worth, which might be
+                ##  the last; and anything short of a whole character
+                end = len(view) - self.segmentLength
+                end -= end % self.segmentLength
+                for start in range(0, end, self.segmentLength):
+                    segment = view[start:start + self.segmentLength]
+                    self.length += len(segment)
+                    yield segment, True
+                pending = bytes(view[max(end, 0):])
+            if len(pending) % self.unit:
+                raise ValueError('a Unicode Lob has an odd number of bytes')
+            view = memoryview(pending)
+            for start in range(0, len(view), self.segmentLength):
+                segment = view[start:start + self.segmentLength]
+                self.length += len(segment)
+                yield segment, start + self.segmentLength < len(view)
+            if not view:
+                yield view, False
+        finally:
+            chunks.close()
+
+
+##  each encoder returns (dataType, length, precision, scale, raw value)
+
+def _null( value ):
+    return IIAPI_LTXT_TYPE, 2, 0, 0, None
+
+
+def _bool( value ):
+    return IIAPI_BOOL_TYPE, 1, 0, 0, b'\x01' if value else b'\x00'
+
+
+def _int( value ):
+    if -(1 << 63) <= value < (1 << 63):
+        return IIAPI_INT_TYPE, 8, 0, 0, _INT8.pack( value )
+    return _decimal( decimal.Decimal(value) )
+
+
+def _handle( value ):
+    return IIAPI_HNDL_TYPE, _POINTER.size, 0, 0, _POINTER.pack( value )
+
+
+def _float( value ):
+    return IIAPI_FLT_TYPE, 8, 0, 0, _FLOAT8.pack( value )
+
+
+def _decimal( value ):
+    precision, scale = datatypes.decimal_precision( value )
+    raw = datatypes.decimal_bytes( value, precision, scale )
+    return IIAPI_DEC_TYPE, len(raw), precision, scale, raw
+
+
+def _packed( value ):
+    return IIAPI_DEC_TYPE, len(value), value.precision, value.scale, value
+
+
+def _varying( dataType, raw ):
+    if len(raw) > IIAPI_MAX_PARM_LEN:
+        raise ValueError(f'a parameter of {len(raw)} bytes is too long to '
+            'send in one piece')
+    raw = _LENGTH.pack( len(raw) ) + raw
+    return dataType, len(raw), 0, 0, raw
+
+
+def _str( value ):
+    return _varying( IIAPI_VCH_TYPE, value.encode() )
+
+
+def _bytes( value ):
+    return _varying( IIAPI_VBYTE_TYPE, bytes(value) )
+
+
+def _datetime( value ):
+    dataType = IIAPI_TSWO_TYPE if value.tzinfo is None else IIAPI_TSTZ_TYPE
+    return dataType, IIAPI_TS_LEN, 9, 0, datatypes.timestamp_bytes( value )
+
+
+def _date( value ):
+    return (IIAPI_DATE_TYPE, IIAPI_DATE_LEN, 0, 0,
+        datatypes.ansi_date_bytes( value ))
+
+
+def _interval( value ):
+    return (IIAPI_INTDS_TYPE, IIAPI_INTDS_LEN, 9, 0,
+        datatypes.interval_ds_bytes( value ))
+
+
+def _lob( value ):
+    ##  the value is written to the buffer a segment at a time by puts()
+    return (value.dataType, _LENGTH.size + value.segmentLength, 0, 0,
+        value)
+
+
+def _time( value ):
+    dataType = IIAPI_TMWO_TYPE if value.tzinfo is None else IIAPI_TMTZ_TYPE
+    return dataType, IIAPI_TIME_LEN, 9, 0, datatypes.time_bytes( value )
+
+
+ENCODERS = {
+    type(None): _null,
+    Handle: _handle,
+    bool: _bool,
+    int: _int,
+    float: _float,
+    decimal.Decimal: _decimal,
+    PackedDecimal: _packed,
+    str: _str,
+    bytes: _bytes,
+    bytearray: _bytes,
+    memoryview: _bytes,
+    datetime.datetime: _datetime,
+    datetime.date: _date,
+    datetime.time: _time,
+    datetime.timedelta: _interval,
+    Lob: _lob,
+}
+
+
+def encoder( value ):
+    '''return the encoder for a Python value'''
+
+    try:
+        return ENCODERS[type(value)]
+    except KeyError:
+        pass
+    ##  subclasses (e.g. of int or str) are encoded like their base class;
+    ##  the order of ENCODERS puts bool before int and datetime before date
+    for base, encode in ENCODERS.items():
+        if isinstance(value, base):
+            return encode
+    raise TypeError(f'{type(value).__name__} can\'t be sent as a parameter')
+
+
+def encode( value ):
+    '''return (dataType, length, precision, scale, raw value) for a value'''
+
+    return encoder( value )( value )
+
+
+class Parameters(object):
+    '''the descriptors and values of one set of query parameters'''
+
+    def __init__( self, count, columnType=IIAPI_COL_QPARM ):
+        self.count = count
+        self.columnType = columnType
+        self.descriptors = (IIAPI_DESCRIPTOR * count)()
+        for descriptor in self.descriptors:
+            descriptor.ds_nullable = True
+            descriptor.ds_columnType = columnType
+        self.parmData = (IIAPI_DATAVALUE * count)()
+        self.buffer = None
+        self.size = 0
+        ##  the (dataType, length, precision, scale) of each descriptor
+        self.shape = None
+
+        self.sdp = IIAPI_SETDESCRPARM()
+        self.sdp.sd_descriptorCount = count
+        self.sdp.sd_descriptor = self.descriptors
+        self.ppp = IIAPI_PUTPARMPARM()
+        self.ppp.pp_parmCount = count
+        self.ppp.pp_parmData = self.parmData
+        self.ppp.pp_moreSegments = False
+        ##  the (index, Lob) of each value to be sent in segments
+        self.lobs = []
+
+
+    def bind( self, stmtHandle ):
+        '''direct the parameter blocks at a statement'''
+
+        self.sdp.sd_stmtHandle = stmtHandle
+        self.ppp.pp_stmtHandle = stmtHandle
+
+
+    def set( self, values ):
+        '''describe and encode a row of values'''
+
+        if len(values) != self.count:
+            raise ValueError(f'{len(values)} values given for '
+                f'{self.count} parameters')
+        encoded = [encode(value) for value in values]
+        size = 0
+        for dataType, length, precision, scale, raw in encoded:
+            size += -(-length // _ALIGNMENT) * _ALIGNMENT
+        if self.buffer is None or size > self.size:
+            ##  the buffer is kept, and only grows, for the next row
+            self.buffer = C.create_string_buffer( size )
+            self.size = size
+        ##  the descriptors are only rewritten if they have changed
+        shape = [value[:4] for value in encoded]
+        if shape != self.shape:
+            for descriptor, (dataType, length, precision,
+                scale) in zip(self.descriptors, shape):
+                descriptor.ds_dataType = dataType
+                descriptor.ds_length = length
+                descriptor.ds_precision = precision
+                descriptor.ds_scale = scale
+                if dataType == IIAPI_HNDL_TYPE:
+                    descriptor.ds_nullable = False
+                    descriptor.ds_columnType = IIAPI_COL_SVCPARM
+                else:
+                    descriptor.ds_nullable = True
+                    descriptor.ds_columnType = self.columnType
+            self.shape = shape
+        address = C.addressof(self.buffer)
+        self.lobs = []
+        for index, (datavalue, (dataType, length, precision, scale,
+            raw)) in enumerate(zip(self.parmData, encoded)):
+            datavalue.dv_value = address
+            if raw is None:
+                datavalue.dv_null = True
+                datavalue.dv_length = 0
+            elif isinstance(raw, Lob):
+                datavalue.dv_null = False
+                datavalue.dv_length = 0
+                self.lobs.append( (index, raw) )
+            else:
+                datavalue.dv_null = False
+                datavalue.dv_length = len(raw)
+                C.memmove( address, raw, len(raw) )
+            address += -(-length // _ALIGNMENT) * _ALIGNMENT
+
+
+    def puts( self ):
+        '''yield the IIAPI_PUTPARMPARM set up for each IIapi_putParms()'''
+
+        ppp = self.ppp
+        if not self.lobs:
+            yield ppp
+            return
+        size = C.sizeof(IIAPI_DATAVALUE)
+        view = memoryview(self.buffer).cast( 'B' )
+        start = 0
+        try:
+            for index, lob in self.lobs:
+                if index > start:
+                    ppp.pp_parmCount = index - start
+                    ppp.pp_parmData = C.cast( C.byref(self.parmData,
+                        start * size), C.POINTER(IIAPI_DATAVALUE) )
+                    ppp.pp_moreSegments = False
+                    yield ppp
+                datavalue = self.parmData[index]
+                offset = datavalue.dv_value - C.addressof(self.buffer)
+                ppp.pp_parmCount = 1
+                ppp.pp_parmData = C.cast( C.byref(self.parmData,
+                    index * size), C.POINTER(IIAPI_DATAVALUE) )
+                for segment, more in lob.segments():
+                    ##  the length of a segment is in characters
+                    _LENGTH.pack_into( view, offset, len(segment) // lob.unit )
+                    view[offset + _LENGTH.size:
+                        offset + _LENGTH.size + len(segment)] = segment
+                    datavalue.dv_length = _LENGTH.size + len(segment)
+                    ppp.pp_moreSegments = more
+                    yield ppp
+                start = index + 1
+            if start < self.count:
+                ppp.pp_parmCount = self.count - start
+                ppp.pp_parmData = C.cast( C.byref(self.parmData,
+                    start * size), C.POINTER(IIAPI_DATAVALUE) )
+                ppp.pp_moreSegments = False
+                yield ppp
+        finally:
+            ppp.pp_parmCount = self.count
+            ppp.pp_parmData = self.parmData
+            ppp.pp_moreSegments = False
+            self.lobs = []
@@ -0,0 +1,509 @@
+##  Copyright (c) 2024 Rational Commerce Ltd.
+
+'''
+keep connections open and hand them out again
+
+A Pool (for threads, using pyngres.blocking) or an AsyncPool (for
+asyncio, using pyngres.asyncio) keeps up to size connections to one
+target open. A connection that has been idle for IIAPI_POOL_CHECK_IDLE
+seconds is validated before it is handed out again; one that fails
+validation, or is released as broken, is recycled with IIapi_abort() and
+replaced by a new one. An OpenAPIError raised in a with pool.connection()
+block only breaks the connection if it is a failure of the connection
+(IIAPI_ST_FAILURE or worse, or SQLSTATE class 08); after an ordinary SQL
+error the transaction is rolled back and the connection kept. Each new
+connection has the same IIapi_setConnectParam() parameters.
+
+    pool = Pool( b'vnode::dbname', envHandle, size=8,
+        parameters=[(IIAPI_CP_DATE_FORMAT, IIAPI_CPV_DFRMT_YMD)] )
+    pool.warm()
+    with pool.connection() as connection:
+        ...use connection.connHandle; keep connection.tranHandle current...
+
+A transaction left open when a connection is released is rolled back.
+The metrics of a pool count the checkouts and the time spent waiting for
+a connection and getting one.
+'''
+
+
+import asyncio
+import contextlib
+import ctypes as C
+import os
+import threading
+import time
+from .IIAPI_CONSTANTS import *
+from .IIAPI_PARM import *
+from .errors import OpenAPIError, check
+import pyngres.blocking as blocking
+import pyngres.asyncio as aio
+
+
+##  the default number of connections in a pool
+IIAPI_POOL_SIZE = int(os.environ.get('IIAPI_POOL_SIZE', 8))
+
+##  connections idle for longer than this (in seconds) are validated
+##  before they are handed out
+IIAPI_POOL_CHECK_IDLE = float(os.environ.get('IIAPI_POOL_CHECK_IDLE', 30.0))
+
+##  the statement that validates a connection
+IIAPI_POOL_PING = os.environ.get('IIAPI_POOL_PING', 'SELECT 1').encode()
+
+
+class Connection(object):
+    '''a connection belonging to a pool'''
+
+    def __init__( self, connHandle ):
+        self.connHandle = connHandle
+        ##  the application keeps tranHandle current, so the pool can roll
+        ##  back a transaction left open
+        self.tranHandle = None
+        self.released = time.monotonic()
+
+
+class Metrics(object):
+    '''how long the checkouts of a pool have taken'''
+
+    def __init__( self ):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        ##  the checkouts that had to wait for a connection to be released
+        self.waits = 0
+        self.waitTime = 0.0
+        self.maxWaitTime = 0.0
+        ##  from asking for a connection to getting one (including waiting,
+        ##  validating, and connecting)
+        self.checkoutTime = 0.0
+        self.maxCheckoutTime = 0.0
+        self.connects = 0
+        self.validations = 0
+        self.aborts = 0
+
+
+    def count( self, name ):
+        with self._lock:
+            setattr( self, name, getattr(self, name) + 1 )
+
+
+    def checkout( self, waitTime, checkoutTime ):
+        '''record a checkout (waitTime is None if it didn't wait)'''
+
+        with self._lock:
+            self.checkouts += 1
+            if waitTime is not None:
+                self.waits += 1
+                self.waitTime += waitTime
+                self.maxWaitTime = max(self.maxWaitTime, waitTime)
+            self.checkoutTime += checkoutTime
+            self.maxCheckoutTime = max(self.maxCheckoutTime, checkoutTime)
+
+
+    def snapshot( self ):
+        '''return the metrics, and the mean times, as a dict'''
+
+        with self._lock:
+            metrics = {name: value for name, value in vars(self).items()
+                if not name.startswith('_')}
+        metrics['meanWaitTime'] = self.waitTime / (self.waits or 1)
+        metrics['meanCheckoutTime'] = self.checkoutTime / (self.checkouts or 1)
+        return metrics
+
+
+##  the conversations; each yields (function name, parameter block)
+
+
+def _value( value ):
+    ##  IIapi_setConnectParam() takes the address of a value
+    if isinstance(value, str):
+        value = value.encode()
+    if isinstance(value, bytes):
+        return C.create_string_buffer( value )
+    return II_LONG( value )
+
+
+def _connect( envHandle, target, username, password, parameters ):
+    '''the conversation opening a connection; returns the connHandle'''
+
+    connHandle = envHandle
+    values = []
+    for paramID, value in parameters:
+        scp = IIAPI_SETCONPRMPARM()
+        scp.sc_connHandle = connHandle
+        scp.sc_paramID = paramID
+        values.append( _value(value) )
+        scp.sc_paramValue = C.addressof(values[-1])
+        yield 'IIapi_setConnectParam', scp
+        check( 'IIapi_setConnectParam', scp )
+        connHandle = scp.sc_connHandle
+    cop = IIAPI_CONNPARM()
+    cop.co_target = target
+    cop.co_username = username
+    cop.co_password = password
+    cop.co_connHandle = connHandle
+    cop.co_type = IIAPI_CT_SQL
+    cop.co_timeout = -1
+    yield 'IIapi_connect', cop
+    ##  a failed connection is aborted to free its handle, unless
+    ##  co_connHandle is still the environment handle
+    if (cop.co_genParm.gp_status >= IIAPI_ST_ERROR and cop.co_connHandle
+        and cop.co_connHandle != envHandle):
+        abp = IIAPI_ABORTPARM()
+        abp.ab_connHandle = cop.co_connHandle
+        yield 'IIapi_abort', abp
+    check( 'IIapi_connect', cop )
+    return cop.co_connHandle
+
+
+def _rollback( tranHandle ):
+    '''the conversation rolling back a transaction; returns success'''
+
+    rbp = IIAPI_ROLLBACKPARM()
+    rbp.rb_tranHandle = tranHandle
+    yield 'IIapi_rollback', rbp
+    return rbp.rb_genParm.gp_status < IIAPI_ST_ERROR
+
+
+def _ping( connHandle, queryText ):
+    '''the conversation validating a connection; returns success'''
+
+    qyp = IIAPI_QUERYPARM()
+    qyp.qy_connHandle = connHandle
+    qyp.qy_queryType = IIAPI_QT_QUERY
+    qyp.qy_queryText = queryText
+    qyp.qy_tranHandle = None
+    yield 'IIapi_query', qyp
+    if qyp.qy_genParm.gp_status >= IIAPI_ST_ERROR:
+        return False
+    ##  there is no need to fetch the result; closing cancels it
+    clp = IIAPI_CLOSEPARM()
+    clp.cl_stmtHandle = qyp.qy_stmtHandle
+    yield 'IIapi_close', clp
+    if clp.cl_genParm.gp_status >= IIAPI_ST_ERROR:
+        return False
+    if qyp.qy_tranHandle:
+        return (yield from _rollback( qyp.qy_tranHandle ))
+    return True
+
+
+def _broken( exception ):
+    '''whether an OpenAPIError means the connection itself has failed'''
+
+    if exception.status >= IIAPI_ST_FAILURE:
+        return True
+    return any(SQLSTATE.startswith( '08' )
+        for SQLSTATE, errorCode, message in exception.messages)
+
+
+def _abort( connHandle ):
+    abp = IIAPI_ABORTPARM()
+    abp.ab_connHandle = connHandle
+    yield 'IIapi_abort', abp
+
+
+def _disconnect( connHandle ):
+    dcp = IIAPI_DISCONNPARM()
+    dcp.dc_connHandle = connHandle
+    yield 'IIapi_disconnect', dcp
+
+
+class _Pool(object):
+    '''the bookkeeping shared by Pool and AsyncPool'''
+
+    def __init__( self, target, envHandle=None, size=None, username=None,
+        password=None, parameters=(), checkIdle=None, ping=None ):
+        self.target = target
+        self.envHandle = envHandle
+        self.size = size or IIAPI_POOL_SIZE
+        self.username = username
+        self.password = password
+        ##  (paramID, value) pairs for IIapi_setConnectParam()
+        self.parameters = list(parameters)
+        self.checkIdle = IIAPI_POOL_CHECK_IDLE if checkIdle is None \
+            else checkIdle
+        self.ping = ping or IIAPI_POOL_PING
+        ##  the idle connections, the most recently released last
+        self.idle = []
+        ##  the connections open (or being opened), idle or not
+        self.opened = 0
+        self.closed = False
+        self.metrics = Metrics()
+
+
+    def _take( self ):
+        '''return an idle Connection, True to open a new one, or None'''
+
+        if self.closed:
+            raise RuntimeError('the pool is closed')
+        if self.idle:
+            return self.idle.pop()
+        if self.opened < self.size:
+            self.opened += 1
+            return True
+        return None
+
+
+    def _connect( self ):
+        self.metrics.count( 'connects' )
+        return _connect( self.envHandle, self.target, self.username,
+            self.password, self.parameters )
+
+
+    def _stale( self, connection ):
+        return time.monotonic() - connection.released > self.checkIdle
+
+
+    def _checked_out( self, start, waited ):
+        ##  waited is when the wait for a connection ended (or None)
+        self.metrics.checkout( None if waited is None else waited - start,
+            time.perf_counter() - start )
+
+
+    def _recycle( self, connection ):
+        self.metrics.count( 'aborts' )
+        return _abort( connection.connHandle )
+
+
+class Pool(_Pool):
+    '''a thread-safe pool of connections, using pyngres.blocking'''
+
+    def __init__( self, target, envHandle=None, size=None, username=None,
+        password=None, parameters=(), checkIdle=None, ping=None, wait=None ):
+        super().__init__( target, envHandle, size, username, password,
+            parameters, checkIdle, ping )
+        ##  the pyngres.blocking wait strategy
+        self.wait = wait
+        self.condition = threading.Condition()
+
+
+    def _converse( self, conversation ):
+        return blocking._converse( conversation, wait=self.wait )
+
+
+    def _open( self ):
+        try:
+            return Connection( self._converse(self._connect()) )
+        except BaseException:
+            with self.condition:
+                self.opened -= 1
+                self.condition.notify()
+            raise
+
+
+    def warm( self, count=None ):
+        '''open connections until count (by default size) are open'''
+
+        count = min(count or self.size, self.size)
+        while True:
+            with self.condition:
+                if self.opened >= count:
+                    return
+                self.opened += 1
+            self.release( self._open() )
+
+
+    def acquire( self, timeout=None ):
+        '''return a Connection, waiting up to timeout seconds for one'''
+
+        start = time.perf_counter()
+        waited = None
+        with self.condition:
+            while True:
+                connection = self._take()
+                if connection is not None:
+                    break
+                waited = start
+                remaining = None
+                if timeout is not None:
+                    remaining = timeout - (time.perf_counter() - start)
+                    if remaining <= 0:
+                        raise TimeoutError('no connection became available')
+                self.condition.wait( remaining )
+        if waited is not None:
+            waited = time.perf_counter()
+
+        if connection is True:
+            connection = self._open()
+        elif self._stale( connection ):
+            self.metrics.count( 'validations' )
+            if not self._converse( _ping(connection.connHandle, self.ping) ):
+                self._converse( self._recycle(connection) )
+                connection = self._open()
+        self._checked_out( start, waited )
+        return connection
+
+
+    def release( self, connection, broken=False ):
+        '''give a Connection back; recycle it if it is broken'''
+
+        if connection.tranHandle and not broken:
+            broken = not self._converse( _rollback(connection.tranHandle) )
+        connection.tranHandle = None
+        if broken:
+            self._converse( self._recycle(connection) )
+            with self.condition:
+                self.opened -= 1
+                self.condition.notify()
+            return
+        connection.released = time.monotonic()
+        with self.condition:
+            if not self.closed:
+                self.idle.append( connection )
+                self.condition.notify()
+                return
+            self.opened -= 1
+        self._converse( _disconnect(connection.connHandle) )
+
+
+    @contextlib.contextmanager
+    def connection( self, timeout=None ):
+        '''check out a Connection for the duration of a with statement'''
+
+        ##  after an SQL error the transaction is rolled back, and the
+        ##  connection is only recycled if that fails too
+        connection = self.acquire( timeout )
+        try:
+            yield connection
+        except OpenAPIError as exception:
+            self.release( connection, broken=_broken(exception) )
+            raise
+        except BaseException:
+            self.release( connection )
+            raise
+        self.release( connection )
+
+
+    def close( self ):
+        '''disconnect the idle connections, and the others when released'''
+
+        with self.condition:
+            self.closed = True
+            idle, self.idle = self.idle, []
+            self.opened -= len(idle)
+            self.condition.notify_all()
+        for connection in idle:
+            self._converse( _disconnect(connection.connHandle) )
+
+
+class AsyncPool(_Pool):
+    '''a pool of connections for asyncio, using pyngres.asyncio'''
+
+    def __init__( self, target, envHandle=None, size=None, username=None,
+        password=None, parameters=(), checkIdle=None, ping=None ):
+        super().__init__( target, envHandle, size, username, password,
+            parameters, checkIdle, ping )
+        self.condition = asyncio.Condition()
+
+
+    async def _converse( self, conversation ):
+        return await aio._converse( conversation )
+
+
+    async def _open( self ):
+        try:
+            return Connection( await self._converse(self._connect()) )
+        except BaseException:
+            async with self.condition:
+                self.opened -= 1
+                self.condition.notify()
+            raise
+
+
+    async def warm( self, count=None ):
+        '''open connections until count (by default size) are open'''
+
+        count = min(count or self.size, self.size)
+        opening = []
+        async with self.condition:
+            while self.opened < count:
+                self.opened += 1
+                opening.append( self._open() )
+        for connection in await asyncio.gather( *opening ):
+            await self.release( connection )
+
+
+    async def acquire( self, timeout=None ):
+        '''return a Connection, waiting up to timeout seconds for one'''
+
+        start = time.perf_counter()
+        waited = None
+        async with self.condition:
+            while True:
+                connection = self._take()
+                if connection is not None:
+                    break
+                waited = start
+                remaining = None
+                if timeout is not None:
+                    remaining = timeout - (time.perf_counter() - start)
+                    if remaining <= 0:
+                        raise TimeoutError('no connection became available')
+                try:
+                    await asyncio.wait_for( self.condition.wait(), remaining )
+                except asyncio.TimeoutError:
+                    pass
+        if waited is not None:
+            waited = time.perf_counter()
+
+        if connection is True:
+            connection = await self._open()
+        elif self._stale( connection ):
+            self.metrics.count( 'validations' )
+            if not await self._converse( _ping(connection.connHandle,
+                self.ping) ):
+                await self._converse( self._recycle(connection) )
+                connection = await self._open()
+        self._checked_out( start, waited )
+        return connection
+
+
+    async def release( self, connection, broken=False ):
+        '''give a Connection back; recycle it if it is broken'''
+
+        if connection.tranHandle and not broken:
+            broken = not await self._converse(
+                _rollback(connection.tranHandle) )
+        connection.tranHandle = None
+        if broken:
+            await self._converse( self._recycle(connection) )
+            async with self.condition:
+                self.opened -= 1
+                self.condition.notify()
+            return
+        connection.released = time.monotonic()
+        async with self.condition:
+            if not self.closed:
+                self.idle.append( connection )
+                self.condition.notify()
+                return
+            self.opened -= 1
+        await self._converse( _disconnect(connection.connHandle) )
+
+
+    @contextlib.asynccontextmanager
+    async def connection( self, timeout=None ):
+        '''check out a Connection for the duration of an async with'''
+
+        ##  after an SQL error the transaction is rolled back, and the
+        ##  connection is only recycled if that fails too
+        connection = await self.acquire( timeout )
+        try:
+            yield connection
+        except OpenAPIError as exception:
+            await self.release( connection, broken=_broken(exception) )
+            raise
+        except BaseException:
+            await self.release( connection )
+            raise
+        await self.release( connection )
+
+
+    async def close( self ):
+        '''disconnect the idle connections, and the others when released'''
+
+        async with self.condition:
+            self.closed = True
+            idle, self.idle = self.idle, []
+            self.opened -= len(idle)
+            self.condition.notify_all()
+        for connection in idle:
+            await self._converse( _disconnect(connection.connHandle) )
@@ -0,0 +1,241 @@
+##  Copyright (c) 2024 Rational Commerce Ltd.
+
+'''
+cache prepared statements, by query text, for each connection
+
+A PreparedCache prepares each query text once (PREPARE name FROM ...) and
+executes it by name after that. It keeps the Parameters (the descriptors
+and buffer for IIapi_setDescriptor() and IIapi_putParms()) and the RowSet
+built from IIapi_getDescriptor() of each statement, so repeat executions
+skip the prepare and most of the Python work too.
+
+pyngres.blocking.execute_prepared() and pyngres.asyncio.execute_prepared()
+run the conversation:
+
+    cache = PreparedCache( connHandle )
+    result = execute_prepared( cache, b'INSERT INTO t VALUES (?, ?)',
+        ('Smith', 42), tranHandle=tranHandle )
+    result = execute_prepared( cache, b'SELECT * FROM t WHERE age > ?', (40,),
+        tranHandle=result.tranHandle, sink=lambda rowset: ... )
+    tranHandle = result.tranHandle
+
+The least recently used statement is evicted when the cache is full; its
+name is reused by the next statement prepared, which replaces it in the
+DBMS. Ingres discards prepared statements when the transaction they were
+prepared in ends, so by default a statement is prepared again in each new
+transaction; PreparedCache( connHandle, perTransaction=False ) doesn't.
+'''
+
+
+import collections
+import itertools
+import os
+from .IIAPI_CONSTANTS import *
+from .IIAPI_PARM import *
+from .errors import check
+from .parameters import Parameters
+from .rowset import RowSet
+
+
+##  the default number of prepared statements cached for each connection
+IIAPI_PREPARED_CACHE_SIZE = int(os.environ.get('IIAPI_PREPARED_CACHE_SIZE',
+    100))
+
+
+class Prepared(object):
+    '''a statement in a PreparedCache'''
+
+    def __init__( self, name, queryText ):
+        self.name = name
+        self.queryText = queryText
+        ##  a prepared SELECT is opened as a cursor, anything else executed
+        words = queryText.split( None, 1 )
+        self.select = bool(words) and words[0].upper() in (b'SELECT',
+            b'WITH')
+        ##  the transaction it was prepared in (None if it has to be)
+        self.tranHandle = None
+        self.prepared = False
+        self.parameters = None
+        self.rowset = None
+        self.executions = 0
+
+
+class PreparedCache(object):
+    '''the prepared statements of one connection, least recently used first'''
+
+    def __init__( self, connHandle, size=None, perTransaction=True ):
+        self.connHandle = connHandle
+        self.size = size or IIAPI_PREPARED_CACHE_SIZE
+        self.perTransaction = perTransaction
+        self.statements = collections.OrderedDict()
+        self.names = (b'pyngres_s%d' % n for n in itertools.count())
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+    def __len__( self ):
+        return len(self.statements)
+
+
+    def __contains__( self, queryText ):
+        return queryText in self.statements
+
+
+    def lookup( self, queryText, tranHandle=None ):
+        '''return the Prepared for queryText, and whether to prepare it'''
+
+        prepared = self.statements.get( queryText )
+        if prepared is None:
+            self.misses += 1
+            if len(self.statements) >= self.size:
+                ##  the DBMS statement is replaced when the name is reused
+                evicted = self.statements.popitem( last=False )[1]
+                self.evictions += 1
+                name = evicted.name
+            else:
+                name = next(self.names)
+            prepared = self.statements[queryText] = Prepared( name, queryText )
+            return prepared, True
+        self.statements.move_to_end( queryText )
+        if not prepared.prepared or (self.perTransaction
+            and (not tranHandle or tranHandle != prepared.tranHandle)):
+            self.misses += 1
+            return prepared, True
+        self.hits += 1
+        return prepared, False
+
+
+    def discard( self, queryText ):
+        '''forget a statement (e.g. one that failed to prepare)'''
+
+        self.statements.pop( queryText, None )
+
+
+    def invalidate( self ):
+        '''have every statement prepared again (e.g. after a commit)'''
+
+        for prepared in self.statements.values():
+            prepared.prepared = False
+
+
+class Result(object):
+    '''the outcome of executing a prepared statement'''
+
+    def __init__( self, tranHandle=None ):
+        self.tranHandle = tranHandle
+        self.rowCount = -1
+
+
+def _prepare( cache, prepared, tranHandle ):
+    ##  the conversation preparing the statement; returns the tranHandle
+    qyp = IIAPI_QUERYPARM()
+    qyp.qy_connHandle = cache.connHandle
+    qyp.qy_queryType = IIAPI_QT_QUERY
+    qyp.qy_queryText = b'PREPARE ' + prepared.name + b' FROM ' + \
+        prepared.queryText
+    qyp.qy_parameters = False
+    qyp.qy_tranHandle = tranHandle
+    qyp.qy_stmtHandle = None
+    yield 'IIapi_query', qyp
+    if qyp.qy_genParm.gp_status >= IIAPI_ST_ERROR:
+        cache.discard( prepared.queryText )
+        check( 'IIapi_query', qyp )
+    gqp = IIAPI_GETQINFOPARM()
+    gqp.gq_stmtHandle = qyp.qy_stmtHandle
+    yield 'IIapi_getQueryInfo', gqp
+    clp = IIAPI_CLOSEPARM()
+    clp.cl_stmtHandle = qyp.qy_stmtHandle
+    yield 'IIapi_close', clp
+    if gqp.gq_genParm.gp_status >= IIAPI_ST_ERROR:
+        cache.discard( prepared.queryText )
+        check( 'IIapi_getQueryInfo', gqp )
+    prepared.prepared = True
+    prepared.tranHandle = qyp.qy_tranHandle
+    return qyp.qy_tranHandle
+
+
+def execute( cache, queryText, values=(), tranHandle=None, sink=None ):
+    '''the conversation executing a statement, prepared once by the cache
+
+    The rows of a SELECT are fetched into the statement's RowSet, and
+    sink( rowset ) is called with each batch.'''
+
+    ##  yields (function name, parameter block) for the caller to call,
+    ##  and returns the Result
+    prepared, prepare = cache.lookup( queryText, tranHandle )
+    if prepare:
+        tranHandle = yield from _prepare( cache, prepared, tranHandle )
+
+    qyp = IIAPI_QUERYPARM()
+    qyp.qy_connHandle = cache.connHandle
+    if prepared.select:
+        qyp.qy_queryType = IIAPI_QT_OPEN
+        qyp.qy_queryText = prepared.name
+    else:
+        qyp.qy_queryType = IIAPI_QT_EXEC
+        qyp.qy_queryText = b'EXECUTE ' + prepared.name
+    qyp.qy_parameters = len(values) > 0
+    qyp.qy_tranHandle = tranHandle
+    qyp.qy_stmtHandle = None
+    yield 'IIapi_query', qyp
+    if qyp.qy_genParm.gp_status >= IIAPI_ST_ERROR:
+        ##  prepare it again next time, in case the DBMS discarded it
+        prepared.prepared = False
+        check( 'IIapi_query', qyp )
+    prepared.executions += 1
+    stmtHandle = qyp.qy_stmtHandle
+    result = Result( qyp.qy_tranHandle )
+
+    try:
+        if values:
+            parameters = prepared.parameters
+            if parameters is None or parameters.count != len(values):
+                parameters = prepared.parameters = Parameters( len(values) )
+            parameters.set( values )
+            parameters.bind( stmtHandle )
+            yield 'IIapi_setDescriptor', parameters.sdp
+            check( 'IIapi_setDescriptor', parameters.sdp )
+            for ppp in parameters.puts():
+                yield 'IIapi_putParms', ppp
+                check( 'IIapi_putParms', ppp )
+        if prepared.select:
+            gdp = IIAPI_GETDESCRPARM()
+            gdp.gd_stmtHandle = stmtHandle
+            yield 'IIapi_getDescriptor', gdp
+            status = check( 'IIapi_getDescriptor', gdp )
+            if status != IIAPI_ST_NO_DATA and gdp.gd_descriptorCount:
+                ##  reuse the RowSet unless the result has changed shape
+                rowset = prepared.rowset
+                if rowset is None or not rowset.matches( gdp ):
+                    rowset = prepared.rowset = RowSet( gdp )
+                rowset.bind( stmtHandle )
+                while True:
+                    rowset.expire()
+                    yield 'IIapi_getColumns', rowset.gcp
+                    status = check( 'IIapi_getColumns', rowset.gcp )
+                    if rowset.rowsReturned and sink is not None:
+                        sink( rowset )
+                    if status == IIAPI_ST_NO_DATA:
+                        break
+    except Exception:
+        cnp = IIAPI_CANCELPARM()
+        cnp.cn_stmtHandle = stmtHandle
+        yield 'IIapi_cancel', cnp
+        clp = IIAPI_CLOSEPARM()
+        clp.cl_stmtHandle = stmtHandle
+        yield 'IIapi_close', clp
+        raise
+
+    gqp = IIAPI_GETQINFOPARM()
+    gqp.gq_stmtHandle = stmtHandle
+    yield 'IIapi_getQueryInfo', gqp
+    if (gqp.gq_genParm.gp_status < IIAPI_ST_ERROR
+        and gqp.gq_mask & IIAPI_GQ_ROW_COUNT):
+        result.rowCount = gqp.gq_rowCount
+    clp = IIAPI_CLOSEPARM()
+    clp.cl_stmtHandle = stmtHandle
+    yield 'IIapi_close', clp
+    check( 'IIapi_getQueryInfo', gqp )
+    check( 'IIapi_close', clp )
+    return result
@@ -24,6 +24,9 @@ IIAPI_DEV_MODE = ('IIAPI_DEV_MODE' in os.environ
     and os.environ['IIAPI_DEV_MODE'] == 'ON')
 IIAPI_DEBUG_ONERROR = ('IIAPI_DEBUG_ONERROR' in os.environ 
     and os.environ['IIAPI_DEBUG_ONERROR'] == 'ON')
+##  IIAPI_BACKEND names a Python module to use in place of the OpenAPI
+##  library (e.g. pyngres.loopback, which needs no Ingres installation)
+IIAPI_BACKEND = os.environ.get('IIAPI_BACKEND')
 
 
 ##  IIAPI_DEV_MODE=ON puts pyngres in development mode
@@ -38,7 +41,10 @@ else:
 
 
 ##  load the Ingres OpenAPI using ctypes
-if platform == 'linux':
+if IIAPI_BACKEND:
+    ##  the backend module stands in for the library; nothing to locate
+    api_pathname = IIAPI_BACKEND
+elif platform == 'linux':
     ##  expect to find libiiapi.1.so in $II_SYSTEM/ingres/lib
     try:
         II_SYSTEM = os.environ['II_SYSTEM']
@@ -89,14 +95,18 @@ else:
     quit()
 ##  don't use try/except here; just let it explode if it wants to
 logger.debug(f'attempting to load {api_pathname}')
-iiapi = C.CDLL(api_pathname)
+if IIAPI_BACKEND:
+    import importlib
+    iiapi = importlib.import_module(IIAPI_BACKEND)
+else:
+    iiapi = C.CDLL(api_pathname)
 logger.success(f'loaded {api_pathname}')
 
 
 ##  decorator to simplify the binding of functions
 def bind_function(lib, funcname, restype, argtypes):
     '''return a python wrapper for a C function'''
-    func = lib.__getattr__(funcname)
+    func = getattr(lib, funcname)
     func.restype = restype
     func.argtypes = argtypes
     return func
@@ -0,0 +1,286 @@
+##  Copyright (c) 2024 Rational Commerce Ltd.
+
+'''
+define repeat queries, by query text, once for each connection
+
+A RepeatCache defines each query text as a repeat query (IIAPI_QT_DEF_
+REPEAT_QUERY) the first time it is executed, and keeps the handle returned
+in gq_repeatQueryHandle. After that the query is executed by handle
+(IIAPI_QT_EXEC_REPEAT_QUERY), sending only the handle and the parameters,
+and the DBMS reuses the query plan it kept. Unlike prepared statements,
+repeat queries outlive the transaction they were defined in.
+
+pyngres.blocking.execute_repeated() and pyngres.asyncio.execute_repeated()
+run the conversation:
+
+    cache = RepeatCache( connHandle )
+    result = execute_repeated( cache,
+        b'INSERT INTO t VALUES ( $0 = ~V, $1 = ~V )', ('Smith', 42),
+        tranHandle=tranHandle )
+    result = execute_repeated( cache,
+        b'SELECT * FROM t WHERE age > $0 = ~V', (40,),
+        tranHandle=result.tranHandle, sink=lambda rowset: ... )
+    tranHandle = result.tranHandle
+
+If the DBMS reports that it no longer knows a query
+(IIAPI_GQF_UNKNOWN_REPEAT_QUERY) the query is defined again and executed
+again; if it reports that it flushed its query IDs
+(IIAPI_GQF_FLUSH_QUERY_ID) every query of the connection is defined again
+when it is next executed. Executing it again reads each Lob parameter
+again from the start, which a seekable file or a sequence can do; for any
+other Lob OpenAPIError is raised instead.
+'''
+
+
+import collections
+import os
+from .IIAPI_CONSTANTS import *
+from .IIAPI_PARM import *
+from .errors import check, OpenAPIError
+from .parameters import Handle, Lob, Parameters
+from .prepared import Result
+from .rowset import RowSet
+
+
+##  the default number of repeat query handles kept for each connection
+IIAPI_REPEAT_CACHE_SIZE = int(os.environ.get('IIAPI_REPEAT_CACHE_SIZE', 100))
+
+
+class Repeated(object):
+    '''a repeat query in a RepeatCache'''
+
+    def __init__( self, queryText ):
+        self.queryText = queryText
+        words = queryText.split( None, 1 )
+        self.select = bool(words) and words[0].upper() in (b'SELECT',
+            b'WITH')
+        ##  gq_repeatQueryHandle (None if it has to be defined)
+        self.handle = None
+        self.parameters = None
+        self.rowset = None
+        self.executions = 0
+
+
+class RepeatCache(object):
+    '''the repeat queries of one connection, least recently used first'''
+
+    def __init__( self, connHandle, size=None ):
+        self.connHandle = connHandle
+        self.size = size or IIAPI_REPEAT_CACHE_SIZE
+        self.statements = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        ##  the number of times the DBMS had forgotten a query, and had
+        ##  flushed them all
+        self.redefinitions = 0
+        self.flushes = 0
+
+
+    def __len__( self ):
+        return len(self.statements)
+
+
+    def __contains__( self, queryText ):
+        return queryText in self.statements
+
+
+    def lookup( self, queryText ):
+        '''return the Repeated for queryText, and whether to define it'''
+
+        repeated = self.statements.get( queryText )
+        if repeated is None:
+            self.misses += 1
+            if len(self.statements) >= self.size:
+                ##  the DBMS keeps the query until the session ends, but
+                ##  it is defined again if it is needed again
+                self.statements.popitem( last=False )
+                self.evictions += 1
+            repeated = self.statements[queryText] = Repeated( queryText )
+            return repeated, True
+        self.statements.move_to_end( queryText )
+        if repeated.handle is None:
+            self.misses += 1
+            return repeated, True
+        self.hits += 1
+        return repeated, False
+
+
+    def discard( self, queryText ):
+        '''forget a query (e.g. one that failed to be defined)'''
+
+        self.statements.pop( queryText, None )
+
+
+    def flush( self ):
+        '''have every query defined again (e.g. when the DBMS flushed them)'''
+
+        for repeated in self.statements.values():
+            repeated.handle = None
+
+
+def _flushed( cache, flags ):
+    ##  the DBMS has forgotten the handles it gave before
+    if flags & IIAPI_GQF_FLUSH_QUERY_ID:
+        cache.flushes += 1
+        cache.flush()
+
+
+def _define( cache, repeated, values, tranHandle ):
+    ##  the conversation defining the query; returns the tranHandle
+    qyp = IIAPI_QUERYPARM()
+    qyp.qy_connHandle = cache.connHandle
+    qyp.qy_queryType = IIAPI_QT_DEF_REPEAT_QUERY
+    qyp.qy_queryText = repeated.queryText
+    qyp.qy_parameters = len(values) > 0
+    qyp.qy_tranHandle = tranHandle
+    qyp.qy_stmtHandle = None
+    yield 'IIapi_query', qyp
+    if qyp.qy_genParm.gp_status >= IIAPI_ST_ERROR:
+        cache.discard( repeated.queryText )
+        check( 'IIapi_query', qyp )
+    stmtHandle = qyp.qy_stmtHandle
+    try:
+        if values:
+            ##  the parameters describe the query; they are not executed,
+            ##  so a Lob is described without reading its source
+            parameters = Parameters( len(values) )
+            parameters.set( [Lob((), value.dataType, value.segmentLength,
+                prefetch=False) if isinstance(value, Lob) else value
+                for value in values] )
+            parameters.bind( stmtHandle )
+            yield 'IIapi_setDescriptor', parameters.sdp
+            check( 'IIapi_setDescriptor', parameters.sdp )
+            for ppp in parameters.puts():
+                yield 'IIapi_putParms', ppp
+                check( 'IIapi_putParms', ppp )
+    except Exception:
+        cache.discard( repeated.queryText )
+        clp = IIAPI_CLOSEPARM()
+        clp.cl_stmtHandle = stmtHandle
+        yield 'IIapi_close', clp
+        raise
+    gqp = IIAPI_GETQINFOPARM()
+    gqp.gq_stmtHandle = stmtHandle
+    yield 'IIapi_getQueryInfo', gqp
+    clp = IIAPI_CLOSEPARM()
+    clp.cl_stmtHandle = stmtHandle
+    yield 'IIapi_close', clp
+    if gqp.gq_genParm.gp_status >= IIAPI_ST_ERROR:
+        cache.discard( repeated.queryText )
+        check( 'IIapi_getQueryInfo', gqp )
+    if not gqp.gq_mask & IIAPI_GQ_REPEAT_QUERY_ID:
+        cache.discard( repeated.queryText )
+        raise OpenAPIError( 'IIapi_getQueryInfo', IIAPI_ST_ERROR,
+            [('26000', 0, 'no repeat query handle was returned')] )
+    _flushed( cache, gqp.gq_flags )
+    repeated.handle = gqp.gq_repeatQueryHandle
+    return qyp.qy_tranHandle
+
+
+def _execute( cache, repeated, values, tranHandle, sink ):
+    ##  the conversation executing the query by its handle; returns the
+    ##  Result and the gq_flags
+    qyp = IIAPI_QUERYPARM()
+    qyp.qy_connHandle = cache.connHandle
+    qyp.qy_queryType = IIAPI_QT_EXEC_REPEAT_QUERY
+    qyp.qy_queryText = None
+    qyp.qy_parameters = True
+    qyp.qy_tranHandle = tranHandle
+    qyp.qy_stmtHandle = None
+    yield 'IIapi_query', qyp
+    check( 'IIapi_query', qyp )
+    repeated.executions += 1
+    stmtHandle = qyp.qy_stmtHandle
+    result = Result( qyp.qy_tranHandle )
+
+    try:
+        ##  the handle is sent first, as a service parameter
+        parameters = repeated.parameters
+        if parameters is None or parameters.count != len(values) + 1:
+            parameters = repeated.parameters = Parameters( len(values) + 1 )
+        parameters.set( (Handle(repeated.handle),) + tuple(values) )
+        parameters.bind( stmtHandle )
+        yield 'IIapi_setDescriptor', parameters.sdp
+        check( 'IIapi_setDescriptor', parameters.sdp )
+        for ppp in parameters.puts():
+            yield 'IIapi_putParms', ppp
+            check( 'IIapi_putParms', ppp )
+        if repeated.select:
+            gdp = IIAPI_GETDESCRPARM()
+            gdp.gd_stmtHandle = stmtHandle
+            yield 'IIapi_getDescriptor', gdp
+            status = check( 'IIapi_getDescriptor', gdp )
+            if status != IIAPI_ST_NO_DATA and gdp.gd_descriptorCount:
+                ##  reuse the RowSet unless the result has changed shape
+                rowset = repeated.rowset
+                if rowset is None or not rowset.matches( gdp ):
+                    rowset = repeated.rowset = RowSet( gdp )
+                rowset.bind( stmtHandle )
+                while True:
+                    rowset.expire()
+                    yield 'IIapi_getColumns', rowset.gcp
+                    status = check( 'IIapi_getColumns', rowset.gcp )
+                    if rowset.rowsReturned and sink is not None:
+                        sink( rowset )
+                    if status == IIAPI_ST_NO_DATA:
+                        break
+    except Exception:
+        cnp = IIAPI_CANCELPARM()
+        cnp.cn_stmtHandle = stmtHandle
+        yield 'IIapi_cancel', cnp
+        clp = IIAPI_CLOSEPARM()
+        clp.cl_stmtHandle = stmtHandle
+        yield 'IIapi_close', clp
+        raise
+
+    gqp = IIAPI_GETQINFOPARM()
+    gqp.gq_stmtHandle = stmtHandle
+    yield 'IIapi_getQueryInfo', gqp
+    if (gqp.gq_genParm.gp_status < IIAPI_ST_ERROR
+        and gqp.gq_mask & IIAPI_GQ_ROW_COUNT):
+        result.rowCount = gqp.gq_rowCount
+    clp = IIAPI_CLOSEPARM()
+    clp.cl_stmtHandle = stmtHandle
+    yield 'IIapi_close', clp
+    check( 'IIapi_getQueryInfo', gqp )
+    check( 'IIapi_close', clp )
+    return result, gqp.gq_flags
+
+
+def execute( cache, queryText, values=(), tranHandle=None, sink=None ):
+    '''the conversation executing a repeat query, defined once by the cache
+
+    The rows of a SELECT are fetched into the query's RowSet, and
+    sink( rowset ) is called with each batch.'''
+
+    ##  yields (function name, parameter block) for the caller to call,
+    ##  and returns the Result
+    repeated, define = cache.lookup( queryText )
+    if define:
+        tranHandle = yield from _define( cache, repeated, values, tranHandle )
+    result, flags = yield from _execute( cache, repeated, values, tranHandle,
+        sink )
+    _flushed( cache, flags )
+    if flags & IIAPI_GQF_UNKNOWN_REPEAT_QUERY:
+        ##  the DBMS forgot the query (and didn't execute it), so it is
+        ##  defined and executed again; the values are sent again, so each
+        ##  Lob has to read its source again
+        if not all(value.rewind() for value in values
+            if isinstance(value, Lob)):
+            repeated.handle = None
+            raise OpenAPIError( 'IIapi_getQueryInfo', IIAPI_ST_ERROR,
+                [('26000', 0, 'the repeat query was unknown, and a Lob '
+                'parameter can\'t be read again to execute it again')] )
+        cache.redefinitions += 1
+        tranHandle = yield from _define( cache, repeated, values,
+            result.tranHandle )
+        result, flags = yield from _execute( cache, repeated, values,
+            tranHandle, sink )
+        _flushed( cache, flags )
+        if flags & IIAPI_GQF_UNKNOWN_REPEAT_QUERY:
+            repeated.handle = None
+            raise OpenAPIError( 'IIapi_getQueryInfo', IIAPI_ST_ERROR,
+                [('26000', 0, 'the repeat query was unknown after it was '
+                'defined')] )
+    return result
@@ -0,0 +1,367 @@
+##  Copyright (c) 2024 Rational Commerce Ltd.
+
+'''
+fetch many rows with each IIapi_getColumns()
+
+A RowSet sizes gc_rowCount from the width of a row as described by
+IIapi_getDescriptor(), and allocates one IIAPI_DATAVALUE array and one
+value buffer big enough for that many rows, so a large result set is
+fetched in tens of calls instead of one call per row.
+
+    rowset = RowSet( gdp )
+    IIapi_getColumns( rowset.gcp )
+    ...wait for completion...
+    for row in rowset.rows():
+        ...
+
+rows() returns the raw OpenAPI values; values() decodes them into Python
+values with pyngres.decoders.
+
+pyngres.blocking.fetch() and pyngres.asyncio.fetch() do all of that, with
+a RowSet from pyngres.arena, which keeps it to fetch the next result of the
+same shape.
+
+views() returns the same raw values without copying them: each one is a
+memoryview of the value buffer, valid only until the RowSet is refilled.
+They are released (so using one raises ValueError rather than reading the
+next batch) by Views.release(), at the end of a with block, or by
+expire(), which every fetch loop calls before the next IIapi_getColumns():
+
+    for rowset in pyngres.blocking.fetch( stmtHandle ):
+        with rowset.views() as rows:
+            for row in rows:
+                digest.update( row[1] )
+
+Keep bytes( view ) of any value needed for longer. Something made from a
+view (a NumPy array, another memoryview) is not released with it, and sees
+the next batch. Releasing a view that is in use, e.g. by another thread,
+raises BufferError, and an Arena doesn't reuse that RowSet. Slicing a view
+costs about as much as copying a short value, so views() pays off for
+values of a few hundred bytes or more.
+'''
+
+
+import array
+import ctypes as C
+import functools
+import os
+import struct
+from .IIAPI_CONSTANTS import *
+from .IIAPI_PARM import *
+from . import decoders
+
+
+##  the size (in bytes) of the value buffer of a RowSet; the number of rows
+##  fetched by each IIapi_getColumns() is as many as will fit
+IIAPI_ROWSET_SIZE = int(os.environ.get('IIAPI_ROWSET_SIZE', 1 << 20))
+
+##  gc_rowCount is an II_INT2
+IIAPI_ROWSET_MAX_ROWS = 32767
+
+##  each value is aligned for the widest of the binary types
+_ALIGNMENT = 8
+
+
+def shape( descriptors, count ):
+    '''the (dataType, nullable, length, precision, scale) of each column'''
+
+    return tuple((descriptor.ds_dataType, descriptor.ds_nullable,
+        descriptor.ds_length, descriptor.ds_precision, descriptor.ds_scale)
+        for descriptor in descriptors[:count])
+
+
+##  the pointers of an IIAPI_DATAVALUE array are written all at once, as
+##  unsigned integers of their size; with NumPy (if installed) in one
+##  strided assignment, otherwise with one per column
+_POINTER = {4: 'I', 8: 'Q'}[C.sizeof(C.c_void_p)]
+_VALUE = IIAPI_DATAVALUE.dv_value.offset // C.sizeof(C.c_void_p)
+_STRIDE = C.sizeof(IIAPI_DATAVALUE) // C.sizeof(C.c_void_p)
+
+
+@functools.lru_cache( maxsize=None )
+def _numpy():
+    ##  NumPy is imported when the first RowSet is made, not with pyngres
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def _point( columnData, address, offsets, width, rows ):
+    '''point the dv_value of each IIAPI_DATAVALUE at its value in the buffer'''
+
+    count = len(offsets)
+    np = _numpy()
+    if np is not None:
+        ##  NumPy can't take the IIAPI_DATAVALUE array itself (it doesn't
+        ##  know the pointer member), so view it as bytes
+        raw = (C.c_byte * C.sizeof(columnData)).from_buffer( columnData )
+        size = C.sizeof(IIAPI_DATAVALUE)
+        pointers = np.ndarray( (rows, count), dtype=np.uintp, buffer=raw,
+            offset=IIAPI_DATAVALUE.dv_value.offset,
+            strides=(count * size, size) )
+        pointers[:] = (np.arange(rows, dtype=np.uintp)[:, None] * width
+            + np.array(offsets, dtype=np.uintp) + address)
+        return
+    pointers = memoryview(columnData).cast( 'B' ).cast( _POINTER )
+    for c, offset in enumerate(offsets):
+        start = address + offset
+        pointers[_VALUE + c * _STRIDE::count * _STRIDE] = array.array(
+            _POINTER, range(start, start + rows * width, width) )
+    pointers.release()
+
+
+def _aligned( length ):
+    return -(-length // _ALIGNMENT) * _ALIGNMENT
+
+
+def _datavalue():
+    ##  a struct of the dv_null and dv_length of an IIAPI_DATAVALUE
+    null = IIAPI_DATAVALUE.dv_null
+    length = IIAPI_DATAVALUE.dv_length
+    return struct.Struct( '=' + 'x' * null.offset
+        + {1: 'b', 2: 'h', 4: 'i'}[null.size]
+        + 'x' * (length.offset - null.offset - null.size) + 'H'
+        + 'x' * (C.sizeof(IIAPI_DATAVALUE) - length.offset - length.size) )
+
+_DATAVALUE = _datavalue()
+
+
+class Views(object):
+    '''memoryviews of the values fetched into a RowSet, until released'''
+
+    def __init__( self, rowset ):
+        rows = rowset.gcp.gc_rowsReturned
+        width = rowset.width
+        self.buffer = memoryview(rowset.buffer).cast( 'B' )
+        buffer = self.buffer
+        ##  the (dv_null, dv_length) of every value, in one pass
+        cells = rows * rowset.columnCount
+        columnData = memoryview(rowset.columnData).cast( 'B' )[
+            :cells * _DATAVALUE.size]
+        starts = [start + offset for start in range(0, rows * width, width)
+            for offset in rowset.offsets]
+        ##  every view, to be released with the buffer (releasing the
+        ##  buffer doesn't release the views sliced from it)
+        self.cells = [None if null else buffer[start:start + length]
+            for start, (null, length) in zip(starts,
+                _DATAVALUE.iter_unpack(columnData))]
+        self.rows = list(zip(*[iter(self.cells)] * rowset.columnCount))
+        self.released = False
+
+
+    def __len__( self ):
+        return len(self.rows)
+
+
+    def __iter__( self ):
+        if self.released:
+            raise ValueError('the views of the RowSet have been released')
+        return iter(self.rows)
+
+
+    def __getitem__( self, row ):
+        if self.released:
+            raise ValueError('the views of the RowSet have been released')
+        return self.rows[row]
+
+
+    def __enter__( self ):
+        return self
+
+
+    def __exit__( self, *exception ):
+        self.release()
+
+
+    def release( self ):
+        '''release every view, before the RowSet is refilled'''
+
+        if self.released:
+            return
+        self.released = True
+        inUse = 0
+        for view in self.cells:
+            if view is None:
+                continue
+            try:
+                view.release()
+            except BufferError:
+                inUse += 1
+        self.buffer.release()
+        self.cells = []
+        self.rows = []
+        if inUse:
+            raise BufferError(f'{inUse} views of the RowSet are still '
+                'in use; copy a value with bytes() to keep it')
+
+
+def row_count( shape, rowCount=None, size=None, expected=None ):
+    '''the number of rows of a RowSet for columns of the given shape'''
+
+    ##  rowCount overrides the number of rows that fit in size bytes; if
+    ##  the result is expected to have fewer rows (and one more, to see
+    ##  the end of it in the same call) there are no more than that
+    if rowCount is None:
+        width = sum(_aligned(length) for dataType, nullable, length,
+            precision, scale in shape)
+        rowCount = (size or IIAPI_ROWSET_SIZE) // width
+    if expected is not None:
+        rowCount = min(rowCount, expected + 1)
+    return max(1, min(rowCount, IIAPI_ROWSET_MAX_ROWS))
+
+
+class RowSet(object):
+    '''the buffers for fetching many rows with each IIapi_getColumns()'''
+
+    def __init__( self, gdp, rowCount=None, size=None, expected=None ):
+        ##  gdp is a completed IIAPI_GETDESCRPARM; rowCount overrides the
+        ##  number of rows that fit in size bytes, and expected (if known)
+        ##  is the number of rows of the result
+        count = gdp.gd_descriptorCount
+        if count <= 0:
+            raise ValueError('the statement returns no columns')
+        ##  the descriptors belong to the OpenAPI, and only until the next
+        ##  IIapi_getDescriptor(), so keep a copy
+        descriptors = (IIAPI_DESCRIPTOR * count)()
+        C.memmove( descriptors, gdp.gd_descriptor,
+            C.sizeof(IIAPI_DESCRIPTOR) * count )
+        self.names = [descriptor.ds_columnName for descriptor in descriptors]
+        for descriptor in descriptors:
+            if descriptor.ds_dataType in IIAPI_LONG_TYPES:
+                name = (descriptor.ds_columnName or b'').decode(
+                    errors='replace')
+                raise ValueError(f'{name} is a long column, which has to '
+                    'be fetched one row at a time using IIapi_getColumns()')
+            descriptor.ds_columnName = None
+        self.descriptors = descriptors
+        self.stmtHandle = gdp.gd_stmtHandle
+        self.columnCount = count
+        self.shape = shape( descriptors, count )
+
+        ##  lay each row out as consecutive aligned values
+        offsets = []
+        width = 0
+        for descriptor in descriptors:
+            offsets.append( width )
+            width += _aligned( descriptor.ds_length )
+        self.offsets = offsets
+        self.width = width
+        self.rowCount = row_count( self.shape, rowCount, size, expected )
+
+        self.buffer = C.create_string_buffer( self.rowCount * width )
+        self.columnData = (IIAPI_DATAVALUE * (self.rowCount * count))()
+        _point( self.columnData, C.addressof(self.buffer), offsets, width,
+            self.rowCount )
+
+        gcp = IIAPI_GETCOLPARM()
+        gcp.gc_stmtHandle = self.stmtHandle
+        gcp.gc_rowCount = self.rowCount
+        gcp.gc_columnCount = count
+        gcp.gc_columnData = self.columnData
+        self.gcp = gcp
+        ##  the Views of the rows fetched, if any
+        self.current = None
+
+
+    def matches( self, gdp ):
+        '''whether the RowSet fits the result described by gdp'''
+
+        count = gdp.gd_descriptorCount
+        if count != self.columnCount:
+            return False
+        return shape( gdp.gd_descriptor, count ) == self.shape
+
+
+    def bind( self, stmtHandle ):
+        '''fetch the result of another statement into the RowSet'''
+
+        ##  for a result with the same descriptors (see matches())
+        self.stmtHandle = stmtHandle
+        self.gcp.gc_stmtHandle = stmtHandle
+        self.gcp.gc_rowsReturned = 0
+
+
+    def reuse( self, gdp ):
+        '''fetch the result described by gdp (see matches()) into the RowSet'''
+
+        if not self.matches( gdp ):
+            raise ValueError( 'the RowSet does not fit the result' )
+        ##  the column names may differ, so take a copy of the descriptors
+        count = self.columnCount
+        C.memmove( self.descriptors, gdp.gd_descriptor,
+            C.sizeof(IIAPI_DESCRIPTOR) * count )
+        self.names = [descriptor.ds_columnName
+            for descriptor in self.descriptors]
+        for descriptor in self.descriptors:
+            descriptor.ds_columnName = None
+        self.bind( gdp.gd_stmtHandle )
+
+
+    @property
+    def rowsReturned( self ):
+        '''the number of rows fetched by the last IIapi_getColumns()'''
+
+        return self.gcp.gc_rowsReturned
+
+
+    @property
+    def status( self ):
+        '''the status of the last IIapi_getColumns()'''
+
+        return self.gcp.gc_genParm.gp_status
+
+
+    def __len__( self ):
+        return self.gcp.gc_rowsReturned
+
+
+    def rows( self ):
+        '''return the fetched rows as tuples of raw values (None for NULL)'''
+
+        rows = self.gcp.gc_rowsReturned
+        count = self.columnCount
+        width = self.width
+        ##  copy out only the part of the buffer that was filled
+        raw = C.string_at( self.buffer, rows * width )
+        columnData = self.columnData
+        values = []
+        append = values.append
+        index = 0
+        for start in range(0, rows * width, width):
+            for offset in self.offsets:
+                datavalue = columnData[index]
+                if datavalue.dv_null:
+                    append( None )
+                else:
+                    value = start + offset
+                    append( raw[value:value + datavalue.dv_length] )
+                index += 1
+        return list(zip(*[iter(values)] * count))
+
+
+    def values( self ):
+        '''return the fetched rows as tuples of Python values (None for NULL)'''
+
+        return decoders.decode( self )
+
+
+    def views( self ):
+        '''return the fetched rows as tuples of memoryviews of the buffer
+        (None for NULL), valid until the RowSet is refilled'''
+
+        if self.current is None or self.current.released:
+            self.current = Views( self )
+        return self.current
+
+
+    def expire( self ):
+        '''release the views() of the rows fetched, before fetching more'''
+
+        ##  called before each IIapi_getColumns() into the RowSet, and by
+        ##  Arena.release()
+        current = self.current
+        if current is not None:
+            self.current = None
+            current.release()
@@ -0,0 +1,79 @@
+##  Copyright (c) 2024 Rational Commerce Ltd.
+
+'''
+the tests run against pyngres.loopback rather than the OpenAPI library
+
+The backend is chosen when pyngres is imported, so IIAPI_BACKEND is set
+here, before any test module imports it.
+'''
+
+
+import os
+os.environ.setdefault( 'IIAPI_BACKEND', 'pyngres.loopback' )
+
+import pytest
+import pyngres.blocking as py
+from pyngres import arena, loopback
+
+
+@pytest.fixture( autouse=True )
+def reset():
+    '''start every test with the default loopback and an empty arena'''
+
+    loopback.reset()
+    arena.shared.clear()
+    yield
+    loopback.reset()
+
+
+@pytest.fixture( scope='session' )
+def envHandle():
+    inp = py.IIAPI_INITPARM()
+    inp.in_version = py.IIAPI_VERSION_11
+    inp.in_timeout = -1
+    py.IIapi_initialize( inp )
+    return inp.in_envHandle
+
+
+@pytest.fixture
+def connHandle( envHandle ):
+    cop = py.IIAPI_CONNPARM()
+    cop.co_target = b'db'
+    cop.co_connHandle = envHandle
+    cop.co_type = py.IIAPI_CT_SQL
+    cop.co_timeout = -1
+    py.IIapi_connect( cop )
+    assert cop.co_genParm.gp_status == py.IIAPI_ST_SUCCESS
+    yield cop.co_connHandle
+    dcp = py.IIAPI_DISCONNPARM()
+    dcp.dc_connHandle = cop.co_connHandle
+    py.IIapi_disconnect( dcp )
+
+
+@pytest.fixture
+def query( connHandle ):
+    '''return a function executing a query; it returns the stmtHandle'''
+
+    def query( queryText, tranHandle=None ):
+        qyp = py.IIAPI_QUERYPARM()
+        qyp.qy_connHandle = connHandle
+        qyp.qy_queryType = py.IIAPI_QT_QUERY
+        qyp.qy_queryText = queryText
+        qyp.qy_parameters = False
+        qyp.qy_tranHandle = tranHandle
+        qyp.qy_stmtHandle = None
+        py.IIapi_query( qyp )
+        assert qyp.qy_genParm.gp_status == py.IIAPI_ST_SUCCESS
+        return qyp.qy_stmtHandle
+    return query
+
+
+@pytest.fixture
+def statements():
+    '''return a function listing the statement handles the test left open'''
+
+    def open():
+        return {handle for handle, object in loopback._handles.items()
+            if isinstance(object, loopback._Statement)}
+    before = open()
+    return lambda: sorted(open() - before)
@@ -0,0 +1,47 @@
+##  Copyright (c) 2024 Rational Commerce Ltd.
+
+'''pyngres.arrow.reader()'''
+
+
+import decimal
+import pytest
+import pyngres.blocking as py
+from pyngres import loopback
+
+pa = pytest.importorskip( 'pyarrow' )
+pytest.importorskip( 'numpy' )
+from pyngres import arrow
+
+
+QUERY = b'SELECT * FROM t'
+
+
+def test_reader( query ):
+    loopback.define( QUERY, [
+        loopback.Column( 'id', py.IIAPI_INT_TYPE, 4 ),
+        loopback.Column( 'name', py.IIAPI_VCH_TYPE, 34, nullable=True ),
+        loopback.Column( 'amount', py.IIAPI_FLT_TYPE, 8 ),
+        loopback.Column( 'price', py.IIAPI_MNY_TYPE, 8 ),
+        loopback.Column( 'cost', py.IIAPI_DEC_TYPE, 4, 7, 2, nullable=True ),
+    ], 250 )
+    reader = arrow.reader( query(QUERY), rowCount=100 )
+    assert reader.schema.names == ['id', 'name', 'amount', 'price', 'cost']
+    assert reader.schema.field( 'id' ).type == pa.int32()
+    assert reader.schema.field( 'price' ).type == pa.decimal128( 14, 2 )
+    batches = list(reader)
+    assert [batch.num_rows for batch in batches] == [100, 100, 50]
+
+    ##  the same values as RowSet.values()
+    table = pa.Table.from_batches( batches )
+    values = []
+    for rowset in py.fetch( query(QUERY) ):
+        values.extend( rowset.values() )
+    assert list(zip(*(column.to_pylist() for column in table.columns))) \
+        == values
+    assert table.column( 'name' ).null_count == 35
+    assert values[0][3] == decimal.Decimal( '0.25' )
+
+
+def test_no_result( query ):
+    reader = arrow.reader( query(b'DELETE FROM t') )
+    assert reader.read_all().num_rows == 0
@@ -0,0 +1,56 @@
+##  Copyright (c) 2024 Rational Commerce Ltd.
+
+'''executemany(), and how it cancels a batch that fails'''
+
+
+import pytest
+import pyngres.blocking as py
+from pyngres import arena, loopback
+from pyngres.errors import OpenAPIError
+
+
+INSERT = b'INSERT INTO t VALUES (?, ?)'
+
+
+def test_executemany( connHandle, statements ):
+    loopback.configure( capture=True )
+    rows = [(i, f'x{i}') for i in range(2500)]
+    results = py.executemany( connHandle, INSERT, rows, batchSize=1000 )
+    assert len(results) == 2500
+    assert results.rows == 2500
+    assert results.failures() == []
+    assert loopback.calls['IIapi_batch'] == 2500
+    assert len(loopback.captured) == 2500
+    assert loopback.captured[-1][1] == b'\x05\x00x2499'
+    assert statements() == []
+    ##  the Parameters went back to the arena
+    assert arena.shared.stats()['free'] == 1
+
+
+def test_bad_value( connHandle, statements ):
+    ##  a value that can't be sent cancels the batch it is in
+    with pytest.raises( Exception ):
+        py.executemany( connHandle, INSERT, [(1, 'a'), (2, 'b'),
+            (object(), 'c')], batchSize=10 )
+    assert loopback.calls['IIapi_cancel'] == 1
+    assert statements() == []
+    assert arena.shared.stats()['free'] == 1
+    ##  and the connection can be used again
+    results = py.executemany( connHandle, INSERT, [(1, 'a')] )
+    assert len(results) == 1
+
+
+def test_failed_batch( connHandle, statements ):
+    loopback.fail( INSERT, 'table t does not exist' )
+    with pytest.raises( OpenAPIError ) as info:
+        py.executemany( connHandle, INSERT, [(1, 'a'), (2, 'b')] )
+    assert info.value.messages[0][0] == '42000'
+    ##  the first IIapi_batch() failed, so there was no batch to cancel
+    assert 'IIapi_cancel' not in loopback.calls
+    assert statements() == []
+
+
+def test_rows_without_parameters( connHandle ):
+    results = py.executemany( connHandle, b'DELETE FROM t', [(), ()] )
+    assert len(results) == 2
+    assert 'IIapi_putParms' not in loopback.calls
@@ -0,0 +1,123 @@
+##  Copyright (c) 2024 Rational Commerce Ltd.
+
+'''PreparedCache and RepeatCache, and how they are invalidated'''
+
+
+import pytest
+import pyngres.blocking as py
+from pyngres import loopback
+from pyngres.errors import OpenAPIError
+from pyngres.prepared import PreparedCache
+from pyngres.repeat import RepeatCache
+
+
+SELECT = b'SELECT * FROM t WHERE id > ?'
+INSERT = b'INSERT INTO t VALUES (?, ?)'
+
+
+def commit( tranHandle ):
+    cmp = py.IIAPI_COMMITPARM()
+    cmp.cm_tranHandle = tranHandle
+    py.IIapi_commit( cmp )
+    assert cmp.cm_genParm.gp_status == py.IIAPI_ST_SUCCESS
+
+
+def test_prepared_once_per_transaction( connHandle ):
+    cache = PreparedCache( connHandle )
+    rows = []
+    result = py.execute_prepared( cache, SELECT, (1,),
+        sink=lambda rowset: rows.extend( rowset.values() ) )
+    for i in range(3):
+        result = py.execute_prepared( cache, SELECT, (i,),
+            tranHandle=result.tranHandle,
+            sink=lambda rowset: rows.extend( rowset.values() ) )
+    assert (cache.misses, cache.hits) == (1, 3)
+    assert len(rows) == 4 * 100
+    ##  the RowSet is kept with the statement
+    assert cache.statements[SELECT].rowset is not None
+
+    ##  the DBMS discards it at the end of the transaction, so it is
+    ##  prepared again in the next one
+    commit( result.tranHandle )
+    result = py.execute_prepared( cache, SELECT, (1,) )
+    assert (cache.misses, cache.hits) == (2, 3)
+    commit( result.tranHandle )
+
+
+def test_invalidate( connHandle ):
+    cache = PreparedCache( connHandle, perTransaction=False )
+    result = py.execute_prepared( cache, INSERT, ('a', 1) )
+    result = py.execute_prepared( cache, INSERT, ('b', 2),
+        tranHandle=result.tranHandle )
+    assert (cache.misses, cache.hits) == (1, 1)
+    cache.invalidate()
+    result = py.execute_prepared( cache, INSERT, ('c', 3),
+        tranHandle=result.tranHandle )
+    assert (cache.misses, cache.hits) == (2, 1)
+    assert result.rowCount == 1
+
+
+def test_prepared_eviction( connHandle ):
+    cache = PreparedCache( connHandle, size=2 )
+    result = py.execute_prepared( cache, b'SELECT * FROM a' )
+    for queryText in (b'SELECT * FROM b', b'SELECT * FROM c'):
+        result = py.execute_prepared( cache, queryText,
+            tranHandle=result.tranHandle )
+    assert cache.evictions == 1
+    assert b'SELECT * FROM a' not in cache
+    ##  the evicted name is reused
+    assert cache.statements[b'SELECT * FROM c'].name == b'pyngres_s0'
+
+
+def test_failed_prepare_is_discarded( connHandle ):
+    loopback.fail( b'PREPARE pyngres_s0 FROM SELECT * FROM nowhere',
+        'table nowhere does not exist' )
+    cache = PreparedCache( connHandle )
+    with pytest.raises( OpenAPIError ):
+        py.execute_prepared( cache, b'SELECT * FROM nowhere' )
+    assert len(cache) == 0
+
+
+def test_repeated( connHandle ):
+    cache = RepeatCache( connHandle )
+    rows = []
+    result = None
+    for i in range(3):
+        result = py.execute_repeated( cache, SELECT, (i,),
+            tranHandle=result and result.tranHandle,
+            sink=lambda rowset: rows.extend( rowset.values() ) )
+    assert (cache.misses, cache.hits) == (1, 2)
+    assert len(rows) == 3 * 100
+    ##  repeat queries outlive the transaction
+    commit( result.tranHandle )
+    py.execute_repeated( cache, SELECT, (1,) )
+    assert (cache.misses, cache.hits) == (1, 3)
+
+
+def test_repeated_flushed( connHandle ):
+    cache = RepeatCache( connHandle )
+    result = py.execute_repeated( cache, INSERT, ('a', 1) )
+    result = py.execute_repeated( cache, SELECT, (1,),
+        tranHandle=result.tranHandle )
+    ##  the DBMS forgets every repeat query: the next one executed is
+    ##  defined again, and so is the other when it is next executed
+    loopback.flush_repeated()
+    result = py.execute_repeated( cache, INSERT, ('b', 2),
+        tranHandle=result.tranHandle )
+    assert cache.flushes == 1
+    assert cache.redefinitions == 1
+    assert result.rowCount == 1
+    assert cache.statements[SELECT].handle is None
+    result = py.execute_repeated( cache, SELECT, (1,),
+        tranHandle=result.tranHandle )
+    assert cache.statements[SELECT].handle is not None
+    assert cache.redefinitions == 1
+
+
+def test_repeated_flush( connHandle ):
+    cache = RepeatCache( connHandle )
+    result = py.execute_repeated( cache, INSERT, ('a', 1) )
+    cache.flush()
+    py.execute_repeated( cache, INSERT, ('b', 2),
+        tranHandle=result.tranHandle )
+    assert (cache.misses, cache.hits) == (2, 0)
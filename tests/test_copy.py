@@ -0,0 +1,96 @@
+##  Copyright (c) 2024 Rational Commerce Ltd.
+
+'''copy_from() and copy_into()'''
+
+
+import decimal
+import struct
+import pytest
+import pyngres.blocking as py
+from pyngres import datatypes, loopback
+from pyngres.copy import from_columns
+
+
+COPY_FROM = b'COPY TABLE t () FROM PROGRAM'
+COPY_INTO = b'COPY TABLE t () INTO PROGRAM'
+
+
+def columns():
+    return [
+        loopback.Column( 'id', py.IIAPI_INT_TYPE, 8 ),
+        loopback.Column( 'name', py.IIAPI_VCH_TYPE, 22, nullable=True ),
+        loopback.Column( 'code', py.IIAPI_CHA_TYPE, 6 ),
+        loopback.Column( 'cost', py.IIAPI_DEC_TYPE, 4, 7, 2 ),
+        loopback.Column( 'price', py.IIAPI_MNY_TYPE, 8 ),
+        loopback.Column( 'flag', py.IIAPI_BOOL_TYPE, 1 ),
+        loopback.Column( 'ratio', py.IIAPI_FLT_TYPE, 4 ),
+    ]
+
+
+def row( i ):
+    return (i, None if i % 3 else f'n{i}', 'ab', decimal.Decimal('-12.34'),
+        decimal.Decimal('1.25'), bool(i % 2), 0.5)
+
+
+def test_copy_from( connHandle ):
+    loopback.define( COPY_FROM, columns(), 0 )
+    loopback.configure( capture=True )
+    result = py.copy_from( connHandle, COPY_FROM, [row(i) for i in range(1000)],
+        rowCount=300 )
+    assert result.rowCount == 1000
+    ##  many rows to each IIapi_putColumns()
+    assert loopback.calls['IIapi_putColumns'] == 4
+    assert len(loopback.captured) == 1000
+    for i in (0, 1, 999):
+        (id, name, code, cost, price, flag,
+            ratio) = loopback.captured[i]
+        assert struct.unpack( '=q', id )[0] == i
+        if i % 3:
+            assert name is None
+        else:
+            assert name == struct.pack( '=H', len(f'n{i}') ) + f'n{i}'.encode()
+        assert code == b'ab    '
+        assert datatypes.decimal_value( cost, 7, 2 ) == decimal.Decimal(
+            '-12.34' )
+        assert struct.unpack( '=d', price )[0] == 125.0
+        assert flag == bytes((i % 2,))
+        assert struct.unpack( '=f', ratio )[0] == 0.5
+
+
+def test_copy_from_columns( connHandle ):
+    loopback.define( COPY_FROM, columns()[:2], 0 )
+    loopback.configure( capture=True )
+    result = py.copy_from( connHandle, COPY_FROM,
+        from_columns([[1, 2, 3], ['a', None, 'c']]) )
+    assert result.rowCount == 3
+    assert [value[1] for value in loopback.captured] == [b'\x01\x00a', None,
+        b'\x01\x00c']
+
+
+def test_copy_from_bad_row( connHandle, statements ):
+    loopback.define( COPY_FROM, columns(), 0 )
+    ##  a NULL in a column that isn't nullable cancels the COPY
+    with pytest.raises( ValueError ):
+        py.copy_from( connHandle, COPY_FROM, [(None,) * 7] )
+    assert loopback.calls['IIapi_cancel'] == 1
+    assert statements() == []
+
+
+def test_copy_into( connHandle ):
+    loopback.define( COPY_INTO, columns()[:2], 250 )
+    rows = []
+    batches = []
+    result = py.copy_into( connHandle, COPY_INTO,
+        lambda rowset: (batches.append( rowset.rowsReturned ),
+        rows.extend( rowset.values() )), rowCount=100 )
+    assert result.rowCount == 250
+    assert batches == [100, 100, 50]
+    assert rows == [(i, None if i % 7 == 6 else f'row {i}')
+        for i in range(250)]
+
+
+def test_copy_direction( connHandle, statements ):
+    loopback.define( COPY_FROM, columns(), 0 )
+    with pytest.raises( ValueError ):
+        py.copy_into( connHandle, COPY_FROM, lambda rowset: None )
+    assert statements() == []
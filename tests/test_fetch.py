@@ -0,0 +1,97 @@
+##  Copyright (c) 2024 Rational Commerce Ltd.
+
+'''fetch(), RowSet.values() and RowSet.views()'''
+
+
+import decimal
+import pickle
+import pytest
+import pyngres.blocking as py
+from pyngres import arena, loopback
+
+
+QUERY = b'SELECT * FROM t'
+
+
+def define( rows ):
+    loopback.define( QUERY, [
+        loopback.Column( 'id', py.IIAPI_INT_TYPE, 4 ),
+        loopback.Column( 'name', py.IIAPI_VCH_TYPE, 34, nullable=True ),
+        loopback.Column( 'amount', py.IIAPI_MNY_TYPE, 8 ),
+        loopback.Column( 'flag', py.IIAPI_BOOL_TYPE, 1 ),
+    ], rows )
+
+
+def expected( row ):
+    return (row, None if row % 7 == 6 else f'row {row}',
+        decimal.Decimal(row * 100 + 25).scaleb( -2 ), bool(row % 2))
+
+
+def test_values( query ):
+    define( 250 )
+    rows = []
+    batches = 0
+    for rowset in py.fetch( query(QUERY), rowCount=100 ):
+        batches += 1
+        rows.extend( rowset.values() )
+    assert batches == 3
+    assert rows == [expected(row) for row in range(250)]
+
+
+def test_empty_result( query ):
+    define( 0 )
+    assert list(py.fetch( query(QUERY) )) == []
+
+
+def test_fetch_releases_the_rowset( query ):
+    define( 10 )
+    rowsets = arena.Arena()
+    for rowset in py.fetch( query(QUERY), arena=rowsets ):
+        pass
+    assert rowsets.stats()['free'] == 1
+    for again in py.fetch( query(QUERY), arena=rowsets ):
+        assert again is rowset
+    assert rowsets.stats()['allocations'] == {'rowset': 1}
+    assert rowsets.stats()['reuses'] == {'rowset': 1}
+    ##  a RowSet can only be released once
+    with pytest.raises( ValueError ):
+        rowsets.release( rowset )
+
+
+def test_views_match_values( query ):
+    define( 20 )
+    for rowset in py.fetch( query(QUERY) ):
+        with rowset.views() as views:
+            for view, values in zip(views, rowset.values()):
+                assert int.from_bytes( view[0], 'little',
+                    signed=True ) == values[0]
+                if values[1] is None:
+                    assert view[1] is None
+                else:
+                    assert bytes(view[1])[2:].decode() == values[1]
+
+
+def test_views_are_released_before_the_next_batch( query ):
+    define( 20 )
+    kept = []
+    for rowset in py.fetch( query(QUERY), rowCount=10 ):
+        views = rowset.views()
+        kept.append( views )
+        assert len(views) == 10
+    assert all(views.released for views in kept)
+    with pytest.raises( ValueError ):
+        kept[0][0]
+    with pytest.raises( ValueError ):
+        iter(kept[-1])
+
+
+def test_views_in_use( query ):
+    define( 20 )
+    batches = py.fetch( query(QUERY), rowCount=10 )
+    rowset = next(batches)
+    ##  a PickleBuffer keeps the view exported, so it can't be released
+    exported = pickle.PickleBuffer( rowset.views()[0][0] )
+    with pytest.raises( BufferError ):
+        next(batches)
+    ##  the RowSet isn't refilled under the export
+    assert exported.raw().tobytes() == (0).to_bytes( 4, 'little' )
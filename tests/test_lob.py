@@ -0,0 +1,92 @@
+##  Copyright (c) 2024 Rational Commerce Ltd.
+
+'''pyngres.lob.fetch(): seek() and readinto() across segments'''
+
+
+import io
+import pytest
+import pyngres.blocking as py
+from pyngres import lob, loopback
+
+
+QUERY = b'SELECT * FROM docs'
+
+##  longer than a few segments
+SIZE = 5 * py.IIAPI_SEGMENT_LEN + 123
+
+
+@pytest.fixture
+def docs( query ):
+    columns = [
+        loopback.Column( 'id', py.IIAPI_INT_TYPE, 4 ),
+        loopback.Column( 'doc', py.IIAPI_LBYTE_TYPE, SIZE, nullable=True ),
+        loopback.Column( 'name', py.IIAPI_VCH_TYPE, 20 ),
+    ]
+    loopback.define( QUERY, columns, 8 )
+    return columns[1].value, query( QUERY )
+
+
+def test_read( docs ):
+    value, stmtHandle = docs
+    rows = 0
+    for row in lob.fetch( stmtHandle ):
+        id = row[0]
+        reader = row[1]
+        if id % 7 == 6:
+            assert reader is None
+        else:
+            assert reader.read() == value( id )
+        ##  the short columns are decoded
+        assert row[2] == f'row {id}'
+        rows += 1
+    assert rows == 8
+
+
+def test_readinto( docs ):
+    value, stmtHandle = docs
+    row = next(iter(lob.fetch( stmtHandle )))
+    reader = row[1]
+    ##  a buffer smaller than a segment, and one spanning several
+    buffer = bytearray(100)
+    assert reader.readinto( buffer ) == 100
+    assert bytes(buffer) == value( 0 )[:100]
+    buffer = bytearray(3 * py.IIAPI_SEGMENT_LEN)
+    assert reader.readinto( buffer ) == len(buffer)
+    assert bytes(buffer) == value( 0 )[100:100 + len(buffer)]
+    assert reader.tell() == 100 + len(buffer)
+    rest = bytearray(SIZE)
+    count = reader.readinto( rest )
+    assert 100 + len(buffer) + count == SIZE
+    assert reader.readinto( rest ) == 0
+
+
+def test_seek( docs ):
+    value, stmtHandle = docs
+    row = next(iter(lob.fetch( stmtHandle )))
+    reader = row[1]
+    offset = 2 * py.IIAPI_SEGMENT_LEN + 10
+    assert reader.seek( offset ) == offset
+    assert reader.read( 10 ) == value( 0 )[offset:offset + 10]
+    assert reader.seek( 5, io.SEEK_CUR ) == offset + 15
+    assert reader.read( 5 ) == value( 0 )[offset + 15:offset + 20]
+    with pytest.raises( io.UnsupportedOperation ):
+        reader.seek( 0 )
+    with pytest.raises( io.UnsupportedOperation ):
+        reader.seek( 0, io.SEEK_END )
+    ##  seeking past the end stops at the end
+    assert reader.seek( 2 * SIZE ) == SIZE
+    assert reader.read() == b''
+
+
+def test_passed_column( docs ):
+    value, stmtHandle = docs
+    rows = iter(lob.fetch( stmtHandle ))
+    row = next(rows)
+    reader = row[1]
+    assert reader.read( 10 ) == value( 0 )[:10]
+    ##  getting a later column discards the rest of the long one
+    assert row[2] == 'row 0'
+    with pytest.raises( ValueError ):
+        reader.read( 10 )
+    row = next(rows)
+    assert row[1].read() == value( 1 )
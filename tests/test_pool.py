@@ -0,0 +1,113 @@
+##  Copyright (c) 2024 Rational Commerce Ltd.
+
+'''Pool and AsyncPool: validation and recycling'''
+
+
+import asyncio
+import pytest
+import pyngres.blocking as py
+from pyngres import loopback
+from pyngres.errors import OpenAPIError
+from pyngres.pool import Pool, AsyncPool
+
+
+def error( SQLSTATE, status=py.IIAPI_ST_ERROR ):
+    return OpenAPIError( 'IIapi_query', status, [(SQLSTATE, 1, 'error')] )
+
+
+def test_reuse( envHandle ):
+    pool = Pool( b'db', envHandle, size=2 )
+    pool.warm()
+    assert pool.metrics.connects == 2
+    with pool.connection() as connection:
+        connHandle = connection.connHandle
+    with pool.connection() as connection:
+        assert connection.connHandle == connHandle
+    assert pool.metrics.checkouts == 2
+    assert pool.metrics.connects == 2
+    pool.close()
+
+
+def test_validation( envHandle ):
+    pool = Pool( b'db', envHandle, size=1, checkIdle=0 )
+    with pool.connection() as connection:
+        connHandle = connection.connHandle
+    ##  an idle connection is validated before it is handed out again
+    with pool.connection() as connection:
+        assert connection.connHandle == connHandle
+    assert pool.metrics.validations == 1
+    assert pool.metrics.aborts == 0
+
+    ##  one that fails validation is recycled and replaced
+    loopback.fail( b'SELECT 1', 'connection lost', '08006' )
+    with pool.connection() as connection:
+        assert connection.connHandle != connHandle
+    assert pool.metrics.validations == 2
+    assert pool.metrics.aborts == 1
+    assert pool.metrics.connects == 2
+    assert connHandle not in loopback._handles
+    pool.close()
+
+
+@pytest.mark.parametrize( 'exception, kept', [
+    (error( '42000' ), True),
+    (error( '08006' ), False),
+    (error( '42000', py.IIAPI_ST_FAILURE ), False),
+] )
+def test_recycling( envHandle, exception, kept ):
+    pool = Pool( b'db', envHandle, size=1 )
+    with pytest.raises( OpenAPIError ):
+        with pool.connection() as connection:
+            connHandle = connection.connHandle
+            raise exception
+    with pool.connection() as connection:
+        assert (connection.connHandle == connHandle) == kept
+    assert pool.metrics.aborts == (0 if kept else 1)
+    pool.close()
+
+
+def test_rollback( envHandle ):
+    ##  a transaction left open is rolled back when the connection is
+    ##  released
+    pool = Pool( b'db', envHandle, size=1 )
+    with pool.connection() as connection:
+        qyp = py.IIAPI_QUERYPARM()
+        qyp.qy_connHandle = connection.connHandle
+        qyp.qy_queryType = py.IIAPI_QT_QUERY
+        qyp.qy_queryText = b'DELETE FROM t'
+        qyp.qy_tranHandle = None
+        py.IIapi_query( qyp )
+        connection.tranHandle = qyp.qy_tranHandle
+    assert loopback.calls['IIapi_rollback'] == 1
+    assert qyp.qy_tranHandle not in loopback._handles
+    assert connection.tranHandle is None
+    pool.close()
+
+
+def test_timeout( envHandle ):
+    pool = Pool( b'db', envHandle, size=1 )
+    connection = pool.acquire()
+    with pytest.raises( TimeoutError ):
+        pool.acquire( timeout=0.01 )
+    pool.release( connection )
+    pool.close()
+    with pytest.raises( RuntimeError ):
+        pool.acquire()
+
+
+def test_async( envHandle ):
+    async def main():
+        pool = AsyncPool( b'db', envHandle, size=1, checkIdle=0 )
+        with pytest.raises( OpenAPIError ):
+            async with pool.connection() as connection:
+                connHandle = connection.connHandle
+                raise error( '23000' )
+        async with pool.connection() as connection:
+            assert connection.connHandle == connHandle
+        loopback.fail( b'SELECT 1', 'connection lost', '08006' )
+        async with pool.connection() as connection:
+            assert connection.connHandle != connHandle
+        assert pool.metrics.validations == 2
+        assert pool.metrics.aborts == 1
+        await pool.close()
+    asyncio.run( main() )